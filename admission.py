@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+推理请求准入控制
+限制同时推理的请求数量，超出部分排队等待，队列满时快速拒绝
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import HTTPException, status
+
+
+class AdmissionController:
+    """有界并发 + 有界等待队列"""
+
+    def __init__(
+        self,
+        max_in_flight: int = 1,
+        max_queue: int = 16,
+        queue_timeout: float = 60.0,
+        retry_after: int = 5,
+    ):
+        """
+        Args:
+            max_in_flight: 同时推理的最大请求数
+            max_queue: 等待队列的最大长度
+            queue_timeout: 排队等待的最长时间（秒）
+            retry_after: 拒绝时建议客户端重试的间隔（秒）
+        """
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.queue_timeout = queue_timeout
+        self.retry_after = retry_after
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self._in_flight = 0
+        self._waiting = 0
+
+    @property
+    def in_flight(self) -> int:
+        """正在推理的请求数"""
+        return self._in_flight
+
+    @property
+    def waiting(self) -> int:
+        """排队等待的请求数"""
+        return self._waiting
+
+    def _reject(self, status_code: int, detail: str) -> HTTPException:
+        return HTTPException(
+            status_code=status_code,
+            detail=detail,
+            headers={"Retry-After": str(self.retry_after)},
+        )
+
+    async def acquire(self):
+        """申请推理名额，队列已满时抛出 429，排队超时抛出 503"""
+        if self._in_flight + self._waiting >= self.max_in_flight + self.max_queue:
+            raise self._reject(status.HTTP_429_TOO_MANY_REQUESTS, "服务繁忙，请求队列已满，请稍后重试")
+
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            raise self._reject(status.HTTP_503_SERVICE_UNAVAILABLE, "排队等待超时，请稍后重试")
+        finally:
+            self._waiting -= 1
+        self._in_flight += 1
+
+    def release(self):
+        """归还推理名额"""
+        self._in_flight -= 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        """在 async with 块内持有一个推理名额"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        """当前负载状态"""
+        return {
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+        }
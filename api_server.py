@@ -4,44 +4,113 @@
 提供 RESTful API 接口
 """
 
+import asyncio
+import codecs
+import json
 import os
-import re
-import yaml
-from typing import List, Optional
+import tempfile
+import time
+import urllib.parse
+import uuid
+from typing import TYPE_CHECKING, AsyncIterator, Callable, List, Optional, Tuple
 from contextlib import asynccontextmanager
 from pathlib import Path
 
 import uvicorn
-from fastapi import FastAPI, HTTPException, status
+from fastapi import FastAPI, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
-from pydantic import BaseModel, Field
-
-# 设置环境变量
-os.environ["CUDA_VISIBLE_DEVICES"] = "0"
-
-from llamafactory.chat import ChatModel
-
-
-# 配置文件路径
-CONFIG_FILE = Path(__file__).parent / "config_models.yaml"
-
-
-def load_model_config():
-    """从配置文件加载模型配置"""
-    try:
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            config = yaml.safe_load(f)
-            current_id = config.get('current_model', 'qwen-7b')
-            models = config.get('models', {})
-            if current_id in models:
-                return models[current_id]
-            else:
-                print(f"⚠️  警告: 模型 '{current_id}' 不存在，使用默认配置")
-                return {}
-    except Exception as e:
-        print(f"⚠️  警告: 无法加载配置文件，使用默认配置: {e}")
-        return {}
+from fastapi.responses import FileResponse, PlainTextResponse, StreamingResponse
+from fastapi.exceptions import RequestValidationError
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from sse_starlette.sse import EventSourceResponse
+
+# 设置环境变量（没有 GPU 的机器可设为空，模型条目用 device: cpu 选择 CPU 推理）
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "0")
+
+from admission import AdmissionController
+from cpu_backend import is_cpu
+from document_analysis import DocumentScanner, ReferenceCounter, create_pool
+from law_links import StreamingLawLinker, add_law_links, iter_citations, search_url
+from lora_adapters import LoRAAdapterPool
+from merged_cache import MergedCheckpointCache
+from metrics import CONTENT_TYPE, TOKEN_RATE_BUCKETS, MetricsRegistry, process_rss_bytes
+from model_registry import ModelHandle, ModelRegistry
+from response_cache import ResponseCache, make_cache_key
+from retrieval import StatuteIndex, ground_messages
+from sessions import KVCacheStore, SessionStore
+from similar_cache import SimilarQuestionIndex
+from startup import PhaseTimer
+from statutes import StatuteStore, normalize_law_name, parse_article
+
+if TYPE_CHECKING:
+    # batching 依赖 torch 与 transformers，在加载模型时才导入，服务启动时无需等待
+    from batching import BatchScheduler
+
+
+# 模型热切换配置
+ADMIN_TOKEN = os.environ.get("API_ADMIN_TOKEN", "")
+DRAIN_TIMEOUT = float(os.environ.get("API_DRAIN_TIMEOUT", "300"))
+CONFIG_POLL_INTERVAL = float(os.environ.get("API_CONFIG_POLL_INTERVAL", "0"))
+
+# 多模型驻留配置：已加载模型的内存预算（GB），0 表示不限制
+MODEL_MEMORY_GB = float(os.environ.get("API_MODEL_MEMORY_GB", "0"))
+
+# 连续批处理配置
+BATCHING_ENABLED = os.environ.get("API_BATCHING", "false").lower() in ("1", "true", "yes")
+MAX_BATCH_SIZE = int(os.environ.get("API_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_TOKENS = int(os.environ.get("API_MAX_BATCH_TOKENS", "8192"))
+
+# 多 LoRA 配置：基座相同的 LoRA 模型共享一份基座权重（自动启用连续批处理调度器）
+MULTI_LORA_ENABLED = os.environ.get("API_MULTI_LORA", "false").lower() in ("1", "true", "yes")
+MAX_LORA_ADAPTERS = int(os.environ.get("API_MAX_LORA_ADAPTERS", "8"))
+
+# LoRA 合并权重缓存：LoRA 模型首次加载时合并并保存，之后直接加载合并好的权重，为空时不缓存
+MERGED_CACHE_DIR = os.environ.get("API_MERGED_CACHE_DIR", "")
+MERGED_CACHE_GB = float(os.environ.get("API_MERGED_CACHE_GB", "64"))
+
+# 回复缓存配置（默认关闭）
+CACHE_ENABLED = os.environ.get("API_RESPONSE_CACHE", "false").lower() in ("1", "true", "yes")
+CACHE_MAX_ENTRIES = int(os.environ.get("API_CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL = float(os.environ.get("API_CACHE_TTL", "86400"))
+CACHE_DB = os.environ.get("API_CACHE_DB", "")
+CACHE_MAX_TEMPERATURE = float(os.environ.get("API_CACHE_MAX_TEMPERATURE", "0.3"))
+
+# 近似问题缓存配置（默认关闭）
+SIMILAR_CACHE_ENABLED = os.environ.get("API_SIMILAR_CACHE", "false").lower() in ("1", "true", "yes")
+SIMILAR_THRESHOLD = float(os.environ.get("API_SIMILAR_THRESHOLD", "0.8"))
+SIMILAR_MAX_ENTRIES = int(os.environ.get("API_SIMILAR_MAX_ENTRIES", "10000"))
+SIMILAR_PATH = os.environ.get("API_SIMILAR_PATH", "")
+
+# 服务端会话配置（KV 缓存复用需开启连续批处理）
+MAX_SESSIONS = int(os.environ.get("API_MAX_SESSIONS", "10000"))
+SESSION_TTL = float(os.environ.get("API_SESSION_TTL", "3600"))
+SESSION_KV_MB = int(os.environ.get("API_SESSION_KV_MB", "2048"))
+
+# 并发与排队配置（开启批处理时默认并发数与批大小一致）
+MAX_CONCURRENCY = int(os.environ.get(
+    "API_MAX_CONCURRENCY", str(MAX_BATCH_SIZE if BATCHING_ENABLED or MULTI_LORA_ENABLED else 1)
+))
+MAX_QUEUE = int(os.environ.get("API_MAX_QUEUE", "16"))
+QUEUE_TIMEOUT = float(os.environ.get("API_QUEUE_TIMEOUT", "60"))
+RETRY_AFTER = int(os.environ.get("API_RETRY_AFTER", "5"))
+
+# 批量对话：同时处理的对话数（默认与推理并发数一致），上传内容超出内存上限时写入临时文件
+BATCH_CONCURRENCY = int(os.environ.get("API_BATCH_CONCURRENCY", str(MAX_CONCURRENCY)))
+BATCH_SPOOL_MB = int(os.environ.get("API_BATCH_SPOOL_MB", "8"))
+
+# 大文档分析：扫描用的进程数（0 表示在线程中扫描），默认保留一个 CPU 给服务本身
+ANALYZE_WORKERS = int(os.environ.get("API_ANALYZE_WORKERS", str(min(4, (os.cpu_count() or 1) - 1))))
+# NDJSON 上传时每行需整行读入后解析，单行超过该大小时返回 413
+ANALYZE_MAX_LINE_MB = int(os.environ.get("API_ANALYZE_MAX_LINE_MB", "64"))
+
+# 本地法规库（python statutes.py import 导入），为空时法规引用只返回搜索链接
+STATUTE_DB = os.environ.get("API_STATUTE_DB", "")
+STATUTE_CACHE_SIZE = int(os.environ.get("API_STATUTE_CACHE_SIZE", "4096"))
+
+# 条文检索（python retrieval.py build 生成索引）：生成前检索 top-k 条文注入本轮问题，为空时不检索
+STATUTE_INDEX = os.environ.get("API_STATUTE_INDEX", "")
+RETRIEVAL_TOP_K = int(os.environ.get("API_RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MAX_TOKENS = int(os.environ.get("API_RETRIEVAL_MAX_TOKENS", "1024"))
 
 
 # 请求和响应模型
@@ -52,123 +121,333 @@ class Message(BaseModel):
 
 class ChatRequest(BaseModel):
     messages: List[Message] = Field(..., description="对话历史消息列表")
+    model: Optional[str] = Field(None, description="模型 ID 或名称（见 /v1/models），为空时使用默认模型")
     temperature: float = Field(0.8, ge=0.1, le=2.0, description="温度参数")
     max_tokens: int = Field(512, ge=64, le=1024, description="最大生成长度")
     top_p: float = Field(0.9, ge=0.1, le=1.0, description="Top-p 采样参数")
     stream: bool = Field(False, description="是否使用流式输出")
     enable_law_links: bool = Field(True, description="是否启用法规超链接")
+    session_id: Optional[str] = Field(None, description="会话 ID：服务端保存对话历史，messages 只需包含本轮新消息")
+
+
+class BatchChatItem(ChatRequest):
+    id: str = Field(..., description="调用方的对话 ID，原样返回在结果中")
 
 
 class ChatResponse(BaseModel):
     role: str = Field(default="assistant", description="回复角色")
     content: str = Field(..., description="回复内容")
     law_references: List[dict] = Field(default_factory=list, description="法规引用列表")
+    session_id: Optional[str] = Field(None, description="会话 ID")
+    context: Optional[dict] = Field(None, description="提示 token 数、历史截断情况与注入的检索条文（命中缓存时为空）")
 
 
 class LawReference(BaseModel):
     text: str = Field(..., description="法规文本")
-    link: str = Field(..., description="搜索链接")
+    link: str = Field(..., description="本地法规库链接或搜索链接")
+    law: Optional[str] = Field(None, description="条文所属法规（仅本地法规库命中时）")
+    article: Optional[int] = Field(None, description="条号（仅本地法规库命中时）")
+    content: Optional[str] = Field(None, description="条文内容（仅本地法规库命中时）")
 
 
 # 全局变量
-chat_model: Optional[ChatModel] = None
-
-
-# 法规关键词提取配置
-LAW_PATTERNS = [
-    r'第[一二三四五六七八九十百千万零]+条',
-    r'第[0-9]+条',
-    r'第[一二三四五六七八九十百千万零]+款',
-    r'第[0-9]+款',
-    r'第[一二三四五六七八九十百千万零]+项',
-    r'第[0-9]+项',
-    r'《[^》]+法》',
-    r'《[^》]+条例》',
-    r'《[^》]+规定》',
-    r'《[^》]+办法》',
-    r'《[^》]+细则》',
-    r'《[^》]+解释》',
-    r'《[^》]+编》',  # 新增行，用于匹配以“编》”结尾的法规名称
-]
+response_cache: Optional[ResponseCache] = (
+    ResponseCache(
+        max_entries=CACHE_MAX_ENTRIES,
+        ttl=CACHE_TTL,
+        db_path=CACHE_DB or None,
+        max_temperature=CACHE_MAX_TEMPERATURE,
+    )
+    if CACHE_ENABLED else None
+)
+session_store = SessionStore(max_sessions=MAX_SESSIONS, ttl=SESSION_TTL)
+similar_index: Optional[SimilarQuestionIndex] = (
+    SimilarQuestionIndex(
+        threshold=SIMILAR_THRESHOLD,
+        max_entries=SIMILAR_MAX_ENTRIES,
+        path=SIMILAR_PATH or None,
+        max_temperature=CACHE_MAX_TEMPERATURE,
+    )
+    if SIMILAR_CACHE_ENABLED else None
+)
+admission = AdmissionController(
+    max_in_flight=MAX_CONCURRENCY,
+    max_queue=MAX_QUEUE,
+    queue_timeout=QUEUE_TIMEOUT,
+    retry_after=RETRY_AFTER,
+)
+analysis_pool = None  # 大文档分析的进程池，启动时在加载模型之前创建
+analysis_pool_lock = asyncio.Lock()
+startup_timer = PhaseTimer()  # 启动各阶段计时，模块导入时开始
+model_loader: Optional[asyncio.Task] = None
+config_watcher: Optional[asyncio.Task] = None
+statute_store: Optional[StatuteStore] = (
+    StatuteStore(STATUTE_DB, cache_size=STATUTE_CACHE_SIZE) if STATUTE_DB else None
+)
+statute_index: Optional[StatuteIndex] = StatuteIndex(STATUTE_INDEX) if STATUTE_INDEX else None
+
+# Prometheus 指标：请求路径上只做计数与分桶累加，队列、模型与内存等状态在抓取时读取
+metrics = MetricsRegistry()
+chat_requests = metrics.counter(
+    "lawyer_chat_requests_total", "对话请求数（按模型、是否流式与状态码）", ("model", "stream", "status"))
+chat_latency = metrics.histogram(
+    "lawyer_chat_request_duration_seconds", "对话请求端到端耗时（秒，含排队）", ("model", "stream"))
+chat_ttft = metrics.histogram(
+    "lawyer_chat_time_to_first_token_seconds", "流式请求首个 token 的耗时（秒，含排队）", ("model",))
+chat_token_rate = metrics.histogram(
+    "lawyer_chat_generation_tokens_per_second", "每个请求的生成速度（token/秒）", ("model",),
+    buckets=TOKEN_RATE_BUCKETS)
+chat_prompt_tokens = metrics.counter(
+    "lawyer_chat_prompt_tokens_total", "提示 token 数（仅非流式请求）", ("model",))
+chat_completion_tokens = metrics.counter(
+    "lawyer_chat_completion_tokens_total", "生成 token 数", ("model",))
+retrieval_latency = metrics.histogram(
+    "lawyer_retrieval_duration_seconds", "条文检索耗时（秒）",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1))
 
 
 def extract_law_references(text: str) -> List[LawReference]:
-    """提取文本中的法规引用"""
-    law_refs = []
-    seen = set()  # 避免重复
+    """
+    提取文本中的法规引用
 
-    for pattern in LAW_PATTERNS:
-        matches = re.finditer(pattern, text)
-        for match in matches:
-            law_text = match.group()
-            if law_text not in seen:
-                seen.add(law_text)
-                search_url = f"https://www.baidu.com/s?wd={law_text}"
-                law_refs.append(LawReference(text=law_text, link=search_url))
+    配置了本地法规库时，“第X条”按其前面最近引用的法规查询条文内容，命中的条文链接到
+    /v1/statutes/{法规}/{条号} 并附带内容，同一条文只返回一次；其余引用返回搜索链接，按文本去重。
+    """
+    references = []
+    seen = set()
+    current_law = None
+    for citation in iter_citations(text):
+        if citation.kind == "law":
+            current_law = normalize_law_name(citation.text)
+
+        if statute_store is not None and citation.kind == "article" and current_law is not None:
+            number = parse_article(citation.text)
+            content = statute_store.lookup(current_law, number) if number is not None else None
+            if content is not None:
+                key = (current_law, number)
+                if key not in seen:
+                    seen.add(key)
+                    references.append(LawReference(
+                        text=citation.text,
+                        link=f"/v1/statutes/{urllib.parse.quote(current_law, safe='')}/{number}",
+                        law=current_law,
+                        article=number,
+                        content=content,
+                    ))
+                continue
+
+        if citation.text not in seen:
+            seen.add(citation.text)
+            references.append(LawReference(text=citation.text, link=search_url(citation.text)))
+    return references
+
+
+def single_turn_question(messages: List[dict]) -> Optional[Tuple[str, str]]:
+    """单轮问答（可带 system 消息）时返回 (用户问题, system 提示)，否则返回 None"""
+    turns = [m for m in messages if m["role"] != "system"]
+    if len(turns) == 1 and turns[0]["role"] == "user":
+        system = "\n".join(m["content"] for m in messages if m["role"] == "system")
+        return turns[0]["content"], system
+    return None
+
+
+def save_session_turn(session_id: Optional[str], formatted_messages: List[dict], response_text: str):
+    """会话模式下保存本轮对话（保存模型原始回复，便于下一轮复用 KV 缓存）"""
+    if session_id:
+        session_store.save(session_id, formatted_messages + [{"role": "assistant", "content": response_text}])
+
+
+def remember_response(
+    handle: ModelHandle,
+    formatted_messages: List[dict],
+    cache_key: Optional[str],
+    response_text: str,
+    session_id: Optional[str] = None,
+    temperature: float = 0.0,
+):
+    """将新生成的回复写入回复缓存、近似问题索引（仅低温度回复）与会话历史"""
+    save_session_turn(session_id, formatted_messages, response_text)
+    if cache_key is not None:
+        response_cache.put(cache_key, {"response_text": response_text})
+    if similar_index is not None and similar_index.cacheable(temperature):
+        turn = single_turn_question(formatted_messages)
+        if turn is not None:
+            question, system = turn
+            similar_index.add(question, response_text, handle.name, system)
+
+
+def create_scheduler(chat_model, model_config: dict) -> Optional["BatchScheduler"]:
+    """
+    开启连续批处理或多 LoRA 时为新加载的模型创建调度器（每个模型独立的会话 KV 缓存），
+    多 LoRA 模式下调度器挂载 LoRA 适配器池。
+    CPU 模型总是使用调度器，多轮对话复用会话 KV 缓存，避免在 CPU 上重复预填充整段历史。
+    """
+    cpu = is_cpu(model_config)
+    if not (BATCHING_ENABLED or MULTI_LORA_ENABLED or cpu):
+        return None
+    from batching import BatchScheduler
+
+    scheduler = BatchScheduler.from_chat_model(
+        chat_model,
+        max_batch_size=MAX_BATCH_SIZE,
+        max_batch_tokens=MAX_BATCH_TOKENS,
+        kv_store=KVCacheStore(max_bytes=SESSION_KV_MB << 20),
+        adapters=LoRAAdapterPool(chat_model.engine.model, MAX_LORA_ADAPTERS) if MULTI_LORA_ENABLED and not cpu else None,
+    )
+    scheduler.start()
+    print(f"已启用连续批处理: max_batch_size={MAX_BATCH_SIZE}, max_batch_tokens={MAX_BATCH_TOKENS}")
+    return scheduler
+
+
+registry = ModelRegistry(
+    scheduler_factory=create_scheduler,
+    drain_timeout=DRAIN_TIMEOUT,
+    memory_budget=int(MODEL_MEMORY_GB * (1 << 30)),
+    multi_lora=MULTI_LORA_ENABLED,
+    merged_cache=(
+        MergedCheckpointCache(MERGED_CACHE_DIR, int(MERGED_CACHE_GB * (1 << 30)))
+        if MERGED_CACHE_DIR else None
+    ),
+)
 
-    return law_refs
 
+def _resident_stat(read) -> dict:
+    return {(handle.model_id,): read(handle) for handle in list(registry.resident.values())}
 
-def add_law_links(text: str) -> str:
-    """为法规引用添加超链接"""
-    result = text
-    seen = set()
 
-    for pattern in LAW_PATTERNS:
-        def replace_with_link(match):
-            law_text = match.group()
-            if law_text in seen:
-                return law_text  # 避免重复替换
-            seen.add(law_text)
-            search_url = f"https://www.baidu.com/s?wd={law_text}"
-            return f'[{law_text}](https://www.baidu.com/s?wd={law_text})'
+def _batch_stat(key: str) -> dict:
+    return {
+        (handle.model_id,): handle.scheduler.stats()[key]
+        for handle in list(registry.resident.values())
+        if handle.scheduler is not None and handle.base is None
+    }
 
-        result = re.sub(pattern, replace_with_link, result)
 
-    return result
+def _speculative_stat(key: str) -> dict:
+    stats = {}
+    for handle in list(registry.resident.values()):
+        if handle.scheduler is None or handle.base is not None:
+            continue
+        value = handle.scheduler.stats().get("speculative", {}).get(key)
+        if value is not None:
+            stats[(handle.model_id,)] = value
+    return stats
+
+
+metrics.gauge("lawyer_queue_depth", "排队等待推理名额的请求数",
+              callback=lambda: {(): admission.stats()["waiting"]})
+metrics.gauge("lawyer_in_flight_requests", "正在推理的请求数",
+              callback=lambda: {(): admission.stats()["in_flight"]})
+metrics.gauge("lawyer_batch_active_sequences", "连续批处理中正在解码的序列数", ("model",),
+              callback=lambda: _batch_stat("active"))
+metrics.gauge("lawyer_batch_waiting_sequences", "等待加入批次的序列数", ("model",),
+              callback=lambda: _batch_stat("waiting"))
+metrics.gauge("lawyer_speculative_acceptance_rate", "推测解码中被目标模型接受的草稿 token 比例", ("model",),
+              callback=lambda: _speculative_stat("acceptance_rate"))
+metrics.gauge("lawyer_speculative_tokens_per_round", "推测解码每轮（目标模型每次前向）生成的 token 数", ("model",),
+              callback=lambda: _speculative_stat("tokens_per_round"))
+metrics.gauge("lawyer_speculative_speedup", "推测解码相对目标模型逐 token 解码的估算加速比", ("model",),
+              callback=lambda: _speculative_stat("speedup"))
+metrics.gauge("lawyer_model_in_flight_requests", "正在使用该模型的请求数", ("model",),
+              callback=lambda: _resident_stat(lambda handle: handle.in_flight))
+metrics.gauge("lawyer_model_load_seconds", "模型加载耗时（秒）", ("model",),
+              callback=lambda: _resident_stat(lambda handle: handle.load_seconds))
+metrics.gauge("lawyer_model_memory_bytes", "模型权重占用的内存（字节）", ("model",),
+              callback=lambda: _resident_stat(lambda handle: handle.memory_bytes))
+metrics.gauge("process_resident_memory_bytes", "进程常驻内存（字节）",
+              callback=lambda: {(): process_rss_bytes()})
+
+
+def record_request(model_id: str, stream: bool, status_code: int, started: float):
+    """记录一次对话请求的状态码与端到端耗时"""
+    stream_label = "true" if stream else "false"
+    chat_requests.inc(model_id, stream_label, str(status_code))
+    chat_latency.observe(time.perf_counter() - started, model_id, stream_label)
+
+
+def prepare_prompt(handle: ModelHandle, formatted_messages: List[dict]) -> Tuple[List[dict], dict]:
+    """检索相关条文注入本轮问题，再按提示 token 预算截断历史；会话中保存的仍是原始消息"""
+    passages = []
+    if statute_index is not None:
+        retrieval_started = time.perf_counter()
+        formatted_messages, passages = ground_messages(
+            statute_index,
+            formatted_messages,
+            handle.context.count_tokens,
+            top_k=RETRIEVAL_TOP_K,
+            max_tokens=RETRIEVAL_MAX_TOKENS,
+        )
+        retrieval_latency.observe(time.perf_counter() - retrieval_started)
 
+    prompt_messages, context = handle.context.fit(formatted_messages)
+    context["retrieved_passages"] = [
+        {"law": hit["law"], "article": hit["article"], "score": hit["score"]} for hit in passages
+    ]
+    return prompt_messages, context
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    """应用生命周期管理"""
-    global chat_model
 
-    # 启动时加载模型
+def generation_kwargs(request: ChatRequest, handle: ModelHandle) -> dict:
+    """构造推理参数，使用调度器时附带会话 ID 以复用 KV 缓存，共享基座的模型附带适配器名"""
+    kwargs = {
+        "max_new_tokens": request.max_tokens,
+        "temperature": request.temperature,
+        "top_p": request.top_p,
+    }
+    if handle.scheduler is not None and request.session_id:
+        kwargs["session_id"] = request.session_id
+    if handle.adapter is not None:
+        kwargs["adapter"] = handle.adapter
+    return kwargs
+
+
+async def load_startup_model():
+    """后台加载近似问题索引与默认模型，完成后服务就绪（/health/ready 返回 200）"""
+    global config_watcher
+
     print("正在加载模型...")
     try:
-        # 从配置文件加载模型配置
-        model_config = load_model_config()
-
-        if model_config:
-            print(f"使用模型: {model_config['name']}")
-            args = {
-                "model_name_or_path": model_config['model_name_or_path'],
-                "adapter_name_or_path": model_config['adapter_name_or_path'],
-                "template": model_config['template'],
-                "finetuning_type": model_config['finetuning_type'],
-            }
-            print(f"  - 基础模型: {model_config['model_name_or_path']}")
-            print(f"  - LoRA 权重: {model_config['adapter_name_or_path']}")
-        else:
-            print("使用默认配置...")
-            args = {
-                "model_name_or_path": "/workspace/llmexp/LLaMA-Factory/Qwen/Qwen2___5-7B-Instruct",
-                "adapter_name_or_path": "/workspace/llmexp/saves/qwen2.5-7b_lawyer/lora/sft",
-                "template": "Qwen",
-                "finetuning_type": "lora",
-            }
-
-        chat_model = ChatModel(args=args)
-        print("模型加载完成！")
+        if similar_index is not None:
+            with startup_timer.phase("similar_index"):
+                await asyncio.to_thread(similar_index.load)
+            print(f"近似问题索引已加载: {len(similar_index)} 条")
+        with startup_timer.phase("model"):
+            await registry.load()
     except Exception as e:
         print(f"模型加载失败: {e}")
-        raise
+        return
+    startup_timer.finish()
+    print(f"服务已就绪，启动耗时 {startup_timer.elapsed:.1f} 秒: {startup_timer.snapshot()['phases']}")
+
+    # 监听配置文件，current_model 变化时自动热切换
+    if CONFIG_POLL_INTERVAL > 0:
+        config_watcher = asyncio.create_task(registry.watch_config(CONFIG_POLL_INTERVAL))
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """应用生命周期管理：端口立即开始监听，模型在后台加载"""
+    global analysis_pool, model_loader
+
+    # 进程池以 fork 方式启动，须在加载模型（初始化 CUDA）之前创建
+    with startup_timer.phase("analysis_pool"):
+        analysis_pool = create_pool(ANALYZE_WORKERS)
+
+    model_loader = asyncio.create_task(load_startup_model())
 
     yield
 
     # 关闭时清理资源
     print("正在清理资源...")
-    del chat_model
+    if not model_loader.done():
+        model_loader.cancel()
+    if config_watcher is not None:
+        config_watcher.cancel()
+    if similar_index is not None:
+        # 条目写入时已追加到文件，这里只是去除被替换和淘汰的记录
+        similar_index.save()
+    await registry.close()
+    if analysis_pool is not None:
+        analysis_pool.shutdown(cancel_futures=True)
     print("资源清理完成！")
 
 
@@ -206,84 +485,666 @@ async def api_info():
     }
 
 
+@app.get("/health/live", tags=["健康检查"])
+async def liveness(response: Response):
+    """存活探针：进程能响应即存活；启动时模型加载失败返回 503，由编排系统重启容器"""
+    if startup_timer.error is not None and registry.active is None:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        return {"status": "failed", "error": startup_timer.error}
+    return {"status": "alive", "uptime_seconds": round(time.perf_counter() - startup_timer.started, 1)}
+
+
+@app.get("/health/ready", tags=["健康检查"])
+async def readiness(response: Response):
+    """就绪探针：默认模型加载完成后返回 200；加载期间返回 503，附带当前阶段与各阶段耗时"""
+    ready = registry.active is not None
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {
+        "ready": ready,
+        "startup": startup_timer.snapshot(),
+        "model_load": {model_id: timer.snapshot() for model_id, timer in registry.load_timers.items()},
+    }
+
+
 @app.get("/health", tags=["健康检查"])
 async def health_check():
     """健康检查"""
+    scheduler = registry.active.scheduler if registry.active is not None else None
     return {
         "status": "healthy",
-        "model_loaded": chat_model is not None
+        "model_loaded": registry.active is not None,
+        "startup": startup_timer.snapshot(),
+        "model": registry.active.info() if registry.active is not None else None,
+        "model_switch": registry.status,
+        "models": registry.memory_stats(),
+        "merged_cache": registry.merged_cache.stats() if registry.merged_cache is not None else None,
+        "load": admission.stats(),
+        "batching": scheduler.stats() if scheduler is not None else None,
+        "cache": response_cache.stats() if response_cache is not None else None,
+        "similar_cache": similar_index.stats() if similar_index is not None else None,
+        "statutes": statute_store.stats() if statute_store is not None else None,
+        "retrieval": statute_index.stats() if statute_index is not None else None,
+        "sessions": {
+            "count": len(session_store),
+            "kv_cache": scheduler.kv_store.stats() if scheduler is not None and scheduler.kv_store else None,
+        },
     }
 
 
+def build_chat_response(response_text: str, request: ChatRequest, context: Optional[dict] = None) -> ChatResponse:
+    """根据模型原始回复构造响应：添加法规超链接并提取法规引用，附带历史截断情况"""
+    law_refs = extract_law_references(response_text)
+
+    # 如果启用了法规超链接
+    if request.enable_law_links:
+        response_text = add_law_links(response_text)
+
+    return ChatResponse(
+        role="assistant",
+        content=response_text,
+        law_references=[ref.model_dump(exclude_none=True) for ref in law_refs],
+        session_id=request.session_id,
+        context=context,
+    )
+
+
 @app.post("/v1/chat/completions", response_model=ChatResponse, tags=["对话"])
-async def chat_completion(request: ChatRequest):
+async def chat_completion(request: ChatRequest, http_request: Request, http_response: Response):
     """
     对话补全接口
 
     - 支持多轮对话
     - 自动为法规引用添加超链接
-    - 支持流式输出（需要客户端支持 SSE）
+    - 支持流式输出（stream=true 时以 SSE 推送，需要客户端支持 SSE）
+    - 开启回复缓存时，低温度请求优先返回缓存；请求头 X-Cache-Bypass: 1 可跳过缓存
+    - 开启近似问题缓存时，措辞相近的单轮问题直接返回已存储的回答
+    - 传入 session_id 时由服务端保存对话历史，开启连续批处理时复用上一轮的 KV 缓存
+    - 历史超出模型的提示 token 预算时丢弃最早的轮次，响应中的 context 字段给出截断情况
+    - model 指定使用的模型，未加载时按需加载；为空时使用默认模型
+    - 模型热切换期间，已开始的请求继续使用旧模型直至完成
     """
-    if chat_model is None:
+    started = time.perf_counter()
+    try:
+        handle = await registry.acquire(request.model)
+    except KeyError as e:
+        # 不存在的模型统一记为 unknown，避免任意输入撑大指标的标签集合
+        record_request("unknown", request.stream, status.HTTP_404_NOT_FOUND, started)
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=str(e.args[0])
+        )
+    except Exception as e:
+        record_request(request.model or registry.default_id or "unknown", request.stream,
+                       status.HTTP_503_SERVICE_UNAVAILABLE, started)
+        # 启动时模型仍在加载：提示客户端稍后重试
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-            detail="模型未加载完成"
+            detail=f"模型不可用：{str(e)}",
+            headers={"Retry-After": str(RETRY_AFTER)},
         )
 
     try:
-        # 转换消息格式
-        formatted_messages = [
-            {"role": msg.role, "content": msg.content}
-            for msg in request.messages
-        ]
-
-        # 调用模型生成回复
-        response = chat_model.chat(
-            formatted_messages,
-            max_new_tokens=request.max_tokens,
-            temperature=request.temperature,
-            top_p=request.top_p,
+        result = await _chat_completion(request, handle, http_request, http_response, started)
+    except HTTPException as e:
+        handle.release()
+        record_request(handle.model_id, request.stream, e.status_code, started)
+        raise
+    except BaseException:
+        handle.release()
+        raise
+
+    # 流式响应在结束时释放模型并记录指标
+    if not isinstance(result, ChatStreamResponse):
+        handle.release()
+        record_request(handle.model_id, False, status.HTTP_200_OK, started)
+    return result
+
+
+async def _chat_completion(
+    request: ChatRequest,
+    handle: ModelHandle,
+    http_request: Request,
+    http_response: Response,
+    started: float,
+):
+    """在已登记的模型上处理对话请求"""
+    # 转换消息格式，会话模式下拼接服务端保存的历史
+    formatted_messages = [
+        {"role": msg.role, "content": msg.content}
+        for msg in request.messages
+    ]
+    if request.session_id:
+        formatted_messages = session_store.get(request.session_id) + formatted_messages
+
+    # 查询回复缓存
+    cache_key = None
+    cache_status = None
+    bypass_cache = http_request.headers.get("X-Cache-Bypass", "").lower() in ("1", "true", "yes")
+    if response_cache is not None and response_cache.cacheable(request.temperature):
+        if bypass_cache:
+            response_cache.bypassed += 1
+            cache_status = "BYPASS"
+        else:
+            cache_key = make_cache_key(
+                formatted_messages,
+                handle.name,
+                temperature=request.temperature,
+                top_p=request.top_p,
+                max_tokens=request.max_tokens,
+            )
+            cached = response_cache.get(cache_key)
+            cache_status = "MISS" if cached is None else "HIT"
+            if cached is not None:
+                if request.stream:
+                    return ChatStreamResponse(
+                        request, handle, formatted_messages, started, cached_text=cached["response_text"],
+                        headers={"X-Cache": cache_status},
+                    )
+                http_response.headers["X-Cache"] = cache_status
+                save_session_turn(request.session_id, formatted_messages, cached["response_text"])
+                return build_chat_response(cached["response_text"], request)
+
+    # 查询近似问题索引（仅单轮问答）
+    if similar_index is not None and not bypass_cache and similar_index.cacheable(request.temperature):
+        turn = single_turn_question(formatted_messages)
+        match = similar_index.lookup(turn[0], handle.name, turn[1]) if turn is not None else None
+        if match is not None:
+            cache_status = "SIMILAR"
+            if request.stream:
+                return ChatStreamResponse(
+                    request, handle, formatted_messages, started, cached_text=match["answer"],
+                    headers={"X-Cache": cache_status},
+                )
+            http_response.headers["X-Cache"] = cache_status
+            save_session_turn(request.session_id, formatted_messages, match["answer"])
+            return build_chat_response(match["answer"], request)
+
+    if request.stream:
+        # 排队申请推理名额，名额在流结束时归还
+        await admission.acquire()
+        return ChatStreamResponse(
+            request, handle, formatted_messages, started, cache_key=cache_key,
+            headers={"X-Cache": cache_status} if cache_status else None,
         )
 
-        # 提取回复文本
-        response_text = response[0].response_text
+    # 注入检索到的条文并按提示 token 预算截断历史，会话中保存的仍是完整历史
+    prompt_messages, context = prepare_prompt(handle, formatted_messages)
+
+    # 排队申请推理名额，队列已满时直接返回 429
+    async with admission.slot():
+        try:
+            # 调用模型生成回复（异步接口，不阻塞事件循环）
+            generate_started = time.perf_counter()
+            response = await handle.engine.achat(prompt_messages, **generation_kwargs(request, handle))
+            generate_seconds = time.perf_counter() - generate_started
+
+            # 提取回复文本
+            response_text = response[0].response_text
+
+        except Exception as e:
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"处理请求时出错：{str(e)}"
+            )
+
+    chat_prompt_tokens.inc(handle.model_id, amount=response[0].prompt_length)
+    chat_completion_tokens.inc(handle.model_id, amount=response[0].response_length)
+    if generate_seconds > 0:
+        chat_token_rate.observe(response[0].response_length / generate_seconds, handle.model_id)
+
+    remember_response(handle, formatted_messages, cache_key, response_text, request.session_id, request.temperature)
+    if cache_status:
+        http_response.headers["X-Cache"] = cache_status
+
+    return build_chat_response(response_text, request, context)
+
+
+def _stream_chunk(
+    completion_id: str,
+    created: int,
+    model: str,
+    delta: dict,
+    finish_reason: Optional[str] = None,
+    **extra,
+) -> str:
+    """构造 OpenAI 风格的流式数据块"""
+    chunk = {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        **extra,
+    }
+    return json.dumps(chunk, ensure_ascii=False)
+
+
+async def _cached_tokens(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def stream_chat_completion(
+    request: ChatRequest,
+    handle: ModelHandle,
+    formatted_messages: List[dict],
+    started: float,
+    release: Callable[[int], None],
+    cache_key: Optional[str] = None,
+    cached_text: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    流式生成回复（SSE）
+
+    逐 token 推送 data 块，最后一个数据块携带法规引用列表与历史截断情况，并以 [DONE] 结束。
+    命中缓存时（cached_text 不为空）直接推送缓存内容；否则将新生成的回复写入缓存。
+    结束时以最终状态码调用 release 归还模型占用与推理名额，客户端中途断开的请求记为状态码 499。
+    """
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    linker = StreamingLawLinker() if request.enable_law_links else None
+    raw_text = []
+    status_code = 499
+    first_token_at = None
+
+    context = None
 
-        # 如果启用了法规超链接
-        if request.enable_law_links:
-            response_text = add_law_links(response_text)
+    try:
+        if cached_text is not None:
+            tokens = _cached_tokens(cached_text)
+        else:
+            prompt_messages, context = prepare_prompt(handle, formatted_messages)
+            tokens = handle.engine.astream_chat(prompt_messages, **generation_kwargs(request, handle))
+
+        yield _stream_chunk(completion_id, created, handle.name, {"role": "assistant", "content": ""})
+
+        async for new_token in tokens:
+            if first_token_at is None:
+                first_token_at = time.perf_counter()
+            raw_text.append(new_token)
+            content = linker.feed(new_token) if linker else new_token
+            if content:
+                yield _stream_chunk(completion_id, created, handle.name, {"content": content})
+
+        tail = linker.flush() if linker else ""
+        response_text = "".join(raw_text)
+        law_refs = extract_law_references(response_text)
+        yield _stream_chunk(
+            completion_id, created, handle.name,
+            {"content": tail} if tail else {},
+            finish_reason="stop",
+            law_references=[ref.model_dump(exclude_none=True) for ref in law_refs],
+            session_id=request.session_id,
+            context=context,
+        )
+        if cached_text is None:
+            remember_response(handle, formatted_messages, cache_key, response_text, request.session_id, request.temperature)
+        else:
+            save_session_turn(request.session_id, formatted_messages, response_text)
+        status_code = status.HTTP_200_OK
+    except Exception as e:
+        status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+        yield json.dumps({"error": {"message": f"处理请求时出错：{str(e)}"}}, ensure_ascii=False)
+    finally:
+        if cached_text is None:
+            # 流式输出无法得到提示长度，每个推送的片段计为一个生成 token
+            chat_completion_tokens.inc(handle.model_id, amount=len(raw_text))
+            if first_token_at is not None:
+                chat_ttft.observe(first_token_at - started, handle.model_id)
+                decode_seconds = time.perf_counter() - first_token_at
+                if len(raw_text) > 1 and decode_seconds > 0:
+                    chat_token_rate.observe((len(raw_text) - 1) / decode_seconds, handle.model_id)
+        release(status_code)
+
+    yield "[DONE]"
+
+
+class ChatStreamResponse(EventSourceResponse):
+    """
+    对话流式响应，持有模型占用与推理名额（未命中缓存时）直至响应结束
 
-        # 提取法规引用
-        law_refs = extract_law_references(response[0].response_text)
+    生成器在结束时归还二者；客户端在开始读取前断开时生成器从未执行，其 finally 也不会运行，
+    因此响应结束时关闭生成器并再次归还（只生效一次），保证不会泄漏。
+    """
 
-        return ChatResponse(
-            role="assistant",
-            content=response_text,
-            law_references=[{"text": ref.text, "link": ref.link} for ref in law_refs]
+    def __init__(
+        self,
+        request: ChatRequest,
+        handle: ModelHandle,
+        formatted_messages: List[dict],
+        started: float,
+        cache_key: Optional[str] = None,
+        cached_text: Optional[str] = None,
+        headers: Optional[dict] = None,
+    ):
+        self.handle = handle
+        self.started = started
+        self.admitted = cached_text is None
+        self.released = False
+        super().__init__(
+            stream_chat_completion(
+                request, handle, formatted_messages, started, self.release,
+                cache_key=cache_key, cached_text=cached_text,
+            ),
+            headers=headers,
         )
 
+    def release(self, status_code: int = 499):
+        if self.released:
+            return
+        self.released = True
+        if self.admitted:
+            admission.release()
+        self.handle.release()
+        record_request(self.handle.model_id, True, status_code, self.started)
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            self.release()
+
+
+async def _complete_batch_item(item: BatchChatItem, model: Optional[str], http_request: Request) -> dict:
+    """处理批量请求中的一条对话；推理名额不足时等待后重试，其余错误写入结果。每条按单次对话请求记录指标"""
+    started = time.perf_counter()
+    try:
+        handle = await registry.acquire(item.model or model)
+    except KeyError as e:
+        record_request("unknown", False, status.HTTP_404_NOT_FOUND, started)
+        return {"id": item.id, "error": {"status": status.HTTP_404_NOT_FOUND, "message": str(e.args[0])}}
     except Exception as e:
+        record_request(item.model or model or registry.default_id or "unknown", False,
+                       status.HTTP_503_SERVICE_UNAVAILABLE, started)
+        return {"id": item.id, "error": {"status": status.HTTP_503_SERVICE_UNAVAILABLE, "message": f"模型不可用：{str(e)}"}}
+
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    try:
+        while True:
+            try:
+                response = await _chat_completion(item, handle, http_request, Response(), started)
+                break
+            except HTTPException as e:
+                if e.status_code not in (status.HTTP_429_TOO_MANY_REQUESTS, status.HTTP_503_SERVICE_UNAVAILABLE):
+                    status_code = e.status_code
+                    return {"id": item.id, "error": {"status": e.status_code, "message": e.detail}}
+                await asyncio.sleep(admission.retry_after)
+            except Exception as e:
+                return {"id": item.id, "error": {"status": status_code, "message": f"处理请求时出错：{str(e)}"}}
+        status_code = status.HTTP_200_OK
+    except asyncio.CancelledError:
+        # 客户端断开后未完成的条目被取消
+        status_code = 499
+        raise
+    finally:
+        handle.release()
+        record_request(handle.model_id, False, status_code, started)
+    return {"id": item.id, "model": handle.model_id, **response.model_dump(exclude={"session_id"})}
+
+
+def _parse_batch_line(line: bytes, line_no: int):
+    """解析一行 NDJSON，返回 BatchChatItem 或错误结果"""
+    try:
+        data = json.loads(line)
+    except ValueError as e:
+        return {"id": f"line-{line_no}", "error": {"status": status.HTTP_400_BAD_REQUEST, "message": f"JSON 格式错误：{str(e)}"}}
+    try:
+        item = BatchChatItem.model_validate(data)
+    except ValidationError as e:
+        item_id = data.get("id") if isinstance(data, dict) else None
+        return {
+            "id": str(item_id) if item_id is not None else f"line-{line_no}",
+            "error": {"status": 422, "message": str(e)},
+        }
+    item.stream = False
+    return item
+
+
+async def _batch_results(spool, model: Optional[str], http_request: Request) -> AsyncIterator[str]:
+    """
+    逐行读取对话并以有限窗口并发处理，按完成顺序输出 NDJSON
+
+    同时处理的对话数不超过 BATCH_CONCURRENCY，只有输出被读取后才会读入新的对话，
+    内存占用与批量大小无关。客户端断开时取消未完成的对话。
+    """
+    pending = set()
+    line_no = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < BATCH_CONCURRENCY:
+                line = spool.readline()
+                if not line:
+                    exhausted = True
+                    break
+                line_no += 1
+                if not line.strip():
+                    continue
+                item = _parse_batch_line(line, line_no)
+                if isinstance(item, dict):
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+                    continue
+                pending.add(asyncio.create_task(_complete_batch_item(item, model, http_request)))
+
+            if not pending:
+                break
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield json.dumps(task.result(), ensure_ascii=False) + "\n"
+    finally:
+        for task in pending:
+            task.cancel()
+        spool.close()
+
+
+@app.post("/v1/chat/batch", tags=["对话"])
+async def chat_batch(http_request: Request, model: Optional[str] = None):
+    """
+    批量对话接口
+
+    - 请求体为 NDJSON，每行一个对话：{"id": ..., "messages": [...], 以及 /v1/chat/completions 的其他参数}
+    - 结果以 NDJSON 按完成顺序返回，每行带调用方的 id；单条失败时该行包含 error，不影响其他对话
+    - 查询参数 model 指定默认模型，单条对话中的 model 优先；请求头 X-Cache-Bypass 对所有对话生效
+    - 并发经连续批处理合并解码，同时处理的对话数由 API_BATCH_CONCURRENCY 限制
+    """
+    # 先将上传内容写入临时文件（超出 API_BATCH_SPOOL_MB 时落盘），内存占用与批量大小无关
+    spool = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_MB * (1 << 20))
+    try:
+        async for chunk in http_request.stream():
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+
+    return StreamingResponse(_batch_results(spool, model, http_request), media_type="application/x-ndjson")
+
+
+@app.delete("/v1/sessions/{session_id}", tags=["对话"])
+async def delete_session(session_id: str):
+    """结束会话，释放服务端保存的历史与 KV 缓存"""
+    for handle in registry.resident.values():
+        if handle.scheduler is not None and handle.scheduler.kv_store is not None:
+            handle.scheduler.kv_store.discard(session_id)
+    return {"session_id": session_id, "deleted": session_store.delete(session_id)}
+
+
+class SwitchModelRequest(BaseModel):
+    model_id: str = Field(..., description="config_models.yaml 中的模型 ID")
+
+
+def check_admin_token(http_request: Request):
+    """设置了 API_ADMIN_TOKEN 时校验请求头 X-Admin-Token"""
+    if ADMIN_TOKEN and http_request.headers.get("X-Admin-Token") != ADMIN_TOKEN:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail=f"处理请求时出错：{str(e)}"
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="管理令牌无效"
         )
 
 
-@app.post("/v1/chat/analyze", tags=["分析"])
-async def analyze_law_references(messages: List[Message]):
+@app.post("/admin/models/switch", status_code=status.HTTP_202_ACCEPTED, tags=["管理"])
+async def switch_model(switch_request: SwitchModelRequest, http_request: Request):
+    """
+    热切换模型
+
+    后台加载新模型并设为默认模型，期间继续使用当前模型提供服务；加载完成后原子切换。
+    旧模型仍可通过 model 字段访问，超出内存预算时在其请求处理完毕后释放。
+    通过 GET 同一路径查询切换进度。
+    """
+    check_admin_token(http_request)
+    try:
+        return registry.switch(switch_request.model_id)
+    except KeyError as e:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=str(e.args[0]))
+    except RuntimeError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+
+
+@app.get("/admin/models/switch", tags=["管理"])
+async def switch_model_status(http_request: Request):
+    """查询模型切换进度"""
+    check_admin_token(http_request)
+    return {
+        **registry.status,
+        "active": registry.active.info() if registry.active is not None else None,
+    }
+
+
+async def _scan_upload(http_request: Request, scanner: DocumentScanner, ndjson: bool):
+    """边接收上传内容边扫描：纯文本视为一个文档，NDJSON 每行一个文档（单行不超过 ANALYZE_MAX_LINE_MB）"""
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    if not ndjson:
+        async for chunk in http_request.stream():
+            await scanner.feed(decoder.decode(chunk))
+        await scanner.feed(decoder.decode(b"", final=True))
+        await scanner.end_document()
+        return
+
+    max_line_bytes = ANALYZE_MAX_LINE_MB << 20
+    line_parts = []
+    line_bytes = 0
+    line_no = 0
+
+    async def scan_line(line: bytes):
+        nonlocal line_no
+        line_no += 1
+        if not line.strip():
+            return
+        try:
+            document = json.loads(line)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"第 {line_no} 行 JSON 格式错误：{str(e)}")
+        if not isinstance(document, dict) or not isinstance(document.get("content"), str):
+            raise HTTPException(status_code=422, detail=f"第 {line_no} 行缺少 content 字段")
+        scanner.start_document(document.get("id", line_no - 1))
+        await scanner.feed(document["content"])
+        await scanner.end_document()
+
+    def append_part(part: bytes):
+        nonlocal line_bytes
+        line_bytes += len(part)
+        if line_bytes > max_line_bytes:
+            raise HTTPException(
+                status_code=413,
+                detail=f"第 {line_no + 1} 行超过 {ANALYZE_MAX_LINE_MB} MB，大文档请以 text/plain 上传",
+            )
+        line_parts.append(part)
+
+    async for chunk in http_request.stream():
+        *lines, tail = chunk.split(b"\n")
+        for line in lines:
+            append_part(line)
+            await scan_line(b"".join(line_parts))
+            line_parts = []
+            line_bytes = 0
+        if tail:
+            append_part(tail)
+    if line_parts:
+        await scan_line(b"".join(line_parts))
+
+
+async def rebuild_analysis_pool(broken):
+    """大文档分析的进程池损坏（工作进程异常退出）时重建，并发请求共用一次重建"""
+    global analysis_pool
+    async with analysis_pool_lock:
+        if analysis_pool is broken:
+            print("⚠️  大文档分析进程池已损坏，正在重建...")
+            broken.shutdown(wait=False, cancel_futures=True)
+            # 此时进程中已有 CUDA 与多个线程，以 spawn 启动新的工作进程
+            analysis_pool = await asyncio.to_thread(create_pool, ANALYZE_WORKERS, "spawn")
+    return analysis_pool
+
+
+async def _analysis_results(counter: ReferenceCounter, summary: dict) -> AsyncIterator[str]:
+    for entry in counter.references.values():
+        yield json.dumps({"type": "reference", **entry}, ensure_ascii=False) + "\n"
+    yield json.dumps({"type": "summary", **summary}, ensure_ascii=False) + "\n"
+
+
+# 请求体按 Content-Type 分别解析，不经过 pydantic 参数，需单独声明其结构
+ANALYZE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {
+                "schema": {"type": "array", "items": {"$ref": "#/components/schemas/Message"}},
+            },
+            "text/plain": {
+                "schema": {"type": "string", "description": "单个文档，可流式上传任意大小"},
+            },
+            "application/x-ndjson": {
+                "schema": {
+                    "type": "string",
+                    "description": '每行一个文档 {"id": ..., "content": ...}，单行不超过 API_ANALYZE_MAX_LINE_MB',
+                },
+            },
+        },
+    },
+}
+
+
+@app.post("/v1/chat/analyze", tags=["分析"], openapi_extra=ANALYZE_REQUEST_BODY)
+async def analyze_law_references(http_request: Request):
     """
-    分析对话中的法规引用
+    分析对话或文档中的法规引用
 
-    返回对话中所有识别到的法规条文及其搜索链接
+    - application/json：消息列表，返回对话中所有识别到的法规条文及其搜索链接
+    - text/plain：流式上传的大文档；application/x-ndjson：每行一个文档 {"id": ..., "content": ...}，
+      每行需整行读入，超过 API_ANALYZE_MAX_LINE_MB 时返回 413
+      文档模式边接收边分块扫描（大文档分发到进程池），以 NDJSON 返回去重后的法规引用、
+      出现次数与前若干个出现位置（文档 ID 与字符偏移），最后一行为统计信息
     """
+    content_type = http_request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type in ("text/plain", "application/x-ndjson"):
+        counter = ReferenceCounter()
+        scanner = DocumentScanner(
+            counter,
+            executor=analysis_pool,
+            max_pending=max(2, ANALYZE_WORKERS * 2),
+            rebuild_executor=rebuild_analysis_pool,
+        )
+        try:
+            await _scan_upload(http_request, scanner, ndjson=content_type == "application/x-ndjson")
+        finally:
+            await scanner.close()
+        return StreamingResponse(_analysis_results(counter, scanner.summary()), media_type="application/x-ndjson")
+
+    try:
+        messages = TypeAdapter(List[Message]).validate_json(await http_request.body())
+    except ValidationError as e:
+        raise RequestValidationError(e.errors())
+
     all_law_refs = []
     seen = set()
 
     for msg in messages:
         law_refs = extract_law_references(msg.content)
         for ref in law_refs:
-            if ref.text not in seen:
-                seen.add(ref.text)
-                all_law_refs.append({"text": ref.text, "link": ref.link})
+            key = (ref.law, ref.article) if ref.content is not None else ref.text
+            if key not in seen:
+                seen.add(key)
+                all_law_refs.append(ref.model_dump(exclude_none=True))
 
     return {
         "count": len(all_law_refs),
@@ -291,24 +1152,54 @@ async def analyze_law_references(messages: List[Message]):
     }
 
 
+@app.get("/v1/statutes/{law:path}/{article}", tags=["分析"])
+async def get_statute(law: str, article: str):
+    """
+    查询本地法规库中的条文
+
+    law 可以是法规全称或简称（需 URL 编码，名称中可含 /），article 可以是 20 或 第二十条
+    """
+    if statute_store is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="未配置本地法规库（API_STATUTE_DB）")
+    number = parse_article(article)
+    content = statute_store.lookup(law, number) if number is not None else None
+    if content is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"法规库中没有 {law} {article}")
+    return {"law": normalize_law_name(law), "article": number, "content": content}
+
+
 @app.get("/v1/models", tags=["模型信息"])
 async def list_models():
-    """列出可用模型"""
+    """
+    列出可用模型
+
+    返回 config_models.yaml 中的全部模型；status 为 loaded（已加载）、loading（加载中）
+    或 unloaded（首次请求时加载），default 标记未指定 model 时使用的模型
+    """
     return {
         "object": "list",
         "data": [
             {
-                "id": "qwen2.5-7b-lawyer",
+                "id": model["id"],
                 "object": "model",
                 "owned_by": "lawyer-ai",
                 "permission": [],
-                "root": "qwen2.5-7b-lawyer",
-                "parent": None
+                "root": model["name"],
+                "parent": None,
+                **{key: value for key, value in model.items() if key not in ("id", "name")},
             }
-        ]
+            for model in registry.list_models()
+        ],
+        "memory": registry.memory_stats(),
     }
 
 
+@app.get("/metrics", tags=["健康检查"])
+async def prometheus_metrics():
+    """Prometheus 指标（文本格式）"""
+    return PlainTextResponse(metrics.render(), media_type=CONTENT_TYPE)
+
+
 @app.get("/v1/model/info", tags=["模型信息"])
 async def model_info():
     """获取模型详细信息"""
@@ -5,21 +5,51 @@
 """
 
 import os
-import re
+import threading
+import time
 import yaml
 import gradio as gr
-from typing import List, Tuple
+from typing import AsyncIterator, List, Tuple
 from pathlib import Path
 
-# 设置环境变量
-os.environ["CUDA_VISIBLE_DEVICES"] = "0"
+# 设置环境变量（没有 GPU 的机器可设为空，模型条目用 device: cpu 选择 CPU 推理）
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "0")
 
-from llamafactory.chat import ChatModel
+from context_window import DEFAULT_MAX_PROMPT_TOKENS, ContextWindow
+from cpu_backend import cpu_chat_args, is_cpu, prepare_cpu_model
+from law_links import StreamingLawLinker, add_law_links, find_citations, html_link, search_url
+from merged_cache import MergedCheckpointCache
+from retrieval import StatuteIndex, ground_messages
+from startup import PhaseTimer
 
 
 # 配置文件路径
 CONFIG_FILE = Path(__file__).parent / "config_models.yaml"
 
+# 流式输出的界面刷新间隔：距上次刷新超过 STREAM_UPDATE_INTERVAL 秒
+# 或新增 STREAM_UPDATE_TOKENS 个 token 时刷新一次（先到者），避免逐 token 重绘整条消息
+STREAM_UPDATE_INTERVAL = 0.1
+STREAM_UPDATE_TOKENS = 64
+
+# 并发配置：开启连续批处理时各会话的请求合并到同一批次解码，界面并发数默认与批大小一致
+BATCHING_ENABLED = os.environ.get("GRADIO_BATCHING", "true").lower() in ("1", "true", "yes")
+MAX_BATCH_SIZE = int(os.environ.get("GRADIO_MAX_BATCH_SIZE", "8"))
+MAX_BATCH_TOKENS = int(os.environ.get("GRADIO_MAX_BATCH_TOKENS", "8192"))
+CONCURRENCY = int(os.environ.get("GRADIO_CONCURRENCY", str(MAX_BATCH_SIZE if BATCHING_ENABLED else 1)))
+MAX_QUEUE = int(os.environ.get("GRADIO_MAX_QUEUE", "64"))
+
+# 每个会话保存的对话历史上限（字符数），超出时丢弃最早的轮次
+MAX_HISTORY_CHARS = int(os.environ.get("GRADIO_MAX_HISTORY_CHARS", "100000"))
+
+# 条文检索索引目录（python retrieval.py build 生成），为空时不检索
+STATUTE_INDEX = os.environ.get("GRADIO_STATUTE_INDEX", "")
+RETRIEVAL_TOP_K = int(os.environ.get("GRADIO_RETRIEVAL_TOP_K", "3"))
+RETRIEVAL_MAX_TOKENS = int(os.environ.get("GRADIO_RETRIEVAL_MAX_TOKENS", "1024"))
+
+# LoRA 合并权重缓存目录（可与 API 服务共用），为空时每次启动加载适配器
+MERGED_CACHE_DIR = os.environ.get("GRADIO_MERGED_CACHE_DIR", "")
+MERGED_CACHE_GB = float(os.environ.get("GRADIO_MERGED_CACHE_GB", "64"))
+
 
 def load_model_config():
     """从配置文件加载模型配置"""
@@ -38,29 +68,21 @@ def load_model_config():
         return {}
 
 
-# 法规关键词提取和超链接生成配置
-LAW_PATTERNS = [
-    # 法条格式：第X条、第X款等
-    r'第[一二三四五六七八九十百千万零]+条',
-    r'第[0-9]+条',
-    r'第[一二三四五六七八九十百千万零]+款',
-    r'第[0-9]+款',
-    r'第[一二三四五六七八九十百千万零]+项',
-    r'第[0-9]+项',
-    # 常见法律法规名称
-    r'《[^》]+法》',
-    r'《[^》]+条例》',
-    r'《[^》]+规定》',
-    r'《[^》]+办法》',
-    r'《[^》]+细则》',
-    r'《[^》]+解释》',
-]
-
-
 class LawyerChatApp:
     def __init__(self):
-        """初始化律师 AI 聊天应用"""
-        print("正在加载模型...")
+        """
+        初始化律师 AI 聊天应用
+
+        模型在后台线程中加载（llamafactory、torch 等也在此时才导入），界面可以立即启动；
+        加载完成前提交的问题会提示当前加载阶段。
+        """
+        self.chat_model = None
+        self.context = None
+        self.scheduler = None
+        self.engine = None
+        self.statute_index = None
+        self.startup = PhaseTimer()
+        self.ready = threading.Event()
 
         # 从配置文件加载模型配置
         model_config = load_model_config()
@@ -84,119 +106,229 @@ class LawyerChatApp:
                 "finetuning_type": "lora",
             }
 
-        self.chat_model = ChatModel(args=args)
-        self.chat_history = []
-        print("模型加载完成！")
+        threading.Thread(target=self._load_model, args=(args, model_config), daemon=True).start()
+
+    def _load_model(self, args: dict, model_config: dict):
+        """后台加载模型，分阶段计时（导入依赖、合并 LoRA 权重、读取权重、CPU 量化、加载草稿模型、启动调度器、打开检索索引）"""
+        print("正在加载模型...")
+        try:
+            with self.startup.phase("import"):
+                from llamafactory.chat import ChatModel
+                from batching import BatchScheduler
+
+            merged_cache = (
+                MergedCheckpointCache(MERGED_CACHE_DIR, int(MERGED_CACHE_GB * (1 << 30)))
+                if MERGED_CACHE_DIR else None
+            )
+            if merged_cache is not None and args['finetuning_type'] == 'lora' and args['adapter_name_or_path']:
+                with self.startup.phase("merge"):
+                    merged_path = merged_cache.get_or_build(args)
+                print(f"  - 使用合并权重: {merged_path}")
+                args = dict(args, model_name_or_path=str(merged_path), adapter_name_or_path=None)
+
+            cpu = is_cpu(model_config)
+            with self.startup.phase("weights"):
+                chat_model = ChatModel(args=cpu_chat_args(args) if cpu else args)
+            if cpu:
+                with self.startup.phase("quantize"):
+                    print(f"  - {prepare_cpu_model(chat_model, model_config)}")
+            self.context = ContextWindow.from_chat_model(
+                chat_model, int(model_config.get('max_prompt_tokens', DEFAULT_MAX_PROMPT_TOKENS))
+            )
+
+            # 配置了草稿模型时使用推测解码；否则所有会话共享一份模型，开启批处理时并发请求由调度器合并解码
+            if model_config.get('draft_model'):
+                from model_registry import create_chat_model, resolve_model
+                from speculative import DEFAULT_DRAFT_TOKENS, SpeculativeDecoder
+
+                draft_id, draft_config = resolve_model(model_config['draft_model'], CONFIG_FILE)
+                if draft_config['template'] != model_config['template']:
+                    raise ValueError(f"草稿模型 '{draft_id}' 的对话模板与目标模型不同")
+                # 与目标模型相同：使用合并权重缓存，CPU 模型以 float32 加载后量化
+                draft_chat_model = create_chat_model(
+                    ChatModel, draft_config, self.startup, merged_cache, prefix="draft_"
+                )
+                with self.startup.phase("scheduler"):
+                    self.scheduler = SpeculativeDecoder.from_chat_models(
+                        chat_model,
+                        draft_chat_model,
+                        draft_tokens=int(model_config.get('draft_tokens', DEFAULT_DRAFT_TOKENS)),
+                    )
+                    self.scheduler.start()
+                print(f"  - 推测解码: 草稿模型 {draft_config.get('name', draft_id)}，草稿长度 {self.scheduler.draft_tokens}")
+            elif BATCHING_ENABLED:
+                with self.startup.phase("scheduler"):
+                    self.scheduler = BatchScheduler.from_chat_model(
+                        chat_model,
+                        max_batch_size=MAX_BATCH_SIZE,
+                        max_batch_tokens=MAX_BATCH_TOKENS,
+                    )
+                    self.scheduler.start()
+                print(f"  - 连续批处理: 批大小 {MAX_BATCH_SIZE}")
+
+            if STATUTE_INDEX:
+                with self.startup.phase("retrieval_index"):
+                    self.statute_index = StatuteIndex(STATUTE_INDEX)
+                print(f"  - 条文检索: {self.statute_index.stats()['passages']} 条条文")
+        except Exception as e:
+            print(f"模型加载失败: {e}")
+            return
+
+        self.chat_model = chat_model
+        self.engine = self.scheduler if self.scheduler is not None else chat_model
+        self.startup.finish()
+        self.ready.set()
+        print(f"模型加载完成！耗时 {self.startup.elapsed:.1f} 秒: {self.startup.snapshot()['phases']}")
+
+    def loading_notice(self) -> str:
+        """模型未就绪时提示当前加载阶段"""
+        snapshot = self.startup.snapshot()
+        if snapshot["error"]:
+            return f"模型加载失败：{snapshot['error']}"
+        return f"模型正在加载（阶段：{snapshot['phase']}，已用 {snapshot['elapsed_seconds']:.0f} 秒），请稍后再试"
 
     def extract_law_references(self, text: str) -> List[Tuple[str, str]]:
         """提取文本中的法规引用"""
-        law_refs = []
-        for pattern in LAW_PATTERNS:
-            matches = re.finditer(pattern, text)
-            for match in matches:
-                law_text = match.group()
-                # 生成搜索引擎链接（使用百度）
-                search_url = f"https://www.baidu.com/s?wd={law_text}"
-                law_refs.append((law_text, search_url))
-        return law_refs
+        return [(citation.text, search_url(citation.text)) for citation in find_citations(text)]
 
     def add_law_links(self, text: str) -> str:
         """为法规引用添加超链接"""
-        result = text
-        # 使用 HTML 标记添加超链接
-        for pattern in LAW_PATTERNS:
-            def replace_with_link(match):
-                law_text = match.group()
-                search_url = f"https://www.baidu.com/s?wd={law_text}"
-                return f'<a href="{search_url}" target="_blank" style="color: #1E88E5; text-decoration: underline;">{law_text}</a>'
-            result = re.sub(pattern, replace_with_link, result)
-        return result
-
-    def format_history_for_model(self, history: List[Tuple[str, str]]) -> List[dict]:
-        """将聊天历史转换为模型需要的格式"""
+        # 使用 HTML 标记添加超链接，每处引用都添加
+        return add_law_links(text, formatter=html_link, unique=False)
+
+    def format_history_for_model(self, history: List[Tuple[str, str]], message: str) -> List[dict]:
+        """将聊天历史与本轮消息转换为模型需要的格式：注入检索到的条文，超出提示 token 预算时丢弃最早的轮次"""
         messages = []
         for user_msg, assistant_msg in history:
             messages.append({"role": "user", "content": user_msg})
             if assistant_msg:
                 messages.append({"role": "assistant", "content": assistant_msg})
+        messages.append({"role": "user", "content": message})
+
+        if self.statute_index is not None:
+            messages, _ = ground_messages(
+                self.statute_index,
+                messages,
+                self.context.count_tokens,
+                top_k=RETRIEVAL_TOP_K,
+                max_tokens=RETRIEVAL_MAX_TOKENS,
+            )
+
+        messages, report = self.context.fit(messages)
+        if report["dropped_messages"] or report["collapsed_messages"]:
+            notice = f"对话较长，已省略最早的 {report['dropped_messages']} 条消息（约 {report['dropped_tokens']} token）"
+            if report["collapsed_messages"]:
+                notice += "，并折叠了本轮消息的中间部分"
+            print(notice)
+            gr.Info(notice)
         return messages
 
-    def chat(self, message: str, history: List[Tuple[str, str]]) -> Tuple[str, List[Tuple[str, str]]]:
+    async def stream_chat(
+        self,
+        message: str,
+        history: List[Tuple[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 512,
+    ) -> AsyncIterator[Tuple[str, str]]:
         """
-        处理用户输入并生成回复
+        流式聊天生成
+
+        每隔 STREAM_UPDATE_INTERVAL 秒或 STREAM_UPDATE_TOKENS 个 token 输出一次，
+        最后一次输出完整回复。生成在调度器（或 ChatModel）的异步接口上进行，不占用界面的工作线程。
 
         Args:
             message: 用户输入的消息
-            history: 聊天历史记录
+            history: 聊天历史记录（模型原始回复）
+            temperature: 温度参数
+            max_tokens: 最大生成长度
 
-        Returns:
-            Tuple[assistant_message, updated_history]
+        Yields:
+            Tuple[截至当前已添加法规超链接的回复, 模型原始回复]
         """
+        raw_parts = []
         try:
             # 格式化历史记录
-            formatted_history = self.format_history_for_model(history)
-            formatted_history.append({"role": "user", "content": message})
-
-            # 调用模型生成回复
-            response = self.chat_model.chat(
+            formatted_history = self.format_history_for_model(history, message)
+
+            # 流式生成，边生成边为法规引用添加超链接
+            linker = StreamingLawLinker(formatter=html_link, unique=False)
+            parts = []
+            pending_tokens = 0
+            last_update = time.monotonic()
+            async for new_token in self.engine.astream_chat(
                 formatted_history,
-                max_new_tokens=512,
-                temperature=0.8,
+                max_new_tokens=int(max_tokens),
+                temperature=temperature,
                 top_p=0.9,
-            )
-
-            # 提取回复文本（注意：response 是一个列表）
-            response_text = response[0].response_text
-
-            # 为法规引用添加超链接
-            assistant_message_with_links = self.add_law_links(response_text)
-
-            # 更新历史记录
-            history.append((message, assistant_message_with_links))
-
-            return assistant_message_with_links, history
+            ):
+                raw_parts.append(new_token)
+                parts.append(linker.feed(new_token))
+                pending_tokens += 1
+                now = time.monotonic()
+                if pending_tokens >= STREAM_UPDATE_TOKENS or now - last_update >= STREAM_UPDATE_INTERVAL:
+                    pending_tokens = 0
+                    last_update = now
+                    # 末尾尚未确定的片段先原样显示
+                    yield "".join(parts) + linker.pending, "".join(raw_parts)
+
+            parts.append(linker.flush())
+            yield "".join(parts), "".join(raw_parts)
 
         except Exception as e:
-            error_msg = f"抱歉，处理过程中出现错误：{str(e)}"
-            return error_msg, history
-
-    def stream_chat(self, message: str, history: List[Tuple[str, str]]):
+            yield f"抱歉，处理过程中出现错误：{str(e)}", "".join(raw_parts)
+
+    async def respond(
+        self,
+        message: str,
+        display_history: List[Tuple[str, str]],
+        raw_history: List[Tuple[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 512,
+    ):
         """
-        流式聊天生成
+        界面事件入口：流式生成回复并逐步更新本会话的聊天记录
 
-        Args:
-            message: 用户输入的消息
-            history: 聊天历史记录
+        display_history 是界面上显示的记录（含法规超链接），raw_history 是本会话保存的
+        模型原始问答，下一轮以它作为上下文。两者都只属于当前浏览器会话。
 
         Yields:
-            生成的文本片段
+            Tuple[清空后的输入框, 显示的聊天记录, 原始聊天记录]
         """
-        try:
-            # 格式化历史记录
-            formatted_history = self.format_history_for_model(history)
-            formatted_history.append({"role": "user", "content": message})
+        if not message or not message.strip():
+            yield "", display_history, raw_history
+            return
+        if not self.ready.is_set():
+            # 保留输入框中的问题，加载完成后可直接重新发送
+            gr.Warning(self.loading_notice())
+            yield message, display_history, raw_history
+            return
+
+        display_history = display_history + [(message, "")]
+        raw_history = list(raw_history)
+        raw_text = ""
+        async for display_text, raw_text in self.stream_chat(message, raw_history, temperature, max_tokens):
+            display_history[-1] = (message, display_text)
+            yield "", display_history, raw_history
+
+        raw_history.append((message, raw_text))
+        trim_history(display_history, raw_history)
+        yield "", display_history, raw_history
 
-            # 流式生成
-            full_response = ""
-            for new_token in self.chat_model.stream_chat(
-                formatted_history,
-                max_new_tokens=512,
-                temperature=0.8,
-                top_p=0.9,
-            ):
-                full_response += new_token
-                yield full_response
+    def clear_history(self):
+        """清除本会话的聊天历史"""
+        return [], []
 
-            # 为法规引用添加超链接
-            full_response_with_links = self.add_law_links(full_response)
-            yield full_response_with_links
 
-        except Exception as e:
-            yield f"抱歉，处理过程中出现错误：{str(e)}"
+def trim_history(display_history: List[Tuple[str, str]], raw_history: List[Tuple[str, str]]):
+    """会话保存的历史超过 MAX_HISTORY_CHARS 时丢弃最早的轮次（至少保留最近一轮）"""
+    def turn_chars(turn: Tuple[str, str]) -> int:
+        return sum(len(text or "") for text in turn)
 
-    def clear_history(self):
-        """清除聊天历史"""
-        return [], []
+    total = sum(map(turn_chars, display_history)) + sum(map(turn_chars, raw_history))
+    while total > MAX_HISTORY_CHARS and len(raw_history) > 1:
+        total -= turn_chars(raw_history.pop(0))
+        if len(display_history) > len(raw_history):
+            total -= turn_chars(display_history.pop(0))
 
 
 def create_interface():
@@ -253,6 +385,9 @@ def create_interface():
             """
         )
 
+        # 每个浏览器会话独立保存的模型原始问答（界面显示的是添加了超链接的版本）
+        raw_history = gr.State([])
+
         with gr.Row():
             with gr.Column(scale=4):
                 chatbot = gr.Chatbot(
@@ -325,30 +460,27 @@ def create_interface():
                     """
                 )
 
-        # 事件绑定
+        # 事件绑定：流式输出，使用参数面板中的温度与最大生成长度
         submit.click(
-            fn=app.chat,
-            inputs=[msg, chatbot],
-            outputs=[msg, chatbot],
-        ).then(
-            fn=lambda: "",
-            outputs=msg,
+            fn=app.respond,
+            inputs=[msg, chatbot, raw_history, temperature, max_tokens],
+            outputs=[msg, chatbot, raw_history],
         )
 
         msg.submit(
-            fn=app.chat,
-            inputs=[msg, chatbot],
-            outputs=[msg, chatbot],
-        ).then(
-            fn=lambda: "",
-            outputs=msg,
+            fn=app.respond,
+            inputs=[msg, chatbot, raw_history, temperature, max_tokens],
+            outputs=[msg, chatbot, raw_history],
         )
 
         clear_btn.click(
             fn=app.clear_history,
-            outputs=[chatbot],
+            outputs=[chatbot, raw_history],
+            concurrency_limit=None,
         )
 
+    # 请求队列：同时生成的请求数与批大小一致，超出的排队，队列满时拒绝新请求
+    interface.queue(default_concurrency_limit=CONCURRENCY, max_size=MAX_QUEUE)
     return interface
 
 
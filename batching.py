@@ -0,0 +1,525 @@
+#!/usr/bin/env python3
+"""
+连续批处理调度器
+将并发请求合并到同一批次中逐步解码（iteration-level batching）：
+每个解码步之间，已完成的序列离开批次，新到达的请求加入批次。
+挂载 LoRA 适配器池时，批次中的每条序列可以使用不同的适配器。
+"""
+
+import asyncio
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterator, Callable, Deque, List, Optional, Sequence
+
+import torch
+from transformers import DynamicCache
+
+from lora_adapters import LoRAAdapterPool
+from sessions import KVCacheStore, common_prefix_length
+
+
+@dataclass
+class Response:
+    """生成结果，字段与 llamafactory.chat.base_engine.Response 一致，另附复用的会话缓存长度"""
+    response_text: str
+    response_length: int
+    prompt_length: int
+    finish_reason: str
+    cached_prompt_length: int = 0
+
+
+class _Sequence:
+    """批次中的一条序列"""
+
+    def __init__(
+        self,
+        prompt_ids: List[int],
+        max_new_tokens: int,
+        temperature: float,
+        top_p: float,
+        loop: asyncio.AbstractEventLoop,
+        session_id: Optional[str] = None,
+        adapter: Optional[str] = None,
+    ):
+        self.prompt_ids = prompt_ids
+        self.session_id = session_id
+        self.adapter = adapter
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.loop = loop
+        self.events: asyncio.Queue = asyncio.Queue()
+        self.generated: List[int] = []
+        self.length = len(prompt_ids)  # 已写入 KV 缓存的真实 token 数
+        self.cancelled = False
+        self.finished = False
+        self.cached_tokens = 0  # 复用会话 KV 缓存的提示 token 数
+        # 增量解码偏移量
+        self.prefix_offset = 0
+        self.read_offset = 0
+
+    @property
+    def reserved_tokens(self) -> int:
+        """该序列在整个生命周期中最多占用的 KV 缓存 token 数"""
+        return len(self.prompt_ids) + self.max_new_tokens
+
+    def push(self, *event):
+        """从工作线程向请求所在的事件循环投递事件"""
+        self.loop.call_soon_threadsafe(self.events.put_nowait, event)
+
+
+class BatchScheduler:
+    """
+    连续批处理调度器
+
+    在独立工作线程中运行解码循环，对外提供与 ChatModel 相同的
+    achat / astream_chat 异步接口，可直接替换 ChatModel 使用。
+    """
+
+    def __init__(
+        self,
+        model,
+        tokenizer,
+        encode_prompt: Callable[[List[dict], Optional[str]], List[int]],
+        stop_token_ids: Sequence[int],
+        max_batch_size: int = 8,
+        max_batch_tokens: int = 8192,
+        kv_store: Optional[KVCacheStore] = None,
+        adapters: Optional[LoRAAdapterPool] = None,
+    ):
+        """
+        Args:
+            model: transformers 因果语言模型
+            tokenizer: 对应的分词器
+            encode_prompt: 将 (messages, system) 编码为提示 token 的函数
+            stop_token_ids: 终止 token
+            max_batch_size: 同一批次的最大序列数
+            max_batch_tokens: 同一批次预留的 KV 缓存 token 总数上限
+            kv_store: 会话 KV 缓存，传入后同一会话的后续轮次只预填充新增 token
+            adapters: LoRA 适配器池，传入后请求可通过 adapter 参数选择适配器
+        """
+        self.model = model
+        self.tokenizer = tokenizer
+        self.encode_prompt = encode_prompt
+        self.stop_token_ids = set(stop_token_ids)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_batch_tokens = max_batch_tokens
+        self.kv_store = kv_store
+        self.adapters = adapters
+        self.device = next(model.parameters()).device
+
+        self._waiting: Deque[_Sequence] = deque()
+        self._active: List[_Sequence] = []
+        self._cond = threading.Condition()
+        self._stopped = False
+        self._thread: Optional[threading.Thread] = None
+
+        # 批次状态：左填充的 KV 缓存与注意力掩码
+        self._cache = None
+        self._attention_mask: Optional[torch.Tensor] = None
+        self._next_tokens: Optional[torch.Tensor] = None
+
+    @classmethod
+    def from_chat_model(cls, chat_model, **kwargs) -> "BatchScheduler":
+        """复用 llamafactory ChatModel 已加载的模型、分词器与对话模板"""
+        engine = chat_model.engine
+        tokenizer = engine.tokenizer
+        template = engine.template
+
+        def encode_prompt(messages: List[dict], system: Optional[str] = None) -> List[int]:
+            paired_messages = messages + [{"role": "assistant", "content": ""}]
+            prompt_ids, _ = template.encode_oneturn(tokenizer, paired_messages, system)
+            return prompt_ids
+
+        if hasattr(template, "get_stop_token_ids"):
+            stop_token_ids = template.get_stop_token_ids(tokenizer)
+        else:
+            stop_token_ids = [tokenizer.eos_token_id]
+
+        return cls(engine.model, tokenizer, encode_prompt, stop_token_ids, **kwargs)
+
+    # ------------------------------------------------------------------
+    # 生命周期
+    # ------------------------------------------------------------------
+
+    def start(self):
+        """启动解码工作线程"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="batch-scheduler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """停止解码工作线程"""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def stats(self) -> dict:
+        """当前批次状态"""
+        return {
+            "active": len(self._active),
+            "waiting": len(self._waiting),
+            "max_batch_size": self.max_batch_size,
+            "max_batch_tokens": self.max_batch_tokens,
+            "adapters": self.adapters.stats() if self.adapters is not None else None,
+        }
+
+    # ------------------------------------------------------------------
+    # 对外异步接口（与 ChatModel 保持一致）
+    # ------------------------------------------------------------------
+
+    def _submit(
+        self,
+        messages: List[dict],
+        system: Optional[str],
+        session_id: Optional[str],
+        adapter: Optional[str],
+        input_kwargs: dict,
+    ) -> _Sequence:
+        if adapter is not None and self.adapters is None:
+            raise ValueError("调度器未启用 LoRA 适配器池")
+        if system is None and messages and messages[0]["role"] == "system":
+            system, messages = messages[0]["content"], messages[1:]
+
+        seq = _Sequence(
+            prompt_ids=self.encode_prompt(messages, system),
+            max_new_tokens=input_kwargs.get("max_new_tokens", 512),
+            temperature=input_kwargs.get("temperature", 0.8),
+            top_p=input_kwargs.get("top_p", 0.9),
+            loop=asyncio.get_running_loop(),
+            session_id=session_id,
+            adapter=adapter,
+        )
+        with self._cond:
+            self._waiting.append(seq)
+            self._cond.notify()
+        return seq
+
+    async def astream_chat(
+        self,
+        messages: List[dict],
+        system: Optional[str] = None,
+        session_id: Optional[str] = None,
+        adapter: Optional[str] = None,
+        **input_kwargs,
+    ) -> AsyncIterator[str]:
+        """流式生成，逐段返回新增文本；adapter 为适配器池中的适配器名"""
+        seq = self._submit(messages, system, session_id, adapter, input_kwargs)
+        try:
+            while True:
+                event = await seq.events.get()
+                if event[0] == "token":
+                    yield event[1]
+                elif event[0] == "done":
+                    return
+                else:
+                    raise RuntimeError(event[1])
+        finally:
+            # 客户端断开时通知工作线程释放该序列
+            seq.cancelled = True
+
+    async def achat(
+        self,
+        messages: List[dict],
+        system: Optional[str] = None,
+        session_id: Optional[str] = None,
+        adapter: Optional[str] = None,
+        **input_kwargs,
+    ) -> List[Response]:
+        """生成完整回复"""
+        seq = self._submit(messages, system, session_id, adapter, input_kwargs)
+        pieces = []
+        try:
+            while True:
+                event = await seq.events.get()
+                if event[0] == "token":
+                    pieces.append(event[1])
+                elif event[0] == "done":
+                    return [Response(
+                        response_text="".join(pieces),
+                        response_length=len(seq.generated),
+                        prompt_length=len(seq.prompt_ids),
+                        finish_reason=event[1],
+                        cached_prompt_length=seq.cached_tokens,
+                    )]
+                else:
+                    raise RuntimeError(event[1])
+        finally:
+            seq.cancelled = True
+
+    # ------------------------------------------------------------------
+    # 工作线程
+    # ------------------------------------------------------------------
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._stopped and not self._waiting and not self._active:
+                    self._cond.wait()
+                if self._stopped:
+                    break
+            try:
+                with torch.inference_mode():
+                    self._admit()
+                    if self._active:
+                        self._decode_step()
+            except Exception as e:
+                # 出错时结束当前批次内的全部序列，调度器继续服务后续请求
+                for seq in self._active:
+                    seq.push("error", str(e))
+                    if self.adapters is not None:
+                        self.adapters.release(seq.adapter)
+                self._reset_batch()
+
+        for seq in list(self._active) + list(self._waiting):
+            seq.push("error", "调度器已停止")
+
+    def _reset_batch(self):
+        self._active = []
+        self._cache = None
+        self._attention_mask = None
+        self._next_tokens = None
+
+    def _admit(self):
+        """在解码步之间将等待中的请求加入批次"""
+        while True:
+            with self._cond:
+                if not self._waiting or len(self._active) >= self.max_batch_size:
+                    return
+                seq = self._waiting[0]
+                reserved = sum(s.reserved_tokens for s in self._active)
+                if self._active and reserved + seq.reserved_tokens > self.max_batch_tokens:
+                    return
+                self._waiting.popleft()
+
+            if seq.cancelled:
+                continue
+            if self.adapters is not None:
+                try:
+                    self.adapters.acquire(seq.adapter)
+                except Exception as e:
+                    # 适配器挂载失败只影响该请求
+                    seq.push("error", str(e))
+                    continue
+            try:
+                self._prefill(seq)
+            except Exception as e:
+                if seq in self._active:
+                    # 已并入批次后出错，批次状态不再可靠，由 _run 结束整个批次
+                    raise
+                # 并入批次前出错（提示有误、预填充显存不足等）只影响该请求
+                if self.adapters is not None:
+                    self.adapters.release(seq.adapter)
+                seq.push("error", str(e))
+
+    def _prefill(self, seq: _Sequence):
+        """单独预填充新序列，然后将其 KV 缓存并入批次"""
+        past_key_values, start = self._session_prefix(seq)
+        input_ids = torch.tensor([seq.prompt_ids[start:]], device=self.device)
+        if past_key_values is None:
+            outputs = self._forward([seq], input_ids=input_ids, use_cache=True)
+        else:
+            # 只预填充会话缓存之后的新增 token
+            position_ids = torch.arange(start, len(seq.prompt_ids), device=self.device).unsqueeze(0)
+            outputs = self._forward(
+                [seq],
+                input_ids=input_ids,
+                position_ids=position_ids,
+                past_key_values=DynamicCache.from_legacy_cache(past_key_values),
+                use_cache=True,
+            )
+        next_token = self._sample(outputs.logits[:, -1, :], [seq])
+        self._join(seq, outputs.past_key_values, next_token)
+        self._emit([seq], next_token.tolist())
+
+    def _session_prefix(self, seq: _Sequence):
+        """取出会话上一轮的 KV 缓存，截取与本轮提示相同的前缀部分"""
+        if self.kv_store is None or seq.session_id is None:
+            return None, 0
+        entry = self.kv_store.pop(seq.session_id, tag=seq.adapter)
+        if entry is None:
+            return None, 0
+
+        token_ids, past_key_values = entry
+        # 至少保留一个提示 token 用于计算下一个 token 的分布
+        start = min(common_prefix_length(token_ids, seq.prompt_ids), len(seq.prompt_ids) - 1)
+        if start <= 0:
+            return None, 0
+
+        seq.cached_tokens = start
+        self.kv_store.reused_tokens += start
+        return tuple((k[:, :, :start], v[:, :, :start]) for k, v in past_key_values), start
+
+    def _save_session(self, seq: _Sequence, row: int):
+        """序列结束时保存其 token 前缀与 KV 缓存（去掉左填充），供下一轮复用"""
+        width = self._attention_mask.shape[1]
+        token_ids = (seq.prompt_ids + seq.generated)[:seq.length]
+        past_key_values = tuple(
+            (k[row:row + 1, :, width - seq.length:].clone(), v[row:row + 1, :, width - seq.length:].clone())
+            for k, v in self._cache
+        )
+        self.kv_store.put(seq.session_id, token_ids, past_key_values, tag=seq.adapter)
+
+    def _join(self, seq: _Sequence, past_key_values, next_token: torch.Tensor):
+        new_cache = _to_legacy(past_key_values)
+        new_mask = torch.ones((1, seq.length), dtype=torch.long, device=self.device)
+
+        if not self._active:
+            self._cache, self._attention_mask, self._next_tokens = new_cache, new_mask, next_token
+            self._active.append(seq)
+            return
+
+        # 左填充到相同长度后沿批次维拼接
+        width = max(self._attention_mask.shape[1], new_mask.shape[1])
+        self._cache = tuple(
+            (
+                torch.cat([_left_pad(k, width), _left_pad(nk, width)], dim=0),
+                torch.cat([_left_pad(v, width), _left_pad(nv, width)], dim=0),
+            )
+            for (k, v), (nk, nv) in zip(self._cache, new_cache)
+        )
+        self._attention_mask = torch.cat(
+            [_left_pad(self._attention_mask, width), _left_pad(new_mask, width)], dim=0
+        )
+        self._next_tokens = torch.cat([self._next_tokens, next_token], dim=0)
+        self._active.append(seq)
+
+    def _decode_step(self):
+        """批次内全部序列前进一个 token"""
+        batch_size = len(self._active)
+        position_ids = torch.tensor([[seq.length] for seq in self._active], device=self.device)
+        attention_mask = torch.cat(
+            [self._attention_mask, torch.ones((batch_size, 1), dtype=torch.long, device=self.device)],
+            dim=1,
+        )
+        outputs = self._forward(
+            self._active,
+            input_ids=self._next_tokens.unsqueeze(1),
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache.from_legacy_cache(self._cache),
+            use_cache=True,
+        )
+        for seq in self._active:
+            seq.length += 1
+
+        self._cache = _to_legacy(outputs.past_key_values)
+        self._attention_mask = attention_mask
+        self._next_tokens = self._sample(outputs.logits[:, -1, :], self._active)
+        self._emit(self._active, self._next_tokens.tolist())
+
+    def _forward(self, seqs: List[_Sequence], **kwargs):
+        """前向计算；启用适配器池时每一行使用各自序列的适配器"""
+        if self.adapters is None:
+            return self.model(**kwargs)
+        return self.adapters.forward([seq.adapter for seq in seqs], **kwargs)
+
+    def _emit(self, seqs: List[_Sequence], tokens: List[int]):
+        """推送新 token，并将已完成或已取消的序列移出批次"""
+        finished = []
+        for seq, token in zip(seqs, tokens):
+            if seq.cancelled:
+                finished.append(seq)
+                continue
+
+            if token in self.stop_token_ids:
+                self._finish(seq, "stop")
+                finished.append(seq)
+                continue
+
+            seq.generated.append(token)
+            delta = self._decode_delta(seq)
+            if delta:
+                seq.push("token", delta)
+            if len(seq.generated) >= seq.max_new_tokens:
+                self._finish(seq, "length")
+                finished.append(seq)
+
+        if finished:
+            self._evict(finished)
+
+    def _finish(self, seq: _Sequence, finish_reason: str):
+        delta = self._decode_delta(seq, final=True)
+        if delta:
+            seq.push("token", delta)
+        seq.finished = True
+        seq.push("done", finish_reason)
+
+    def _evict(self, finished: List[_Sequence]):
+        if self.kv_store is not None:
+            for row, seq in enumerate(self._active):
+                if seq in finished and seq.finished and seq.session_id is not None:
+                    self._save_session(seq, row)
+        if self.adapters is not None:
+            for seq in finished:
+                self.adapters.release(seq.adapter)
+
+        keep = [i for i, seq in enumerate(self._active) if seq not in finished]
+        if not keep:
+            self._reset_batch()
+            return
+
+        index = torch.tensor(keep, device=self.device)
+        mask = self._attention_mask.index_select(0, index)
+        # 去掉所有剩余序列都是填充的前导列
+        trim = int((mask.sum(dim=0) == 0).long().cumprod(dim=0).sum().item())
+        self._attention_mask = mask[:, trim:]
+        self._cache = tuple(
+            (k.index_select(0, index)[:, :, trim:], v.index_select(0, index)[:, :, trim:])
+            for k, v in self._cache
+        )
+        self._next_tokens = self._next_tokens.index_select(0, index)
+        self._active = [self._active[i] for i in keep]
+
+    def _decode_delta(self, seq: _Sequence, final: bool = False) -> str:
+        """增量解码，避免每步对全部已生成 token 重新解码"""
+        prefix_text = self.tokenizer.decode(
+            seq.generated[seq.prefix_offset:seq.read_offset], skip_special_tokens=True
+        )
+        new_text = self.tokenizer.decode(seq.generated[seq.prefix_offset:], skip_special_tokens=True)
+        # 末尾是不完整的多字节字符时等待后续 token
+        if len(new_text) > len(prefix_text) and (final or not new_text.endswith("�")):
+            seq.prefix_offset = seq.read_offset
+            seq.read_offset = len(seq.generated)
+            return new_text[len(prefix_text):]
+        return ""
+
+    def _sample(self, logits: torch.Tensor, seqs: List[_Sequence]) -> torch.Tensor:
+        """按每条序列各自的 temperature / top_p 采样"""
+        logits = logits.float()
+        temperatures = torch.tensor([seq.temperature for seq in seqs], device=logits.device)
+        top_ps = torch.tensor([seq.top_p for seq in seqs], device=logits.device)
+
+        greedy = temperatures <= 0
+        probs = torch.softmax(logits / temperatures.clamp(min=1e-5).unsqueeze(1), dim=-1)
+
+        sorted_probs, sorted_indices = torch.sort(probs, dim=-1, descending=True)
+        cumulative = torch.cumsum(sorted_probs, dim=-1)
+        sorted_probs[(cumulative - sorted_probs) > top_ps.unsqueeze(1)] = 0.0
+        sampled = sorted_indices.gather(1, torch.multinomial(sorted_probs, num_samples=1)).squeeze(1)
+
+        if greedy.any():
+            sampled = torch.where(greedy, logits.argmax(dim=-1), sampled)
+        return sampled
+
+
+def _to_legacy(past_key_values):
+    """统一转换为 ((key, value), ...) 形式的 KV 缓存"""
+    if hasattr(past_key_values, "to_legacy_cache"):
+        return past_key_values.to_legacy_cache()
+    return past_key_values
+
+
+def _left_pad(tensor: torch.Tensor, width: int) -> torch.Tensor:
+    """在序列维（掩码为 dim 1，KV 缓存为 dim 2）左侧补零到指定长度"""
+    seq_dim = 1 if tensor.dim() == 2 else 2
+    pad = width - tensor.shape[seq_dim]
+    if pad <= 0:
+        return tensor
+    shape = list(tensor.shape)
+    shape[seq_dim] = pad
+    return torch.cat([tensor.new_zeros(shape), tensor], dim=seq_dim)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+服务端压测工具
+以指定并发数向 /v1/chat/completions 发送流式与非流式请求，统计吞吐、
+端到端延迟、首 token 延迟（TTFT）与 token 间隔（ITL）的 p50/p95/p99，
+结果可写入 JSON 文件，便于比较不同提交的性能。
+
+未指定 --url 时在子进程中启动 api_server，并用 fake_backend.FakeChatModel 代替真实模型，
+只需 CPU 即可运行。
+
+用法：
+    python benchmark.py run --concurrency 1,8,32 --requests 200 --output bench.json
+    python benchmark.py run --url http://localhost:8000 --concurrency 4
+    python benchmark.py compare old.json new.json
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+
+# 压测使用的问题（短问题与带案情描述的长问题）
+SHORT_PROMPTS = [
+    "什么是正当防卫？",
+    "劳动合同到期不续签有补偿吗？",
+    "借款合同的诉讼时效是多久？",
+    "交通事故责任如何认定？",
+    "离婚时夫妻共同财产如何分割？",
+]
+
+LONG_PROMPTS = [
+    "我在一家公司工作了三年零四个月，公司以经营困难为由单方面解除劳动合同，"
+    "没有提前三十天书面通知，也没有支付任何补偿。我每月工资八千元，请问我可以主张哪些权利，"
+    "经济补偿和代通知金分别怎么计算？如果公司拒绝支付，我应该先申请劳动仲裁还是直接起诉？" * 2,
+    "朋友向我借了二十万元用于装修，当时只打了一张借条，写明一年内归还，没有约定利息。"
+    "现在已经过去两年，他一直以各种理由拖延，最近还换了手机号。请问借条是否仍然有效，"
+    "诉讼时效从什么时候开始计算，我能否主张逾期利息，起诉时需要准备哪些证据？" * 2,
+]
+
+
+@dataclass
+class RequestResult:
+    """单个请求的测量结果（时间单位：秒）；ttft 与 itl 只有流式请求才有"""
+    stream: bool
+    status: int
+    latency: float
+    ttft: Optional[float] = None
+    itl: List[float] = field(default_factory=list)
+    output_chars: int = 0
+    error: Optional[str] = None
+
+    @property
+    def ok(self) -> bool:
+        return self.status == 200 and self.error is None
+
+
+def percentile(values: List[float], p: float) -> Optional[float]:
+    """最近秩法百分位数"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(values: List[float]) -> Optional[dict]:
+    """毫秒为单位的分布统计"""
+    if not values:
+        return None
+    return {
+        "p50": round(percentile(values, 50) * 1000, 2),
+        "p95": round(percentile(values, 95) * 1000, 2),
+        "p99": round(percentile(values, 99) * 1000, 2),
+        "mean": round(sum(values) / len(values) * 1000, 2),
+    }
+
+
+def build_plan(args, count: int, rng: random.Random) -> List[dict]:
+    """按请求配比生成请求列表"""
+    plan = []
+    for i in range(count):
+        prompts = LONG_PROMPTS if rng.random() < args.long_ratio else SHORT_PROMPTS
+        prompt = rng.choice(prompts)
+        if args.unique:
+            # 追加序号，避免命中回复缓存与近似问题缓存
+            prompt = f"{prompt}（{i}）"
+        plan.append({
+            "stream": rng.random() < args.stream_ratio,
+            "payload": {
+                "messages": [{"role": "user", "content": prompt}],
+                "temperature": args.temperature,
+                "max_tokens": args.max_tokens,
+                "enable_law_links": True,
+            },
+        })
+    return plan
+
+
+async def send_request(client: httpx.AsyncClient, url: str, item: dict, headers: dict) -> RequestResult:
+    """发送一个请求并记录延迟；流式请求记录首 token 时间与 token 间隔"""
+    payload = dict(item["payload"], stream=item["stream"])
+    start = time.perf_counter()
+    try:
+        if not item["stream"]:
+            response = await client.post(url, json=payload, headers=headers)
+            latency = time.perf_counter() - start
+            if response.status_code != 200:
+                return RequestResult(False, response.status_code, latency)
+            content = response.json()["content"]
+            # 非流式请求没有首 token 时间，TTFT 只统计流式请求
+            return RequestResult(False, 200, latency, output_chars=len(content))
+
+        ttft, last, itl, chars = None, None, [], 0
+        async with client.stream("POST", url, json=payload, headers=headers) as response:
+            if response.status_code != 200:
+                await response.aread()
+                return RequestResult(True, response.status_code, time.perf_counter() - start)
+            async for line in response.aiter_lines():
+                if not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                chunk = json.loads(data)
+                if "error" in chunk:
+                    return RequestResult(True, 200, time.perf_counter() - start, error=chunk["error"]["message"])
+                content = chunk["choices"][0]["delta"].get("content")
+                if not content:
+                    continue
+                now = time.perf_counter()
+                if ttft is None:
+                    ttft = now - start
+                else:
+                    itl.append(now - last)
+                last = now
+                chars += len(content)
+        return RequestResult(True, 200, time.perf_counter() - start, ttft=ttft, itl=itl, output_chars=chars)
+    except httpx.HTTPError as e:
+        return RequestResult(item["stream"], 0, time.perf_counter() - start, error=str(e))
+
+
+async def run_level(base_url: str, concurrency: int, plan: List[dict], headers: dict, timeout: float) -> dict:
+    """以固定并发数（闭环：每个并发槽位完成一个请求后立即发送下一个）执行请求列表"""
+    url = f"{base_url.rstrip('/')}/v1/chat/completions"
+    queue = list(reversed(plan))
+    results: List[RequestResult] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(timeout=timeout, limits=limits) as client:
+        async def worker():
+            while queue:
+                results.append(await send_request(client, url, queue.pop(), headers))
+
+        start = time.perf_counter()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        duration = time.perf_counter() - start
+
+    ok = [r for r in results if r.ok]
+    status_counts: Dict[str, int] = {}
+    for r in results:
+        key = str(r.status) if r.error is None else "error"
+        status_counts[key] = status_counts.get(key, 0) + 1
+
+    def path_stats(stream: bool) -> Optional[dict]:
+        selected = [r for r in ok if r.stream == stream]
+        if not selected:
+            return None
+        return {
+            "requests": len(selected),
+            "latency_ms": summarize([r.latency for r in selected]),
+            "ttft_ms": summarize([r.ttft for r in selected if r.ttft is not None]),
+            "itl_ms": summarize([gap for r in selected for gap in r.itl]),
+        }
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "succeeded": len(ok),
+        "status_counts": status_counts,
+        "duration_s": round(duration, 3),
+        "throughput_rps": round(len(ok) / duration, 3) if duration else None,
+        "output_chars_per_s": round(sum(r.output_chars for r in ok) / duration, 1) if duration else None,
+        "latency_ms": summarize([r.latency for r in ok]),
+        "stream": path_stats(True),
+        "non_stream": path_stats(False),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_fake_server(args) -> Tuple[subprocess.Popen, str]:
+    """在子进程中启动使用模拟后端的 api_server，等待模型加载完成"""
+    port = _free_port()
+    command = [
+        sys.executable, os.path.abspath(__file__), "serve-fake",
+        "--port", str(port),
+        "--token-delay", str(args.token_delay),
+        "--prefill-delay", str(args.prefill_delay),
+        "--response-tokens", str(args.response_tokens),
+        "--max-parallel", str(args.max_parallel),
+    ]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("模拟服务启动失败")
+        try:
+            if httpx.get(f"{base_url}/health", timeout=1).json().get("model_loaded"):
+                return process, base_url
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("等待模拟服务启动超时")
+
+
+def serve_fake(options):
+    """子进程入口：用 FakeChatModel 替换真实模型后运行 api_server"""
+    import uvicorn
+
+    import api_server
+    from fake_backend import FakeChatModel
+
+    def factory(args=None):
+        return FakeChatModel(
+            args,
+            token_delay=options.token_delay,
+            prefill_delay=options.prefill_delay,
+            response_tokens=options.response_tokens,
+            max_parallel=options.max_parallel,
+        )
+
+    api_server.registry.chat_model_factory = factory
+    uvicorn.run(api_server.app, host="127.0.0.1", port=options.port, log_level="warning")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_level(level: dict):
+    def fmt(stats: Optional[dict], key: str) -> str:
+        if stats is None or stats.get(key) is None:
+            return "-"
+        s = stats[key]
+        return f"{s['p50']:.0f}/{s['p95']:.0f}/{s['p99']:.0f}"
+
+    print(f"并发 {level['concurrency']:>4} | 成功 {level['succeeded']}/{level['requests']} "
+          f"| {level['throughput_rps']:.2f} req/s | {level['output_chars_per_s']:.0f} 字/s "
+          f"| 状态码 {level['status_counts']}")
+    for name, key in (("流式", "stream"), ("非流式", "non_stream")):
+        stats = level[key]
+        if stats is None:
+            continue
+        print(f"    {name:<4} n={stats['requests']:<5} 延迟 p50/p95/p99 {fmt(stats, 'latency_ms')} ms"
+              f" | TTFT {fmt(stats, 'ttft_ms')} ms | ITL {fmt(stats, 'itl_ms')} ms")
+
+
+def run(args):
+    process = None
+    base_url = args.url
+    if base_url is None:
+        process, base_url = start_fake_server(args)
+        print(f"模拟服务已启动: {base_url}（token_delay={args.token_delay}s, "
+              f"prefill_delay={args.prefill_delay}s, response_tokens={args.response_tokens}）")
+
+    headers = {"X-Cache-Bypass": "1"} if args.cache_bypass else {}
+    rng = random.Random(args.seed)
+    levels = []
+    try:
+        if args.warmup:
+            asyncio.run(run_level(base_url, 1, build_plan(args, args.warmup, rng), headers, args.timeout))
+        for concurrency in [int(c) for c in args.concurrency.split(",")]:
+            level = asyncio.run(run_level(
+                base_url, concurrency, build_plan(args, args.requests, rng), headers, args.timeout
+            ))
+            levels.append(level)
+            print_level(level)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    result = {
+        "meta": {
+            "timestamp": int(time.time()),
+            "git_commit": git_commit(),
+            "backend": "fake" if args.url is None else args.url,
+            "args": {k: v for k, v in vars(args).items() if k not in ("command", "output")},
+        },
+        "levels": levels,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+
+
+def compare(args):
+    """对比两次压测结果中相同并发数下的吞吐与延迟"""
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        baseline = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        candidate = {level["concurrency"]: level for level in json.load(f)["levels"]}
+
+    def change(old, new) -> str:
+        if old is None or new is None:
+            return "-"
+        if old == 0:
+            return f"{old} -> {new}"
+        return f"{old} -> {new} ({(new - old) / old * 100:+.1f}%)"
+
+    common = sorted(set(baseline) & set(candidate))
+    if not common:
+        print("两次结果没有相同的并发级别")
+        return
+
+    for concurrency in common:
+        old, new = baseline[concurrency], candidate[concurrency]
+        print(f"并发 {concurrency}")
+        print(f"  吞吐 req/s : {change(old['throughput_rps'], new['throughput_rps'])}")
+        for key in ("stream", "non_stream"):
+            if old[key] is None or new[key] is None:
+                continue
+            for metric in ("latency_ms", "ttft_ms", "itl_ms"):
+                if old[key][metric] and new[key][metric]:
+                    print(f"  {key} {metric} p95 : {change(old[key][metric]['p95'], new[key][metric]['p95'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='服务端压测工具')
+    subparsers = parser.add_subparsers(dest='command', help='子命令')
+
+    def add_backend_args(p):
+        p.add_argument('--token-delay', type=float, default=0.02, help='模拟后端每个 token 的耗时（秒）')
+        p.add_argument('--prefill-delay', type=float, default=0.0002, help='模拟后端每个提示字符的预填充耗时（秒）')
+        p.add_argument('--response-tokens', type=int, default=128, help='模拟后端生成的 token 数')
+        p.add_argument('--max-parallel', type=int, default=0, help='模拟后端同时生成的请求数上限，0 表示不限制')
+
+    # run 命令
+    run_parser = subparsers.add_parser('run', help='执行压测')
+    run_parser.add_argument('--url', help='压测已运行的服务（如 http://localhost:8000），默认启动模拟服务')
+    run_parser.add_argument('--concurrency', default='1,4,16', help='并发数，逗号分隔依次测试')
+    run_parser.add_argument('--requests', type=int, default=100, help='每个并发级别发送的请求数')
+    run_parser.add_argument('--warmup', type=int, default=2, help='预热请求数')
+    run_parser.add_argument('--stream-ratio', type=float, default=0.5, help='流式请求占比')
+    run_parser.add_argument('--long-ratio', type=float, default=0.2, help='长问题占比')
+    run_parser.add_argument('--max-tokens', type=int, default=512, help='请求的 max_tokens')
+    run_parser.add_argument('--temperature', type=float, default=0.8, help='请求的 temperature')
+    run_parser.add_argument('--unique', action='store_true', help='为每个问题追加序号，避免命中缓存')
+    run_parser.add_argument('--cache-bypass', action='store_true', help='发送 X-Cache-Bypass 请求头')
+    run_parser.add_argument('--timeout', type=float, default=300, help='单个请求超时（秒）')
+    run_parser.add_argument('--seed', type=int, default=0, help='请求配比的随机种子')
+    run_parser.add_argument('--output', help='结果 JSON 文件路径')
+    add_backend_args(run_parser)
+
+    # compare 命令
+    compare_parser = subparsers.add_parser('compare', help='对比两次压测结果')
+    compare_parser.add_argument('baseline', help='基准结果 JSON')
+    compare_parser.add_argument('candidate', help='待比较结果 JSON')
+
+    # serve-fake 命令（由 run 在子进程中调用）
+    serve_parser = subparsers.add_parser('serve-fake', help='使用模拟后端启动 API 服务')
+    serve_parser.add_argument('--port', type=int, default=8000, help='监听端口')
+    add_backend_args(serve_parser)
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'compare':
+        compare(args)
+    elif args.command == 'serve-fake':
+        serve_fake(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
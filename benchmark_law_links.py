@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+"""
+法规引用识别微基准
+用确定性生成的中文法律文本语料（从简短回答到引用密集的 1 MB 判决书）测量
+extract_law_references、add_law_links、流式加链接与 /v1/chat/analyze 接口的
+吞吐（MB/s）、内存分配与峰值内存，并检查病态输入（大量未闭合的《等）下耗时保持线性、
+流式加链接与整段加链接的结果一致。
+
+用法：
+    python benchmark_law_links.py run --output law_bench.json
+    python benchmark_law_links.py guard
+    python benchmark_law_links.py corpus --dir ./law_corpus
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from law_links import StreamingLawLinker, add_law_links, find_citations
+
+
+# 语料规格：名称 -> 目标大小（UTF-8 字节）与引用密度（每句插入引用的概率）
+CORPUS_SPECS = {
+    "answer": (1 << 10, 0.5),
+    "consultation": (16 << 10, 0.4),
+    "opinion": (128 << 10, 0.5),
+    "judgment": (1 << 20, 0.8),
+}
+
+LAW_NAMES = [
+    "中华人民共和国刑法", "中华人民共和国民法典", "中华人民共和国劳动合同法",
+    "中华人民共和国民事诉讼法", "中华人民共和国刑事诉讼法", "中华人民共和国公司法",
+    "中华人民共和国道路交通安全法", "最高人民法院关于审理民间借贷案件适用法律若干问题的规定",
+    "工伤保险条例", "中华人民共和国劳动争议调解仲裁法", "最高人民法院关于适用《中华人民共和国民法典》合同编通则若干问题的解释",
+]
+
+FILLER_SENTENCES = [
+    "本院经审理查明，原告与被告于二〇一九年三月签订书面合同，约定被告按期履行付款义务",
+    "被告辩称其已按约履行全部义务，原告的诉讼请求缺乏事实和法律依据，请求法院予以驳回",
+    "上述事实，有双方当事人陈述、借款合同、银行转账凭证及庭审笔录等证据在案佐证",
+    "本院认为，当事人应当按照约定全面履行自己的义务，遵循诚信原则",
+    "关于违约金的数额，被告主张约定过高，但未提交相应证据予以证明",
+    "劳动者在用人单位连续工作满十年的，可以要求订立无固定期限劳动合同",
+    "行为人因过错侵害他人民事权益造成损害的，应当承担侵权责任",
+]
+
+CN_DIGITS = "一二三四五六七八九"
+
+
+def cn_number(n: int) -> str:
+    """1-999 的中文数字"""
+    hundreds, rest = divmod(n, 100)
+    tens, ones = divmod(rest, 10)
+    text = ""
+    if hundreds:
+        text += CN_DIGITS[hundreds - 1] + "百"
+        if rest and tens == 0:
+            text += "零"
+    if tens:
+        text += ("" if tens == 1 and not hundreds else CN_DIGITS[tens - 1]) + "十"
+    if ones:
+        text += CN_DIGITS[ones - 1]
+    return text
+
+
+def _citation(rng: random.Random) -> str:
+    article = rng.randint(1, 1260)
+    number = cn_number(article) if article < 1000 and rng.random() < 0.8 else str(article)
+    citation = f"第{number}条"
+    if rng.random() < 0.4:
+        citation += f"第{cn_number(rng.randint(1, 5))}款"
+    if rng.random() < 0.2:
+        citation += f"第{cn_number(rng.randint(1, 9))}项"
+    if rng.random() < 0.7:
+        citation = f"《{rng.choice(LAW_NAMES)}》" + citation
+    return citation
+
+
+def generate_text(size: int, density: float, seed: int = 0) -> str:
+    """生成 UTF-8 编码约 size 字节的法律文本，每句以 density 的概率引用法规"""
+    rng = random.Random(seed)
+    parts = []
+    length = 0
+    while length < size:
+        sentence = rng.choice(FILLER_SENTENCES)
+        if rng.random() < density:
+            sentence = f"根据{_citation(rng)}的规定，{sentence}"
+            if rng.random() < 0.3:
+                sentence += f"，并参照{_citation(rng)}"
+        sentence += "。"
+        parts.append(sentence)
+        length += len(sentence.encode("utf-8"))
+    return "".join(parts)
+
+
+def build_corpus(names: Optional[List[str]] = None, seed: int = 0) -> Dict[str, str]:
+    return {
+        name: generate_text(size, density, seed)
+        for name, (size, density) in CORPUS_SPECS.items()
+        if names is None or name in names
+    }
+
+
+# ----------------------------------------------------------------------
+# 被测操作
+# ----------------------------------------------------------------------
+
+def stream_link(text: str, token_size: int = 4) -> str:
+    """按固定长度切分为 token 后逐个送入流式加链接器"""
+    linker = StreamingLawLinker()
+    pieces = [linker.feed(text[i:i + token_size]) for i in range(0, len(text), token_size)]
+    pieces.append(linker.flush())
+    return "".join(pieces)
+
+
+def make_analyze_call() -> Callable[[str], dict]:
+    """通过 ASGI 直接调用 /v1/chat/analyze（不启动模型）"""
+    import httpx
+
+    import api_server
+
+    transport = httpx.ASGITransport(app=api_server.app)
+    loop = asyncio.new_event_loop()
+    client = httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+    def call(text: str) -> dict:
+        response = loop.run_until_complete(
+            client.post("/v1/chat/analyze", json=[{"role": "assistant", "content": text}])
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return call
+
+
+# ----------------------------------------------------------------------
+# 测量
+# ----------------------------------------------------------------------
+
+def measure(func: Callable[[str], object], text: str, min_time: float = 0.5, min_runs: int = 3) -> dict:
+    """
+    重复执行直到累计耗时超过 min_time，返回吞吐与内存统计
+
+    retained_blocks / retained_bytes 为单次执行结束时仍存活（被结果引用）的内存块数与字节数，
+    peak_bytes 为单次执行期间相对执行前的峰值内存。
+    """
+    func(text)  # 预热
+    durations = []
+    total = 0.0
+    while len(durations) < min_runs or total < min_time:
+        start = time.perf_counter()
+        func(text)
+        elapsed = time.perf_counter() - start
+        durations.append(elapsed)
+        total += elapsed
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        result = func(text)
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    diff = after.compare_to(before, "filename")
+    del result
+
+    size_mb = len(text.encode("utf-8")) / (1 << 20)
+    median = statistics.median(durations)
+    return {
+        "runs": len(durations),
+        "median_ms": round(median * 1000, 3),
+        "min_ms": round(min(durations) * 1000, 3),
+        "mb_per_s": round(size_mb / median, 2) if median else None,
+        "retained_blocks": sum(max(0, stat.count_diff) for stat in diff),
+        "retained_bytes": sum(max(0, stat.size_diff) for stat in diff),
+        "peak_bytes": peak - baseline,
+    }
+
+
+def run(args):
+    from api_server import extract_law_references
+
+    corpus = build_corpus(args.sizes.split(",") if args.sizes else None, seed=args.seed)
+    operations = {
+        "extract_law_references": extract_law_references,
+        "add_law_links": add_law_links,
+        "stream_link": stream_link,
+    }
+    if not args.skip_endpoint:
+        operations["analyze_endpoint"] = make_analyze_call()
+
+    results = []
+    for name, text in corpus.items():
+        citations = len(find_citations(text))
+        size = len(text.encode("utf-8"))
+        print(f"{name}: {size / 1024:.1f} KB，{citations} 处引用")
+        for op_name, func in operations.items():
+            stats = measure(func, text, min_time=args.min_time)
+            results.append({"corpus": name, "bytes": size, "citations": citations, "operation": op_name, **stats})
+            print(f"    {op_name:<24} {stats['median_ms']:>10.2f} ms  {stats['mb_per_s']:>8.2f} MB/s  "
+                  f"峰值 {stats['peak_bytes'] / 1024:>9.1f} KB  存活 {stats['retained_blocks']} 块")
+
+    guard_results = run_guard(args.guard_max_ratio, args.guard_min_mbps) + run_streaming_check()
+    output = {
+        "meta": {"timestamp": int(time.time()), "python": sys.version.split()[0], "seed": args.seed},
+        "results": results,
+        "guard": guard_results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"结果已写入 {args.output}")
+    if not all(g["passed"] for g in guard_results):
+        sys.exit(1)
+
+
+# ----------------------------------------------------------------------
+# 病态输入检查
+# ----------------------------------------------------------------------
+
+# 病态输入：名称 -> 生成约 n 个字符的函数
+PATHOLOGICAL_INPUTS = {
+    "unclosed_brackets": lambda n: "《" * n,
+    "unclosed_long_title": lambda n: "《" + "中" * (n - 1),
+    "near_max_titles": lambda n: ("《" + "法" * 59) * (n // 60),
+    "nested_brackets": lambda n: "《中华人民共和国《" * (n // 9),
+    "bare_di": lambda n: "第" * n,
+    "long_numeral": lambda n: "第" + "一" * (n - 1),
+    "numeral_no_suffix": lambda n: ("第" + "一" * 12) * (n // 13),
+}
+
+
+def run_guard(max_ratio: float = 8.0, min_mbps: float = 1.0, size: int = 250_000) -> List[dict]:
+    """
+    检查病态输入下的耗时：输入增大 4 倍时耗时增长不超过 max_ratio 倍（线性约为 4），
+    且最大输入的吞吐不低于 min_mbps
+    """
+    results = []
+    print("病态输入检查:")
+    for name, make in PATHOLOGICAL_INPUTS.items():
+        timings = []
+        for n in (size, size * 4):
+            text = make(n)
+            start = time.perf_counter()
+            add_law_links(text)
+            find_citations(text)
+            timings.append((len(text.encode("utf-8")), time.perf_counter() - start))
+
+        ratio = timings[1][1] / max(timings[0][1], 1e-9)
+        mbps = timings[1][0] / (1 << 20) / max(timings[1][1], 1e-9)
+        passed = ratio <= max_ratio and mbps >= min_mbps
+        results.append({
+            "input": name,
+            "bytes": timings[1][0],
+            "seconds": round(timings[1][1], 4),
+            "scaling_ratio": round(ratio, 2),
+            "mb_per_s": round(mbps, 2),
+            "passed": passed,
+        })
+        print(f"    {'通过' if passed else '失败'} {name:<22} {timings[1][0] / (1 << 20):.2f} MB "
+              f"{timings[1][1] * 1000:>8.1f} ms  增长 {ratio:.1f} 倍  {mbps:.1f} MB/s")
+    return results
+
+
+# 流式与整段加链接必须一致的边界输入
+STREAMING_CASES = [
+    "《" + "甲" * 60 + "条例》第三条",
+    "《" + "甲" * 60 + "法》第十二条第二款",
+    "《" + "甲" * 59 + "解释》与《" + "乙" * 61 + "条例》",
+    "依据《中华人民共和国劳动合同法》第四十七条第一款第二项",
+    "第一二三四五六七八九十百千条" + "第" + "一" * 13 + "条",
+]
+
+
+def run_streaming_check(token_sizes=(1, 2, 3, 4, 7, 16)) -> List[dict]:
+    """检查各种切分方式下流式加链接的结果与 add_law_links 一致"""
+    results = []
+    print("流式一致性检查:")
+    for text in STREAMING_CASES:
+        expected = add_law_links(text)
+        mismatched = [n for n in token_sizes if stream_link(text, n) != expected]
+        results.append({"input": text, "mismatched_token_sizes": mismatched, "passed": not mismatched})
+        print(f"    {'通过' if not mismatched else '失败'} {text[:24]}…"
+              + (f"  token 长度 {mismatched} 不一致" if mismatched else ""))
+    return results
+
+
+def guard(args):
+    guard_results = run_guard(args.max_ratio, args.min_mbps) + run_streaming_check()
+    if not all(g["passed"] for g in guard_results):
+        sys.exit(1)
+
+
+def write_corpus(args):
+    """将生成的语料写入目录，便于其他工具复用"""
+    directory = Path(args.dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    for name, text in build_corpus(seed=args.seed).items():
+        path = directory / f"{name}.txt"
+        path.write_text(text, encoding="utf-8")
+        print(f"{path}: {os.path.getsize(path) / 1024:.1f} KB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='法规引用识别微基准')
+    subparsers = parser.add_subparsers(dest='command', help='子命令')
+
+    # run 命令
+    run_parser = subparsers.add_parser('run', help='执行基准测试（包含病态输入检查）')
+    run_parser.add_argument('--sizes', help=f"语料规格，逗号分隔（可选: {', '.join(CORPUS_SPECS)}）")
+    run_parser.add_argument('--min-time', type=float, default=0.5, help='每项测量的最短累计耗时（秒）')
+    run_parser.add_argument('--skip-endpoint', action='store_true', help='跳过 /v1/chat/analyze 接口测量')
+    run_parser.add_argument('--seed', type=int, default=0, help='语料随机种子')
+    run_parser.add_argument('--guard-max-ratio', type=float, default=8.0, help='病态输入允许的耗时增长倍数')
+    run_parser.add_argument('--guard-min-mbps', type=float, default=1.0, help='病态输入的最低吞吐（MB/s）')
+    run_parser.add_argument('--output', help='结果 JSON 文件路径')
+
+    # guard 命令
+    guard_parser = subparsers.add_parser('guard', help='只执行病态输入与流式一致性检查，失败时返回非零退出码')
+    guard_parser.add_argument('--max-ratio', type=float, default=8.0, help='输入增大 4 倍时允许的耗时增长倍数')
+    guard_parser.add_argument('--min-mbps', type=float, default=1.0, help='最低吞吐（MB/s）')
+
+    # corpus 命令
+    corpus_parser = subparsers.add_parser('corpus', help='导出生成的语料')
+    corpus_parser.add_argument('--dir', required=True, help='输出目录')
+    corpus_parser.add_argument('--seed', type=int, default=0, help='语料随机种子')
+
+    args = parser.parse_args()
+
+    if args.command == 'run':
+        run(args)
+    elif args.command == 'guard':
+        guard(args)
+    elif args.command == 'corpus':
+        write_corpus(args)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
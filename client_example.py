@@ -6,7 +6,7 @@ FastAPI 客户端示例
 
 import requests
 import json
-from typing import List, Dict
+from typing import Dict, Iterator, List, Optional
 
 
 class LawyerAIClient:
@@ -28,7 +28,8 @@ class LawyerAIClient:
         temperature: float = 0.8,
         max_tokens: int = 512,
         top_p: float = 0.9,
-        enable_law_links: bool = True
+        enable_law_links: bool = True,
+        model: Optional[str] = None
     ) -> Dict:
         """
         发起对话请求
@@ -39,6 +40,7 @@ class LawyerAIClient:
             max_tokens: 最大生成长度
             top_p: Top-p 采样参数
             enable_law_links: 是否启用法规超链接
+            model: 模型 ID（见 /v1/models），为空时使用服务端默认模型
 
         Returns:
             API 响应
@@ -52,6 +54,8 @@ class LawyerAIClient:
             "top_p": top_p,
             "enable_law_links": enable_law_links
         }
+        if model:
+            payload["model"] = model
 
         try:
             response = requests.post(url, json=payload, timeout=300)
@@ -61,6 +65,55 @@ class LawyerAIClient:
             print(f"请求失败: {e}")
             return None
 
+    def chat_stream(
+        self,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.8,
+        max_tokens: int = 512,
+        top_p: float = 0.9,
+        enable_law_links: bool = True,
+        model: Optional[str] = None
+    ) -> Iterator[Dict]:
+        """
+        发起流式对话请求（SSE）
+
+        Args:
+            messages: 对话历史
+            temperature: 温度参数
+            max_tokens: 最大生成长度
+            top_p: Top-p 采样参数
+            enable_law_links: 是否启用法规超链接
+            model: 模型 ID（见 /v1/models），为空时使用服务端默认模型
+
+        Yields:
+            OpenAI 风格的数据块，最后一个数据块包含 law_references
+        """
+        url = f"{self.api_base}/chat/completions"
+
+        payload = {
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+            "stream": True,
+            "enable_law_links": enable_law_links
+        }
+        if model:
+            payload["model"] = model
+
+        try:
+            with requests.post(url, json=payload, stream=True, timeout=300) as response:
+                response.raise_for_status()
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line or not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    yield json.loads(data)
+        except requests.exceptions.RequestException as e:
+            print(f"请求失败: {e}")
+
     def analyze_law_references(self, messages: List[Dict[str, str]]) -> Dict:
         """
         分析法规引用
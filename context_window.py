@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+上下文窗口管理
+按模型分词器统计提示 token 数，在预算内保留 system 消息与最近的若干轮对话：
+较早的轮次整轮丢弃，仅剩本轮消息仍超出预算时折叠其中间部分。
+每条消息的 token 数按内容缓存，多轮对话中历史消息不会被重复分词。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+
+# 未在 config_models.yaml 中配置 max_prompt_tokens 时的提示 token 预算
+DEFAULT_MAX_PROMPT_TOKENS = 6144
+
+# 对话模板为每条消息附加的角色标记等 token 数（Qwen 模板约 5 个，取保守值）
+MESSAGE_OVERHEAD_TOKENS = 8
+
+COLLAPSE_MARKER = "\n……（中间省略 {} 字）……\n"
+
+
+class ContextWindow:
+    """
+    提示 token 预算管理器
+
+    fit() 返回送入模型的消息列表与截断报告，不修改传入的消息列表，
+    服务端保存的会话历史仍是完整的。
+    """
+
+    def __init__(
+        self,
+        count_tokens: Callable[[str], int],
+        max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS,
+        message_overhead: int = MESSAGE_OVERHEAD_TOKENS,
+        cache_size: int = 4096,
+    ):
+        """
+        Args:
+            count_tokens: 文本 -> token 数
+            max_prompt_tokens: 提示 token 预算，0 表示不截断
+            message_overhead: 每条消息额外计入的 token 数
+            cache_size: 缓存 token 数的消息条数上限（LRU）
+        """
+        self.count_tokens = count_tokens
+        self.max_prompt_tokens = max_prompt_tokens
+        self.message_overhead = message_overhead
+        self.cache_size = cache_size
+
+        self._counts: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @classmethod
+    def from_chat_model(cls, chat_model, max_prompt_tokens: int = DEFAULT_MAX_PROMPT_TOKENS) -> "ContextWindow":
+        """使用 ChatModel 的分词器计数；没有分词器的推理后端按字符数估算"""
+        tokenizer = getattr(getattr(chat_model, "engine", None), "tokenizer", None)
+        if tokenizer is None:
+            return cls(len, max_prompt_tokens)
+        return cls(lambda text: len(tokenizer.encode(text, add_special_tokens=False)), max_prompt_tokens)
+
+    def message_tokens(self, message: dict) -> int:
+        """单条消息的 token 数（含模板开销），按角色与内容缓存"""
+        key = (message["role"], message["content"])
+        with self._lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                self.hits += 1
+                return count
+
+        count = self.count_tokens(message["content"]) + self.message_overhead
+        with self._lock:
+            self.misses += 1
+            self._counts[key] = count
+            while len(self._counts) > self.cache_size:
+                self._counts.popitem(last=False)
+        return count
+
+    def fit(self, messages: List[dict]) -> Tuple[List[dict], dict]:
+        """
+        将消息列表截断到预算以内
+
+        system 消息与最后一条消息始终保留；其余消息从最早的一轮开始整轮丢弃，
+        保留部分总以 user 消息开头。
+
+        Returns:
+            (送入模型的消息列表, 截断报告)
+        """
+        counts = [self.message_tokens(m) for m in messages]
+        total = sum(counts)
+        report = {
+            "prompt_tokens": total,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "dropped_messages": 0,
+            "dropped_tokens": 0,
+            "collapsed_messages": 0,
+        }
+        if self.max_prompt_tokens <= 0 or total <= self.max_prompt_tokens or len(messages) == 0:
+            return messages, report
+
+        system_tokens = sum(c for m, c in zip(messages, counts) if m["role"] == "system")
+        turns = [i for i, m in enumerate(messages) if m["role"] != "system"]
+
+        # 从最后一条消息向前累加，记录预算内最早的 user 消息位置
+        keep_from = len(turns) - 1
+        used = system_tokens
+        for pos in range(len(turns) - 1, -1, -1):
+            used += counts[turns[pos]]
+            if used > self.max_prompt_tokens and pos < len(turns) - 1:
+                break
+            if messages[turns[pos]]["role"] == "user":
+                keep_from = pos
+
+        dropped = set(turns[:keep_from])
+        kept = [m for i, m in enumerate(messages) if i not in dropped]
+        report["dropped_messages"] = len(dropped)
+        report["dropped_tokens"] = sum(counts[i] for i in dropped)
+        report["prompt_tokens"] = total - report["dropped_tokens"]
+
+        # 只剩本轮消息仍超出预算：折叠最后一条消息的中间部分
+        overflow = report["prompt_tokens"] - self.max_prompt_tokens
+        if overflow > 0 and kept and kept[-1]["role"] != "system":
+            last = kept[-1]
+            last_tokens = counts[len(messages) - 1]
+            collapsed = self._collapse(last, last_tokens - overflow)
+            if collapsed is not None:
+                kept[-1] = collapsed
+                report["collapsed_messages"] = 1
+                report["prompt_tokens"] += self.message_tokens(collapsed) - last_tokens
+
+        return kept, report
+
+    def _collapse(self, message: dict, target_tokens: int) -> Optional[dict]:
+        """保留消息首尾、省略中间，使其 token 数不超过 target_tokens；预算不足以保留任何内容时返回 None"""
+        content = message["content"]
+        available = target_tokens - self.message_overhead - self.count_tokens(COLLAPSE_MARKER.format(len(content)))
+        if available <= 0:
+            return None
+
+        # 按 token/字符 比例估算保留的字符数，超出时逐步收缩
+        ratio = available / max(1, self.count_tokens(content))
+        keep = int(len(content) * ratio)
+        while keep > 0:
+            head, tail = content[:keep - keep // 2], content[len(content) - keep // 2:]
+            text = head + COLLAPSE_MARKER.format(len(content) - keep) + tail
+            if self.count_tokens(text) + self.message_overhead <= target_tokens:
+                return {**message, "content": text}
+            keep = int(keep * 0.9)
+        return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "max_prompt_tokens": self.max_prompt_tokens,
+                "cached_messages": len(self._counts),
+                "hits": self.hits,
+                "misses": self.misses,
+            }
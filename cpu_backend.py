@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+"""
+CPU 推理后端
+在 config_models.yaml 的模型条目中设置 device: cpu 后，模型以 float32 加载到 CPU，
+线性层做动态 int8 量化（权重 int8、激活在运行时量化），推理线程数由 cpu_threads 指定。
+多轮对话通过连续批处理调度器的会话 KV 缓存复用上一轮的预填充结果，CPU 上预填充开销最大，收益也最明显。
+
+    qwen-1.5b:
+      device: cpu
+      quantization: int8   # none 表示不量化
+      cpu_threads: 16      # 默认为本进程可用的 CPU 数
+
+性能目标（Qwen2.5-1.5B、int8、16 核无加速卡服务器、单路请求）：
+解码不低于 TARGET_TOKENS_PER_SECOND tokens/s，会话后续轮次首 token 不超过 TARGET_FOLLOWUP_TTFT 秒。
+
+用法：
+    python cpu_backend.py bench qwen-1.5b --threads 16
+    python cpu_backend.py bench qwen-1.5b --quantization none --output fp32.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+import warnings
+from typing import List
+
+
+DEVICES = ("cuda", "cpu")
+QUANTIZATIONS = ("int8", "none")
+
+# 交互可用的性能目标，python cpu_backend.py bench 以此判定是否达标
+TARGET_TOKENS_PER_SECOND = 10.0
+TARGET_FOLLOWUP_TTFT = 1.5
+
+# 基准测试的多轮对话（后续轮次依赖会话 KV 缓存）
+BENCH_TURNS = [
+    "我在一家公司工作了三年零四个月，公司以经营困难为由单方面解除劳动合同，没有提前三十天书面通知，"
+    "也没有支付任何补偿。我每月工资八千元，请问我可以主张哪些权利？",
+    "经济补偿和代通知金分别怎么计算？",
+    "如果公司拒绝支付，我应该先申请劳动仲裁还是直接起诉？",
+]
+
+
+def model_device(model_config: dict) -> str:
+    """模型条目的推理设备，未设置时为 cuda"""
+    device = str(model_config.get('device', 'cuda')).lower()
+    if device not in DEVICES:
+        raise ValueError(f"不支持的 device: {device}（可选 {', '.join(DEVICES)}）")
+    return device
+
+
+def is_cpu(model_config: dict) -> bool:
+    return model_device(model_config) == 'cpu'
+
+
+def default_threads() -> int:
+    """本进程可用的 CPU 数（容器中受 cpuset 限制）"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def cpu_chat_args(args: dict) -> dict:
+    """CPU 模型的 ChatModel 参数：以 float32 加载（CPU 上半精度矩阵乘较慢，且动态量化需要 float32 权重）"""
+    return dict(args, infer_dtype="float32")
+
+
+def quantize_int8(model):
+    """对模型中的全部线性层做动态 int8 量化（原地替换），返回模型"""
+    import torch
+
+    with warnings.catch_warnings():
+        # torch.ao.quantization 已标记弃用，但仍是无额外依赖的 CPU int8 方案
+        warnings.simplefilter("ignore")
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def quantized_weight_bytes(model) -> int:
+    """动态量化线性层的 int8 权重字节数（量化后的权重不在 parameters() 中）"""
+    try:
+        from torch.ao.nn.quantized.dynamic import Linear as QuantizedLinear
+    except ImportError:
+        return 0
+    total = 0
+    for module in model.modules():
+        if isinstance(module, QuantizedLinear):
+            weight = module.weight()
+            total += weight.numel() * weight.element_size()
+    return total
+
+
+def prepare_cpu_model(chat_model, model_config: dict) -> str:
+    """
+    将已加载的 ChatModel 调整为 CPU 推理：设置线程数，必要时移到 CPU 并转为 float32，再按配置量化
+
+    torch 的线程数是进程级设置，同一进程中的其他模型也会使用该值。返回描述文本用于日志。
+    """
+    import torch
+
+    threads = int(model_config.get('cpu_threads') or default_threads())
+    quantization = str(model_config.get('quantization', 'int8')).lower()
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"不支持的 quantization: {quantization}（可选 {', '.join(QUANTIZATIONS)}）")
+
+    torch.set_num_threads(threads)
+    model = chat_model.engine.model
+    param = next(model.parameters())
+    # 有 GPU 的机器上 llamafactory 会先把模型放到 GPU
+    if param.device.type != 'cpu' or param.dtype != torch.float32:
+        model.to(device='cpu', dtype=torch.float32)
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+    model.eval()
+    if quantization == 'int8':
+        quantize_int8(model)
+    return f"CPU 推理: {threads} 线程，量化 {quantization}"
+
+
+# ----------------------------------------------------------------------
+# 基准测试
+# ----------------------------------------------------------------------
+
+async def _bench_turns(scheduler, tokenizer, turns: List[str], max_new_tokens: int, session_id: str) -> List[dict]:
+    """以同一会话依次发送各轮问题，记录每轮的提示长度、复用的缓存长度、首 token 延迟与解码速度"""
+    messages = []
+    results = []
+    for question in turns:
+        messages.append({"role": "user", "content": question})
+        reused_before = scheduler.kv_store.reused_tokens
+        prompt_tokens = len(scheduler.encode_prompt(messages, None))
+
+        start = time.perf_counter()
+        first = None
+        pieces = []
+        async for piece in scheduler.astream_chat(
+            messages, session_id=session_id, max_new_tokens=max_new_tokens, temperature=0.0
+        ):
+            if first is None:
+                first = time.perf_counter()
+            pieces.append(piece)
+        end = time.perf_counter()
+
+        reply = "".join(pieces)
+        messages.append({"role": "assistant", "content": reply})
+        tokens = len(tokenizer.encode(reply, add_special_tokens=False))
+        ttft = (first or end) - start
+        results.append({
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": scheduler.kv_store.reused_tokens - reused_before,
+            "new_tokens": tokens,
+            "ttft": round(ttft, 3),
+            "tokens_per_second": round((tokens - 1) / (end - first), 2) if first and tokens > 1 and end > first else None,
+        })
+    return results
+
+
+def bench(args) -> bool:
+    """加载模型并测量 CPU 推理性能，返回是否达到目标"""
+    from batching import BatchScheduler
+    from llamafactory.chat import ChatModel
+    from model_registry import create_chat_model, model_memory_bytes, resolve_model
+    from sessions import KVCacheStore
+    from switch_model import open_merged_cache
+
+    model_id, model_config = resolve_model(args.model)
+    model_config = dict(model_config, device='cpu')
+    if args.threads:
+        model_config['cpu_threads'] = args.threads
+    if args.quantization:
+        model_config['quantization'] = args.quantization
+
+    # 与服务端相同的加载方式（合并权重缓存、float32 加载后量化）
+    start = time.perf_counter()
+    chat_model = create_chat_model(ChatModel, model_config, merged_cache=open_merged_cache())
+    load_seconds = time.perf_counter() - start
+    memory = model_memory_bytes(chat_model)
+    print(f"{model_config.get('name', model_id)}: 加载耗时 {load_seconds:.1f} 秒，"
+          f"权重 {memory / (1 << 30):.2f} GB\n")
+
+    scheduler = BatchScheduler.from_chat_model(chat_model, max_batch_size=1, kv_store=KVCacheStore(1 << 30))
+    scheduler.start()
+    try:
+        # 预热一轮，排除首次调用的初始化开销
+        asyncio.run(_bench_turns(scheduler, chat_model.engine.tokenizer, BENCH_TURNS[:1], 8, "warmup"))
+        turns = asyncio.run(_bench_turns(scheduler, chat_model.engine.tokenizer, BENCH_TURNS, args.new_tokens, "bench"))
+    finally:
+        scheduler.stop()
+
+    print(f"{'轮次':<4}{'提示 token':>12}{'复用缓存':>10}{'生成 token':>12}{'首 token(s)':>14}{'tokens/s':>10}")
+    for i, turn in enumerate(turns, 1):
+        rate = turn['tokens_per_second']
+        print(f"{i:<6}{turn['prompt_tokens']:>12}{turn['cached_tokens']:>12}{turn['new_tokens']:>12}"
+              f"{turn['ttft']:>14.3f}{rate if rate is not None else '-':>12}")
+
+    rates = [turn['tokens_per_second'] for turn in turns if turn['tokens_per_second'] is not None]
+    decode_rate = min(rates) if rates else 0.0
+    followup_ttft = max((turn['ttft'] for turn in turns[1:]), default=0.0)
+    passed = decode_rate >= args.min_tokens_per_second and followup_ttft <= args.max_ttft
+    print(f"\n解码速度（最低）: {decode_rate:.2f} tokens/s（目标 ≥ {args.min_tokens_per_second}）")
+    print(f"后续轮次首 token（最高）: {followup_ttft:.3f} 秒（目标 ≤ {args.max_ttft}）")
+    print("✅ 达到目标" if passed else "❌ 未达到目标")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                "model": model_id,
+                "threads": int(model_config.get('cpu_threads') or default_threads()),
+                "quantization": model_config.get('quantization', 'int8'),
+                "load_seconds": round(load_seconds, 1),
+                "memory_bytes": memory,
+                "turns": turns,
+                "decode_tokens_per_second": decode_rate,
+                "followup_ttft": followup_ttft,
+                "passed": passed,
+            }, f, ensure_ascii=False, indent=2)
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="CPU 推理后端")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="测量 CPU 推理的首 token 延迟与解码速度")
+    bench_parser.add_argument("model", nargs="?", help="模型 ID（默认为 current_model）")
+    bench_parser.add_argument("--threads", type=int, help="推理线程数（默认读取模型配置的 cpu_threads）")
+    bench_parser.add_argument("--quantization", choices=QUANTIZATIONS, help="量化方式（默认读取模型配置）")
+    bench_parser.add_argument("--new-tokens", type=int, default=128, help="每轮最多生成的 token 数")
+    bench_parser.add_argument("--min-tokens-per-second", type=float, default=TARGET_TOKENS_PER_SECOND,
+                              help="解码速度目标")
+    bench_parser.add_argument("--max-ttft", type=float, default=TARGET_FOLLOWUP_TTFT,
+                              help="后续轮次首 token 延迟目标（秒）")
+    bench_parser.add_argument("--output", help="结果 JSON 文件路径")
+
+    args = parser.parse_args()
+    sys.exit(0 if bench(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+#!/usr/bin/env python3
+"""
+大文档法规引用分析
+将任意长度的文本流切成固定大小的块扫描，相邻块重叠 MAX_CITATION_LEN 个字符以识别跨块的引用，
+大输入的各块分发到进程池并行扫描。结果按法规文本去重，只保留出现次数与前若干个位置，
+内存占用与输入大小无关。工作进程异常退出（如被 OOM killer 结束）导致进程池损坏时，
+扫描器换用重建的进程池重新扫描受影响的块。
+"""
+
+import asyncio
+import multiprocessing
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from law_links import LAW_CITATION_RE, MAX_CITATION_LEN, search_url
+
+
+# 每块扫描的字符数
+CHUNK_CHARS = 1 << 20
+
+# 每个法规保留的出现位置数
+MAX_OFFSETS = 16
+
+# 候选命中：(类型, 文本, 在块中的起点, 在块中的终点)
+Candidate = Tuple[str, str, int, int]
+
+
+def scan_block(text: str, limit: int) -> List[Candidate]:
+    """
+    扫描一块文本，返回起点位于 [0, limit) 的命中（在工作进程中执行）
+
+    text 在 limit 之后至少多带 MAX_CITATION_LEN 个字符，起点在 limit 之前的引用都能完整匹配；
+    起点在 limit 之后的引用留给下一块。
+    """
+    candidates = []
+    for match in LAW_CITATION_RE.finditer(text):
+        if match.start() >= limit:
+            break
+        candidates.append((match.lastgroup, match.group(), match.start(), match.end()))
+    return candidates
+
+
+def create_pool(workers: int, start_method: str = "fork") -> Optional[ProcessPoolExecutor]:
+    """
+    创建扫描用的进程池并立即启动全部工作进程
+
+    默认使用 fork 启动，应在加载模型（初始化 CUDA）之前调用；之后重建进程池时
+    进程中已有 CUDA 与多个线程，应使用 spawn。workers 为 0 时返回 None，此时在线程中扫描。
+    """
+    if workers <= 0:
+        return None
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method))
+    # 同时提交 workers 个任务，促使进程池一次性启动全部工作进程
+    for future in [pool.submit(scan_block, "", 0) for _ in range(workers)]:
+        future.result()
+    return pool
+
+
+class ReferenceCounter:
+    """按法规文本去重并计数，保留首次出现的顺序"""
+
+    def __init__(self, max_offsets: int = MAX_OFFSETS):
+        self.max_offsets = max_offsets
+        self.references: "OrderedDict[str, dict]" = OrderedDict()
+        self.occurrences = 0
+
+    def add(self, kind: str, text: str, document, offset: int):
+        entry = self.references.get(text)
+        if entry is None:
+            entry = self.references[text] = {
+                "text": text,
+                "kind": kind,
+                "link": search_url(text),
+                "count": 0,
+                "offsets": [],
+            }
+        entry["count"] += 1
+        if len(entry["offsets"]) < self.max_offsets:
+            entry["offsets"].append({"document": document, "offset": offset})
+        self.occurrences += 1
+
+
+class DocumentScanner:
+    """
+    流式文档扫描器
+
+    feed() 逐段输入文本，end_document() 结束当前文档（之后的偏移量从 0 重新计算）。
+    积累满一块即提交扫描，最多同时扫描 max_pending 块；块的结果按顺序合并，
+    与相邻块重叠而重复识别或被前一个引用覆盖的命中在合并时丢弃。
+    """
+
+    def __init__(
+        self,
+        counter: ReferenceCounter,
+        executor: Optional[Executor] = None,
+        chunk_chars: int = CHUNK_CHARS,
+        max_pending: int = 4,
+        rebuild_executor: Optional[Callable[[Executor], Awaitable[Optional[Executor]]]] = None,
+    ):
+        """
+        Args:
+            counter: 接收去重结果
+            executor: 扫描用的进程池，为空时在线程中扫描
+            chunk_chars: 每块的字符数
+            max_pending: 同时扫描的块数上限
+            rebuild_executor: 进程池损坏时调用，传入损坏的进程池，返回替代的进程池；
+                为空时改为在线程中扫描
+        """
+        self.counter = counter
+        self.executor = executor
+        self.rebuild_executor = rebuild_executor
+        self.chunk_chars = chunk_chars
+        self.max_pending = max(1, max_pending)
+
+        self.documents = 0
+        self.chars = 0
+        self._document = None
+        self._parts: List[str] = []
+        self._buffered = 0
+        self._base = 0          # 缓冲区首字符在当前文档中的偏移
+        self._last_end = 0      # 当前文档中最后一个已确认引用的终点
+        # 排队中的扫描：(文档, 块起点偏移, 块, 块内负责的长度, 执行扫描的进程池, future)
+        self._pending: Deque[Tuple[object, int, str, int, Optional[Executor], asyncio.Future]] = deque()
+
+    def start_document(self, document=None):
+        self._document = document
+
+    async def feed(self, text: str):
+        """输入一段文本"""
+        if not text:
+            return
+        self._parts.append(text)
+        self._buffered += len(text)
+        self.chars += len(text)
+        if self._buffered < self.chunk_chars + MAX_CITATION_LEN:
+            return
+
+        buffer = "".join(self._parts)
+        pos = 0
+        while len(buffer) - pos >= self.chunk_chars + MAX_CITATION_LEN:
+            # 本块负责起点在前 chunk_chars 个字符内的引用，并多带 MAX_CITATION_LEN 个字符
+            await self._submit(buffer[pos:pos + self.chunk_chars + MAX_CITATION_LEN], self.chunk_chars)
+            pos += self.chunk_chars
+            self._base += self.chunk_chars
+        self._parts = [buffer[pos:]]
+        self._buffered = len(buffer) - pos
+
+    async def end_document(self):
+        """扫描当前文档剩余的文本"""
+        buffer = "".join(self._parts)
+        if buffer:
+            await self._submit(buffer, len(buffer))
+        await self._drain(0)
+        self._parts = []
+        self._buffered = 0
+        self._base = 0
+        self._last_end = 0
+        self.documents += 1
+
+    async def _submit(self, block: str, limit: int):
+        await self._drain(self.max_pending - 1)
+        future = await self._scan(block, limit)
+        self._pending.append((self._document, self._base, block, limit, self.executor, future))
+
+    async def _scan(self, block: str, limit: int) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        try:
+            return loop.run_in_executor(self.executor, scan_block, block, limit)
+        except BrokenProcessPool:
+            await self._replace_executor()
+            return loop.run_in_executor(self.executor, scan_block, block, limit)
+
+    async def _replace_executor(self):
+        broken = self.executor
+        self.executor = await self.rebuild_executor(broken) if self.rebuild_executor is not None else None
+
+    async def _drain(self, keep: int):
+        """按提交顺序合并结果，直到排队中的块不超过 keep 个"""
+        while len(self._pending) > keep:
+            document, base, block, limit, executor, future = self._pending.popleft()
+            try:
+                candidates = await future
+            except BrokenProcessPool:
+                # 工作进程异常退出，进程池已不可用：换用新的进程池重新扫描该块
+                # （同一进程池上排队的其他块只需重新提交）
+                if self.executor is executor:
+                    await self._replace_executor()
+                candidates = await (await self._scan(block, limit))
+            for kind, text, start, end in candidates:
+                start += base
+                if start < self._last_end:
+                    continue
+                self._last_end = end + base
+                self.counter.add(kind, text, document, start)
+
+    async def close(self):
+        """放弃尚未合并的扫描"""
+        while self._pending:
+            *_, future = self._pending.popleft()
+            future.cancel()
+
+    def summary(self) -> Dict[str, int]:
+        return {
+            "documents": self.documents,
+            "chars": self.chars,
+            "references": len(self.counter.references),
+            "occurrences": self.counter.occurrences,
+        }
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+模拟推理后端
+与 llamafactory.chat.ChatModel 接口一致的确定性替身，只用 CPU 与 sleep 模拟
+预填充与逐 token 解码的耗时，用于在没有 GPU 的环境中压测服务端。
+"""
+
+import asyncio
+import time
+import zlib
+from dataclasses import dataclass
+from typing import AsyncIterator, Iterator, List, Optional
+
+
+# 模拟回答：内容固定、包含法规引用，按需循环到指定长度（每个字符视为一个 token）
+ANSWERS = [
+    "根据《中华人民共和国刑法》第二十条的规定，为了使国家、公共利益、本人或者他人的人身、"
+    "财产和其他权利免受正在进行的不法侵害，而采取的制止不法侵害的行为，对不法侵害人造成损害的，"
+    "属于正当防卫，不负刑事责任。正当防卫明显超过必要限度造成重大损害的，应当负刑事责任，"
+    "但是应当减轻或者免除处罚。",
+    "依据《中华人民共和国劳动合同法》第四十六条、第四十七条，用人单位依法解除劳动合同的，"
+    "应当向劳动者支付经济补偿。经济补偿按劳动者在本单位工作的年限，每满一年支付一个月工资的标准向劳动者支付；"
+    "六个月以上不满一年的，按一年计算；不满六个月的，支付半个月工资的经济补偿。",
+    "《中华人民共和国民法典》第五百七十七条规定，当事人一方不履行合同义务或者履行合同义务不符合约定的，"
+    "应当承担继续履行、采取补救措施或者赔偿损失等违约责任。第五百八十四条第一款进一步规定了损失赔偿额的计算方式。",
+]
+
+
+@dataclass
+class Response:
+    """字段与 llamafactory.chat.base_engine.Response 一致"""
+    response_text: str
+    response_length: int
+    prompt_length: int
+    finish_reason: str
+
+
+class FakeChatModel:
+    """
+    模拟 ChatModel
+
+    输出由提示内容决定（相同请求得到相同回答），耗时为
+    prefill_delay × 提示字符数 + token_delay × 生成 token 数。
+    max_parallel 大于 0 时最多同时生成 max_parallel 个请求，模拟单卡的算力上限。
+    """
+
+    def __init__(
+        self,
+        args: Optional[dict] = None,
+        token_delay: float = 0.02,
+        prefill_delay: float = 0.0002,
+        response_tokens: int = 128,
+        max_parallel: int = 0,
+    ):
+        """
+        Args:
+            args: ChatModel 参数（忽略，仅为保持接口一致）
+            token_delay: 每个生成 token 的耗时（秒）
+            prefill_delay: 每个提示字符的预填充耗时（秒）
+            response_tokens: 默认生成的 token 数（不超过请求的 max_new_tokens）
+            max_parallel: 同时生成的请求数上限，0 表示不限制
+        """
+        self.args = args or {}
+        self.token_delay = token_delay
+        self.prefill_delay = prefill_delay
+        self.response_tokens = response_tokens
+        self.max_parallel = max_parallel
+        self._semaphore: Optional[asyncio.Semaphore] = None
+
+    def _answer(self, messages: List[dict], max_new_tokens: Optional[int]) -> str:
+        prompt = "".join(m["content"] for m in messages)
+        answer = ANSWERS[zlib.crc32(prompt.encode("utf-8")) % len(ANSWERS)]
+        length = min(self.response_tokens, max_new_tokens or self.response_tokens)
+        return (answer * (length // len(answer) + 1))[:length]
+
+    def _prefill_seconds(self, messages: List[dict], system: Optional[str]) -> float:
+        prompt_length = sum(len(m["content"]) for m in messages) + len(system or "")
+        return prompt_length * self.prefill_delay
+
+    def _slot(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel if self.max_parallel > 0 else 1 << 30)
+        return self._semaphore
+
+    def chat(self, messages: List[dict], system: Optional[str] = None, **input_kwargs) -> List[Response]:
+        text = self._answer(messages, input_kwargs.get("max_new_tokens"))
+        time.sleep(self._prefill_seconds(messages, system) + self.token_delay * len(text))
+        return [Response(text, len(text), sum(len(m["content"]) for m in messages), "stop")]
+
+    def stream_chat(self, messages: List[dict], system: Optional[str] = None, **input_kwargs) -> Iterator[str]:
+        time.sleep(self._prefill_seconds(messages, system))
+        for char in self._answer(messages, input_kwargs.get("max_new_tokens")):
+            time.sleep(self.token_delay)
+            yield char
+
+    async def achat(self, messages: List[dict], system: Optional[str] = None, **input_kwargs) -> List[Response]:
+        text = self._answer(messages, input_kwargs.get("max_new_tokens"))
+        async with self._slot():
+            await asyncio.sleep(self._prefill_seconds(messages, system) + self.token_delay * len(text))
+        return [Response(text, len(text), sum(len(m["content"]) for m in messages), "stop")]
+
+    async def astream_chat(
+        self,
+        messages: List[dict],
+        system: Optional[str] = None,
+        **input_kwargs,
+    ) -> AsyncIterator[str]:
+        text = self._answer(messages, input_kwargs.get("max_new_tokens"))
+        async with self._slot():
+            await asyncio.sleep(self._prefill_seconds(messages, system))
+            # 按绝对时间推进，避免 sleep 误差逐 token 累积
+            start = time.perf_counter()
+            for i, char in enumerate(text, 1):
+                delay = start + i * self.token_delay - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                yield char
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+法规引用识别引擎
+api_server.py 与 app.py 共用的单遍扫描实现
+"""
+
+import re
+from typing import Callable, Iterator, List, NamedTuple, Optional, Set
+
+
+# 中文数字
+CN_NUMERALS = "一二三四五六七八九十百千万零"
+
+# 法规名称最大长度（《》内的字符数），同时限定了回溯范围
+MAX_TITLE_LEN = 60
+
+# 条/款/项序号的最大位数
+MAX_NUMBER_LEN = 12
+
+# 法规名称的结尾关键词
+TITLE_SUFFIXES = ["法", "条例", "规定", "办法", "细则", "解释", "编"]
+
+# 单个引用的最大长度：《 + 名称 + 最长结尾关键词 + 》，第...条 远短于此。
+# 分块扫描时相邻块重叠该长度，保证跨块的引用被完整识别
+MAX_CITATION_LEN = MAX_TITLE_LEN + max(len(suffix) for suffix in TITLE_SUFFIXES) + 2
+
+_NUMBER = f"(?:[{CN_NUMERALS}]{{1,{MAX_NUMBER_LEN}}}|[0-9]{{1,{MAX_NUMBER_LEN}}})"
+
+# 所有规则合并为一个带命名分组的正则，一次扫描即可找出全部引用。
+# 《》内不允许再出现《，保证每个位置最多向后扫描 MAX_TITLE_LEN 个字符。
+LAW_CITATION_RE = re.compile(
+    f"(?P<law>《[^《》]{{1,{MAX_TITLE_LEN}}}(?:{'|'.join(TITLE_SUFFIXES)})》)"
+    f"|(?P<article>第{_NUMBER}条)"
+    f"|(?P<clause>第{_NUMBER}款)"
+    f"|(?P<item>第{_NUMBER}项)"
+)
+
+
+class LawCitation(NamedTuple):
+    """一次法规引用命中"""
+    kind: str   # law / article / clause / item
+    text: str
+    start: int
+    end: int
+
+
+def search_url(law_text: str) -> str:
+    """生成法规搜索链接（使用百度）"""
+    return f"https://www.baidu.com/s?wd={law_text}"
+
+
+def markdown_link(law_text: str) -> str:
+    """Markdown 格式的超链接（API 使用）"""
+    return f'[{law_text}]({search_url(law_text)})'
+
+
+def html_link(law_text: str) -> str:
+    """HTML 格式的超链接（Gradio 界面使用）"""
+    return (
+        f'<a href="{search_url(law_text)}" target="_blank" '
+        f'style="color: #1E88E5; text-decoration: underline;">{law_text}</a>'
+    )
+
+
+def iter_citations(text: str) -> Iterator[LawCitation]:
+    """按出现顺序逐个返回文本中的法规引用"""
+    for match in LAW_CITATION_RE.finditer(text):
+        yield LawCitation(match.lastgroup, match.group(), match.start(), match.end())
+
+
+def find_citations(text: str, unique: bool = False) -> List[LawCitation]:
+    """
+    单遍扫描提取全部法规引用及其位置
+
+    Args:
+        text: 待扫描文本
+        unique: 为 True 时同一法规文本只保留首次出现
+    """
+    if not unique:
+        return list(iter_citations(text))
+
+    seen = set()
+    citations = []
+    for citation in iter_citations(text):
+        if citation.text not in seen:
+            seen.add(citation.text)
+            citations.append(citation)
+    return citations
+
+
+def add_law_links(
+    text: str,
+    formatter: Callable[[str], str] = markdown_link,
+    unique: bool = True,
+    seen: Optional[Set[str]] = None,
+) -> str:
+    """
+    一次改写为全部法规引用添加超链接
+
+    Args:
+        text: 原始文本
+        formatter: 超链接渲染函数
+        unique: 为 True 时同一法规只在首次出现处添加链接
+        seen: 已添加过链接的法规集合（跨片段复用时传入）
+    """
+    if seen is None:
+        seen = set()
+
+    parts = []
+    last = 0
+    for match in LAW_CITATION_RE.finditer(text):
+        law_text = match.group()
+        if unique:
+            if law_text in seen:
+                continue
+            seen.add(law_text)
+        parts.append(text[last:match.start()])
+        parts.append(formatter(law_text))
+        last = match.end()
+
+    if not parts:
+        return text
+    parts.append(text[last:])
+    return "".join(parts)
+
+
+class StreamingLawLinker:
+    """
+    流式法规超链接标注器
+
+    每次输入一个 token，只保留末尾可能仍未完成的《...》或 第...条 片段，
+    其余部分立即标注并输出，结束时无需对全文重新扫描。
+    """
+
+    def __init__(self, formatter: Callable[[str], str] = markdown_link, unique: bool = True):
+        self.formatter = formatter
+        self.unique = unique
+        self._seen: Set[str] = set()
+        self._pending = ""
+
+    @property
+    def pending(self) -> str:
+        """尚未确定的末尾文本（原样）"""
+        return self._pending
+
+    def _holdback_start(self) -> int:
+        """返回末尾待定片段的起始位置，没有待定片段时返回文本长度"""
+        text = self._pending
+        cut = len(text)
+
+        # 《 之后不允许再出现《，因此只有最后一个《可能尚未闭合；
+        # 未闭合片段最长为 《 + 名称 + 结尾关键词，即 MAX_CITATION_LEN - 1
+        title_start = text.rfind("《")
+        if (
+            title_start >= 0
+            and "》" not in text[title_start:]
+            and len(text) - title_start <= MAX_CITATION_LEN - 1
+        ):
+            cut = title_start
+
+        # 第 之后紧跟的数字一直延伸到末尾时，可能是未完成的 第...条/款/项
+        number_start = text.rfind("第")
+        if 0 <= number_start < cut:
+            digits = text[number_start + 1:]
+            if len(digits) <= MAX_NUMBER_LEN and (
+                all(ch in CN_NUMERALS for ch in digits)
+                or all("0" <= ch <= "9" for ch in digits)
+            ):
+                cut = number_start
+
+        return cut
+
+    def _render(self, text: str) -> str:
+        if not text:
+            return ""
+        return add_law_links(text, formatter=self.formatter, unique=self.unique, seen=self._seen)
+
+    def feed(self, token: str) -> str:
+        """输入一个 token，返回已确定并完成标注的片段"""
+        self._pending += token
+        cut = self._holdback_start()
+        ready, self._pending = self._pending[:cut], self._pending[cut:]
+        return self._render(ready)
+
+    def flush(self) -> str:
+        """流结束时输出剩余片段"""
+        ready, self._pending = self._pending, ""
+        return self._render(ready)
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""
+多 LoRA 适配器池
+同一基座模型只加载一次，多个未合并的 LoRA 适配器同时挂载在基座上，
+批次中每一行通过 peft 的 adapter_names 选择各自的适配器，不同适配器的请求可以共用一个批次。
+"""
+
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+
+# peft 混合批次中表示不使用适配器（直接使用基座模型）的名称
+BASE_ADAPTER = "__base__"
+
+
+class LoRAAdapterPool:
+    """
+    LoRA 适配器池
+
+    register() 在请求线程中预读适配器权重到内存；调度器工作线程在序列加入批次时调用
+    acquire() 将其适配器挂载到模型上，序列结束时调用 release()。挂载数超过上限时按 LRU 卸载当前批次未使用的适配器，
+    之后再次使用时从内存中的权重重新挂载，无需读盘。
+    """
+
+    def __init__(self, model, max_adapters: int = 8):
+        """
+        Args:
+            model: 未合并 LoRA 的 transformers 基座模型
+            max_adapters: 同时挂载在模型上的适配器数上限
+        """
+        self.base_model = model
+        self.model = model  # 挂载首个适配器后替换为 PeftModel
+        self.max_adapters = max(1, max_adapters)
+
+        self._staged: Dict[str, tuple] = {}  # 适配器名 -> (PeftConfig, 权重)
+        self._mounted: "OrderedDict[str, None]" = OrderedDict()
+        self._in_use: Dict[str, int] = {}
+        self._discarded = set()
+        self._lock = threading.Lock()
+        self.mounts = 0
+        self.unmounts = 0
+
+    # ------------------------------------------------------------------
+    # 请求线程
+    # ------------------------------------------------------------------
+
+    def register(self, name: str, path: str) -> int:
+        """读取适配器配置与权重（阻塞，可在任意线程调用），返回权重字节数"""
+        from peft import PeftConfig
+        from peft.utils import load_peft_weights
+
+        with self._lock:
+            self._discarded.discard(name)
+            if name in self._staged:
+                return _weights_bytes(self._staged[name][1])
+
+        config = PeftConfig.from_pretrained(path)
+        config.inference_mode = True
+        weights = load_peft_weights(path, device="cpu")
+        with self._lock:
+            self._staged[name] = (config, weights)
+        return _weights_bytes(weights)
+
+    def discard(self, name: str):
+        """不再使用该适配器：工作线程在其空闲时卸载并释放内存中的权重"""
+        with self._lock:
+            self._discarded.add(name)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "registered": len(self._staged),
+                "mounted": list(self._mounted),
+                "max_adapters": self.max_adapters,
+                "mounts": self.mounts,
+                "unmounts": self.unmounts,
+            }
+
+    # ------------------------------------------------------------------
+    # 调度器工作线程
+    # ------------------------------------------------------------------
+
+    def acquire(self, name: Optional[str]):
+        """挂载适配器并登记一条使用它的序列"""
+        if name is not None:
+            self._mount(name)
+            self._in_use[name] = self._in_use.get(name, 0) + 1
+        self._trim(keep={name})
+
+    def release(self, name: Optional[str]):
+        if name is not None:
+            count = self._in_use.get(name, 0) - 1
+            if count > 0:
+                self._in_use[name] = count
+            else:
+                self._in_use.pop(name, None)
+        self._trim()
+
+    def forward(self, names: List[Optional[str]], **kwargs):
+        """按行选择适配器执行一次前向计算"""
+        if self.model is self.base_model:
+            return self.model(**kwargs)
+        adapter_names = [name or BASE_ADAPTER for name in names]
+        return self.model(**kwargs, adapter_names=adapter_names)
+
+    def _mount(self, name: str):
+        if name in self._mounted:
+            self._mounted.move_to_end(name)
+            return
+        with self._lock:
+            if name not in self._staged:
+                raise ValueError(f"LoRA 适配器 '{name}' 未注册")
+            config, weights = self._staged[name]
+
+        from peft import PeftModel
+        from peft.utils import set_peft_model_state_dict
+
+        if self.model is self.base_model:
+            self.model = PeftModel(self.base_model, config, adapter_name=name)
+            self.model.eval()
+        else:
+            self.model.add_adapter(name, config)
+        set_peft_model_state_dict(self.model, weights, adapter_name=name)
+        with self._lock:
+            self._mounted[name] = None
+            self.mounts += 1
+
+    def _unmount(self, name: str):
+        self.model.base_model.delete_adapter(name)
+        with self._lock:
+            self._mounted.pop(name, None)
+            self.unmounts += 1
+        # PeftModel 单独记录当前适配器，删除后需指向仍挂载的适配器
+        if self.model.active_adapter not in self._mounted:
+            self.model.set_adapter(next(iter(self._mounted)))
+
+    def _trim(self, keep: Iterable[str] = ()):
+        """卸载已丢弃的空闲适配器，并按 LRU 将挂载数控制在上限以内"""
+        keep = set(keep)
+        with self._lock:
+            discarded = [name for name in self._discarded if name not in self._in_use]
+        for name in discarded:
+            # PeftModel 至少保留一个适配器，最后一个挂载的适配器留到下次挂载新适配器时卸载
+            if name in self._mounted and len(self._mounted) > 1:
+                self._unmount(name)
+            with self._lock:
+                self._discarded.discard(name)
+                self._staged.pop(name, None)
+
+        idle = [name for name in self._mounted if name not in self._in_use and name not in keep]
+        while len(self._mounted) > self.max_adapters and idle:
+            self._unmount(idle.pop(0))
+
+
+def _weights_bytes(weights: dict) -> int:
+    return sum(t.numel() * t.element_size() for t in weights.values())
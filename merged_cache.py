@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""
+LoRA 合并权重缓存
+将基座模型与 LoRA 适配器合并后的权重以 safetensors 格式保存在磁盘上，之后加载该模型时
+直接读取合并好的权重（内存映射），跳过每次启动与切换模型时重复的加载适配器与合并。
+
+缓存以基座目录与适配器目录中文件内容的哈希为键，任一文件变化（如重新训练）都会生成新的条目。
+大文件的哈希按 (路径, 大小, 修改时间) 记录在缓存目录中，文件未变化时不重复计算。
+缓存总大小超过上限时按最近使用时间淘汰。切换模型前可用 python switch_model.py prebuild 预先合并。
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional
+
+
+# 缓存格式版本，合并方式或目录结构变化时递增，使旧条目失效
+CACHE_FORMAT = 1
+
+META_FILE = "merged.json"
+HASH_MEMO_FILE = "hashes.json"
+
+_HASH_CHUNK = 8 << 20
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def merge_checkpoint(base_path: str, adapter_path: str, output_dir: Path):
+    """加载基座与 LoRA 适配器，合并后以 safetensors 分片保存模型与分词器（阻塞，在 CPU 上进行）"""
+    from peft import PeftModel
+    from transformers import AutoModelForCausalLM, AutoTokenizer
+
+    model = AutoModelForCausalLM.from_pretrained(base_path, torch_dtype="auto", low_cpu_mem_usage=True)
+    model = PeftModel.from_pretrained(model, adapter_path).merge_and_unload()
+    model.save_pretrained(output_dir, safe_serialization=True, max_shard_size="4GB")
+
+    # LLaMA-Factory 训练时会在适配器目录保存分词器（可能含新增的特殊 token），优先使用
+    tokenizer_path = adapter_path if (Path(adapter_path) / "tokenizer_config.json").exists() else base_path
+    AutoTokenizer.from_pretrained(tokenizer_path).save_pretrained(output_dir)
+
+
+class MergedCheckpointCache:
+    """
+    合并权重的磁盘缓存
+
+    每个条目是缓存目录下以键命名的子目录，包含合并后的权重、分词器与 merged.json（来源与最近使用时间）。
+    条目先在临时目录中生成，完成后原子地重命名，多个进程同时构建时只保留先完成的一份。
+    """
+
+    def __init__(self, cache_dir: str, max_bytes: int = 0):
+        """
+        Args:
+            cache_dir: 缓存目录
+            max_bytes: 缓存总大小上限（字节），0 表示不限制
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.builds = 0
+
+    # ------------------------------------------------------------------
+    # 缓存键
+    # ------------------------------------------------------------------
+
+    def _load_memo(self) -> dict:
+        try:
+            with open(self.cache_dir / HASH_MEMO_FILE, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _save_memo(self, memo: dict):
+        tmp = self.cache_dir / f"{HASH_MEMO_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(memo, f)
+        os.replace(tmp, self.cache_dir / HASH_MEMO_FILE)
+
+    def _file_digest(self, path: Path, memo: dict) -> str:
+        stat = path.stat()
+        signature = [stat.st_size, stat.st_mtime_ns]
+        entry = memo.get(str(path))
+        if entry is not None and entry[:2] == signature:
+            return entry[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(_HASH_CHUNK):
+                digest.update(chunk)
+        memo[str(path)] = signature + [digest.hexdigest()]
+        return digest.hexdigest()
+
+    def _tree_digest(self, root: str, memo: dict) -> str:
+        """目录顶层文件（权重、配置与分词器）的内容哈希；checkpoint-* 等子目录不参与加载，不计入"""
+        digest = hashlib.sha256()
+        for path in sorted(Path(root).iterdir()):
+            if path.is_file() and not path.name.startswith("."):
+                digest.update(f"{path.name}\0{self._file_digest(path, memo)}\n".encode("utf-8"))
+        return digest.hexdigest()
+
+    def key(self, model_config: dict) -> str:
+        """由基座与适配器文件内容计算的缓存键"""
+        with self._lock:
+            memo = self._load_memo()
+            before = dict(memo)
+            payload = {
+                "format": CACHE_FORMAT,
+                "base": self._tree_digest(model_config["model_name_or_path"], memo),
+                "adapter": self._tree_digest(model_config["adapter_name_or_path"], memo),
+            }
+            if memo != before:
+                self._save_memo(memo)
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:32]
+
+    # ------------------------------------------------------------------
+    # 查询与构建
+    # ------------------------------------------------------------------
+
+    def _touch(self, path: Path):
+        meta_file = path / META_FILE
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        meta["last_used"] = time.time()
+        tmp = path / f"{META_FILE}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(meta, f, ensure_ascii=False)
+        os.replace(tmp, meta_file)
+
+    def lookup(self, model_config: dict, key: Optional[str] = None) -> Optional[Path]:
+        """返回已缓存的合并权重目录，未缓存时返回 None"""
+        path = self.cache_dir / (key or self.key(model_config))
+        if not (path / META_FILE).exists():
+            return None
+        self._touch(path)
+        self.hits += 1
+        return path
+
+    def build(self, model_config: dict, key: Optional[str] = None) -> Path:
+        """合并并写入缓存，返回合并权重目录"""
+        key = key or self.key(model_config)
+        path = self.cache_dir / key
+        tmp = self.cache_dir / f".{key}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp, ignore_errors=True)
+
+        print(f"正在合并 LoRA 权重: {model_config['adapter_name_or_path']}")
+        start = time.perf_counter()
+        try:
+            merge_checkpoint(model_config["model_name_or_path"], model_config["adapter_name_or_path"], tmp)
+            now = time.time()
+            meta = {
+                "base": model_config["model_name_or_path"],
+                "adapter": model_config["adapter_name_or_path"],
+                "bytes": _dir_size(tmp),
+                "created": now,
+                "last_used": now,
+                "merge_seconds": round(time.perf_counter() - start, 1),
+            }
+            with open(tmp / META_FILE, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            try:
+                os.rename(tmp, path)
+            except OSError:
+                # 其他进程已先完成同一条目
+                if not (path / META_FILE).exists():
+                    raise
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+        self.builds += 1
+        print(f"合并权重已缓存: {path}（耗时 {time.perf_counter() - start:.1f} 秒）")
+        self.evict(keep=key)
+        return path
+
+    def get_or_build(self, model_config: dict) -> Path:
+        """返回合并权重目录，未缓存时先合并"""
+        key = self.key(model_config)
+        path = self.lookup(model_config, key)
+        return path if path is not None else self.build(model_config, key)
+
+    # ------------------------------------------------------------------
+    # 淘汰
+    # ------------------------------------------------------------------
+
+    def entries(self) -> List[dict]:
+        """全部条目，按最近使用时间从旧到新排列"""
+        entries = []
+        for path in self.cache_dir.iterdir():
+            meta_file = path / META_FILE
+            if path.name.startswith(".") or not meta_file.exists():
+                continue
+            try:
+                with open(meta_file, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            entries.append({"key": path.name, **meta})
+        entries.sort(key=lambda entry: entry["last_used"])
+        return entries
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        """按最近使用时间淘汰条目，直到总大小不超过上限，返回淘汰的条目数（已加载的权重不受影响）"""
+        if self.max_bytes <= 0:
+            return 0
+        entries = self.entries()
+        total = sum(entry["bytes"] for entry in entries)
+        evicted = 0
+        for entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry["key"] == keep:
+                continue
+            shutil.rmtree(self.cache_dir / entry["key"], ignore_errors=True)
+            total -= entry["bytes"]
+            evicted += 1
+            print(f"淘汰合并权重缓存: {entry['adapter']}（{entry['bytes'] / (1 << 30):.1f} GB）")
+        return evicted
+
+    def stats(self) -> dict:
+        entries = self.entries()
+        return {
+            "entries": len(entries),
+            "bytes": sum(entry["bytes"] for entry in entries),
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "builds": self.builds,
+        }
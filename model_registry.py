@@ -0,0 +1,635 @@
+#!/usr/bin/env python3
+"""
+模型注册表
+按 config_models.yaml 加载模型。多个模型可同时驻留，请求按模型 ID 选择，
+未加载的模型按需加载，超出内存预算时按 LRU 淘汰最久未使用的模型。
+切换默认模型时后台加载，期间继续使用旧模型，被淘汰的模型排空请求后再释放权重。
+多 LoRA 模式下，基座相同的 LoRA 模型共享一份基座权重，各自的适配器挂载在同一个调度器上。
+"""
+
+import asyncio
+import gc
+import os
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import yaml
+
+from context_window import DEFAULT_MAX_PROMPT_TOKENS, ContextWindow
+from cpu_backend import cpu_chat_args, is_cpu, model_device, prepare_cpu_model, quantized_weight_bytes
+from startup import PhaseTimer
+
+
+# 配置文件路径
+CONFIG_FILE = Path(__file__).parent / "config_models.yaml"
+
+# 配置文件缺失或模型不存在时使用的默认配置
+DEFAULT_MODEL_ID = "qwen-7b"
+DEFAULT_MODEL_CONFIG = {
+    "name": "Qwen2.5-7B-Lawyer",
+    "model_name_or_path": "/workspace/llmexp/LLaMA-Factory/Qwen/Qwen2___5-7B-Instruct",
+    "adapter_name_or_path": "/workspace/llmexp/saves/qwen2.5-7b_lawyer/lora/sft",
+    "template": "Qwen",
+    "finetuning_type": "lora",
+}
+
+
+def read_config(config_file: Path = CONFIG_FILE) -> dict:
+    """读取模型配置文件"""
+    with open(config_file, 'r', encoding='utf-8') as f:
+        return yaml.safe_load(f) or {}
+
+
+def resolve_model(model_id: Optional[str] = None, config_file: Path = CONFIG_FILE) -> Tuple[str, dict]:
+    """
+    查找模型配置
+
+    Args:
+        model_id: 模型 ID，为空时使用配置文件中的 current_model
+
+    Returns:
+        (model_id, 模型配置)；配置文件无法读取时返回默认配置
+    """
+    try:
+        config = read_config(config_file)
+    except Exception as e:
+        print(f"⚠️  警告: 无法加载配置文件，使用默认配置: {e}")
+        return DEFAULT_MODEL_ID, dict(DEFAULT_MODEL_CONFIG)
+
+    models = config.get('models', {})
+    if model_id is None:
+        current_id = config.get('current_model', DEFAULT_MODEL_ID)
+        if current_id not in models:
+            print(f"⚠️  警告: 模型 '{current_id}' 不存在，使用默认配置")
+            return DEFAULT_MODEL_ID, dict(DEFAULT_MODEL_CONFIG)
+        return current_id, models[current_id]
+
+    if model_id not in models:
+        raise KeyError(f"模型 '{model_id}' 不存在")
+    return model_id, models[model_id]
+
+
+def list_model_configs(config_file: Path = CONFIG_FILE) -> Dict[str, dict]:
+    """返回配置文件中的全部模型配置，无法读取时返回空字典"""
+    try:
+        return read_config(config_file).get('models', {}) or {}
+    except Exception:
+        return {}
+
+
+def model_memory_bytes(chat_model) -> int:
+    """统计模型参数与缓冲区占用的字节数，无法统计时返回 0"""
+    try:
+        model = chat_model.engine.model
+        tensors = list(model.parameters()) + list(model.buffers())
+    except Exception:
+        return 0
+    return sum(t.numel() * t.element_size() for t in tensors) + quantized_weight_bytes(model)
+
+
+def build_chat_args(model_config: dict) -> dict:
+    """将模型配置转换为 ChatModel 参数"""
+    return {
+        "model_name_or_path": model_config['model_name_or_path'],
+        "adapter_name_or_path": model_config['adapter_name_or_path'],
+        "template": model_config['template'],
+        "finetuning_type": model_config['finetuning_type'],
+    }
+
+
+def create_chat_model(
+    chat_model_factory: Callable,
+    model_config: dict,
+    timer: Optional[PhaseTimer] = None,
+    merged_cache=None,
+    prefix: str = "",
+):
+    """
+    按模型配置创建 ChatModel：有合并权重缓存时读取合并后的 LoRA 权重，CPU 模型以 float32 加载后量化
+
+    各阶段（merge、weights、quantize）计入 timer，阶段名加上 prefix。
+    """
+    timer = timer or PhaseTimer()
+    args = build_chat_args(model_config)
+    if merged_cache is not None and args['finetuning_type'] == 'lora' and args['adapter_name_or_path']:
+        with timer.phase(prefix + "merge"):
+            merged_path = merged_cache.get_or_build(args)
+        print(f"  - 使用合并权重: {merged_path}")
+        args.update(model_name_or_path=str(merged_path), adapter_name_or_path=None)
+
+    cpu = is_cpu(model_config)
+    if cpu:
+        args = cpu_chat_args(args)
+
+    with timer.phase(prefix + "weights"):
+        chat_model = chat_model_factory(args=args)
+    if cpu:
+        with timer.phase(prefix + "quantize"):
+            print(f"  - {prepare_cpu_model(chat_model, model_config)}")
+    return chat_model
+
+
+class ModelHandle:
+    """
+    一个已加载的模型及其推理入口，记录正在使用它的请求数
+
+    共享基座的 LoRA 模型（adapter 不为空）复用基座的 ChatModel 与调度器，
+    其请求同时计入基座的请求数。
+    """
+
+    def __init__(
+        self,
+        model_id: str,
+        model_config: dict,
+        chat_model,
+        scheduler=None,
+        load_seconds: float = 0.0,
+        memory_bytes: int = 0,
+        adapter: Optional[str] = None,
+        base: Optional["ModelHandle"] = None,
+    ):
+        self.model_id = model_id
+        self.config = model_config
+        self.name = model_config.get('name', model_id)
+        self.chat_model = chat_model
+        self.scheduler = scheduler
+        self.load_seconds = load_seconds
+        self.memory_bytes = memory_bytes
+        self.adapter = adapter
+        self.base = base
+        self.context = ContextWindow.from_chat_model(
+            chat_model, int(model_config.get('max_prompt_tokens', DEFAULT_MAX_PROMPT_TOKENS))
+        )
+        self.loaded_at = time.time()
+        self.last_used = self.loaded_at
+        self.in_flight = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    @property
+    def engine(self):
+        """推理入口：开启批处理时为调度器，否则为 ChatModel"""
+        return self.scheduler if self.scheduler is not None else self.chat_model
+
+    def acquire(self):
+        self.in_flight += 1
+        self.last_used = time.time()
+        self._idle.clear()
+        if self.base is not None:
+            self.base.acquire()
+
+    def release(self):
+        self.in_flight -= 1
+        if self.in_flight <= 0:
+            self.in_flight = 0
+            self._idle.set()
+        if self.base is not None:
+            self.base.release()
+
+    async def drain(self, timeout: Optional[float] = None) -> bool:
+        """等待正在使用该模型的请求全部结束，超时返回 False"""
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        """停止调度器并释放模型权重；共享基座的 LoRA 模型只丢弃自己的适配器"""
+        if self.base is not None:
+            if self.scheduler is not None and self.scheduler.adapters is not None:
+                self.scheduler.adapters.discard(self.adapter)
+            self.base = None
+            self.scheduler = None
+            self.chat_model = None
+            return
+        if self.scheduler is not None:
+            self.scheduler.stop()
+            self.scheduler = None
+        self.chat_model = None
+        gc.collect()
+        try:
+            import torch
+            if torch.cuda.is_available():
+                torch.cuda.empty_cache()
+        except ImportError:
+            pass
+
+    def info(self) -> dict:
+        return {
+            "id": self.model_id,
+            "name": self.name,
+            "base": self.base.name if self.base is not None else None,
+            "device": model_device(self.config),
+            "draft_model": self.config.get('draft_model'),
+            "in_flight": self.in_flight,
+            "memory_bytes": self.memory_bytes,
+            "load_seconds": round(self.load_seconds, 3),
+            "loaded_at": int(self.loaded_at),
+            "last_used": int(self.last_used),
+        }
+
+
+class ModelRegistry:
+    """
+    模型注册表
+
+    resident 按最近使用顺序保存已加载的模型，default_id 是未指定模型的请求使用的模型。
+    请求的模型未加载时按需加载；已加载模型的内存之和超出预算时，
+    淘汰最久未使用的模型（默认模型除外）。被淘汰的模型立即停止接收新请求，
+    正在进行的请求结束后释放权重。
+
+    多 LoRA 模式下，基座模型与对话模板相同的 LoRA 模型共享一个基座（保存在 _bases 中），
+    每个模型只占用其适配器的内存；基座在最后一个使用它的模型被淘汰后释放。
+    """
+
+    def __init__(
+        self,
+        config_file: Path = CONFIG_FILE,
+        scheduler_factory: Optional[Callable] = None,
+        drain_timeout: float = 300.0,
+        memory_budget: int = 0,
+        multi_lora: bool = False,
+        chat_model_factory: Optional[Callable] = None,
+        merged_cache=None,
+    ):
+        """
+        Args:
+            config_file: 模型配置文件
+            scheduler_factory: 以 (ChatModel, 模型配置) 创建调度器的函数，返回 None 表示不使用调度器
+            drain_timeout: 等待被淘汰模型上的请求结束的最长时间（秒）
+            memory_budget: 已加载模型的内存预算（字节），0 表示不限制
+            multi_lora: 是否让基座相同的 LoRA 模型共享基座（调度器需挂载 LoRA 适配器池）
+            chat_model_factory: 以 args 字典创建 ChatModel 的函数，为空时使用 llamafactory 的 ChatModel
+            merged_cache: LoRA 合并权重缓存（MergedCheckpointCache），设置后 LoRA 模型加载合并好的权重
+        """
+        self.config_file = Path(config_file)
+        self.scheduler_factory = scheduler_factory
+        self.drain_timeout = drain_timeout
+        self.memory_budget = memory_budget
+        self.multi_lora = multi_lora
+        self.chat_model_factory = chat_model_factory
+        self.merged_cache = merged_cache
+        self.resident: "OrderedDict[str, ModelHandle]" = OrderedDict()
+        self.default_id: Optional[str] = None
+        self.status = {"phase": "idle", "target": None, "load_seconds": None, "error": None}
+        self._switch_task: Optional[asyncio.Task] = None
+        self._loading: Dict[str, asyncio.Task] = {}
+        self._retiring: Dict[ModelHandle, asyncio.Task] = {}
+        self._load_lock = asyncio.Lock()
+        self._sizes: Dict[str, int] = {}
+        self._bases: Dict[Tuple[str, str], ModelHandle] = {}
+        # 每个模型（或共享基座）最近一次加载的分阶段计时，加载中的模型可据此查看进度
+        self.load_timers: Dict[str, PhaseTimer] = {}
+
+    @property
+    def active(self) -> Optional[ModelHandle]:
+        """默认模型，未加载时为 None"""
+        return self.resident.get(self.default_id) if self.default_id else None
+
+    def memory_used(self) -> int:
+        handles = list(self.resident.values()) + list(self._bases.values())
+        return sum(handle.memory_bytes for handle in handles)
+
+    def _base_key(self, model_config: dict) -> Optional[Tuple[str, str]]:
+        """多 LoRA 模式下返回 LoRA 模型的共享基座标识 (基座路径, 对话模板)，否则返回 None"""
+        if not self.multi_lora or model_config.get('finetuning_type') != 'lora':
+            return None
+        # 量化后的线性层无法挂载适配器，CPU 模型单独加载（适配器在加载时合并）；
+        # 推测解码的目标模型同样单独加载
+        if is_cpu(model_config) or model_config.get('draft_model'):
+            return None
+        if not model_config.get('adapter_name_or_path'):
+            return None
+        return model_config['model_name_or_path'], model_config['template']
+
+    def resolve_id(self, model: str) -> str:
+        """将请求中的模型 ID 或模型名称（不区分大小写）解析为模型 ID，不存在时抛出 KeyError"""
+        if model in self.resident:
+            return model
+        configs = list_model_configs(self.config_file)
+        if model in configs:
+            return model
+        for model_id, model_config in configs.items():
+            if model_config.get('name', '').lower() == model.lower():
+                return model_id
+        for handle in self.resident.values():
+            if handle.name.lower() == model.lower():
+                return handle.model_id
+        raise KeyError(f"模型 '{model}' 不存在")
+
+    def _estimate_bytes(self, size_key: str, model_config: dict) -> int:
+        """加载前估算模型内存：优先使用上次加载的实测值，其次是配置中的 memory_gb"""
+        if size_key in self._sizes:
+            return self._sizes[size_key]
+        return int(float(model_config.get('memory_gb', 0)) * (1 << 30))
+
+    def _load(self, model_id: str, model_config: dict) -> Tuple[object, object, float, int]:
+        """
+        在工作线程中加载模型（阻塞），分阶段计时：
+
+        - import: 首次加载时导入 llamafactory（连带 torch、transformers）
+        - merge: 开启合并权重缓存时查找（未命中时生成）合并好的 LoRA 权重
+        - weights: 创建 ChatModel，读取权重
+        - quantize: CPU 模型（device: cpu）设置线程数并做 int8 量化
+        - draft_*: 配置了 draft_model 时以同样的阶段加载草稿模型
+        - scheduler: 创建调度器（配置了 draft_model 时为推测解码器）
+        """
+        timer = self.load_timers[model_id] = PhaseTimer()
+        print(f"正在加载模型: {model_config.get('name', model_id)}")
+        print(f"  - 基础模型: {model_config['model_name_or_path']}")
+        print(f"  - LoRA 权重: {model_config.get('adapter_name_or_path') or '无'}")
+
+        chat_model_factory = self.chat_model_factory
+        if chat_model_factory is None:
+            with timer.phase("import"):
+                from llamafactory.chat import ChatModel
+            chat_model_factory = ChatModel
+
+        chat_model = create_chat_model(chat_model_factory, model_config, timer, self.merged_cache)
+        memory_bytes = model_memory_bytes(chat_model)
+
+        draft_chat_model = None
+        if model_config.get('draft_model'):
+            draft_id, draft_config = resolve_model(model_config['draft_model'], self.config_file)
+            if draft_config['template'] != model_config['template']:
+                raise ValueError(f"草稿模型 '{draft_id}' 的对话模板与目标模型不同")
+            print(f"  - 草稿模型: {draft_config.get('name', draft_id)}")
+            draft_chat_model = create_chat_model(chat_model_factory, draft_config, timer, self.merged_cache, prefix="draft_")
+            memory_bytes += model_memory_bytes(draft_chat_model)
+
+        scheduler = None
+        if draft_chat_model is not None:
+            with timer.phase("scheduler"):
+                from speculative import DEFAULT_DRAFT_TOKENS, SpeculativeDecoder
+                scheduler = SpeculativeDecoder.from_chat_models(
+                    chat_model, draft_chat_model,
+                    draft_tokens=int(model_config.get('draft_tokens', DEFAULT_DRAFT_TOKENS)),
+                )
+                scheduler.start()
+            print(f"  - 推测解码: 草稿长度 {scheduler.draft_tokens}")
+        elif self.scheduler_factory:
+            with timer.phase("scheduler"):
+                scheduler = self.scheduler_factory(chat_model, model_config)
+        timer.finish()
+        return chat_model, scheduler, timer.elapsed, memory_bytes
+
+    async def _ensure_loaded(self, model_id: str, model_config: dict) -> ModelHandle:
+        """返回已加载的模型；未加载时加载，同一模型的并发请求共用一次加载"""
+        handle = self.resident.get(model_id)
+        if handle is not None:
+            return handle
+        task = self._loading.get(model_id)
+        if task is None:
+            task = asyncio.create_task(self._load_resident(model_id, model_config))
+            self._loading[model_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(model_id, None))
+        # 等待的请求被取消时不中断加载
+        return await asyncio.shield(task)
+
+    async def _load_resident(self, model_id: str, model_config: dict) -> ModelHandle:
+        # 一次只加载一个模型，保证内存统计准确
+        async with self._load_lock:
+            base_key = self._base_key(model_config)
+            if base_key is not None:
+                return await self._load_adapter(model_id, model_config, base_key)
+
+            estimate = self._estimate_bytes(model_id, model_config)
+            self._make_room(estimate, keep=model_id)
+            chat_model, scheduler, load_seconds, memory_bytes = await asyncio.to_thread(
+                self._load, model_id, model_config
+            )
+            handle = ModelHandle(
+                model_id, model_config, chat_model, scheduler, load_seconds,
+                memory_bytes=memory_bytes or estimate,
+            )
+            self._sizes[model_id] = handle.memory_bytes
+            self.resident[model_id] = handle
+            print(f"模型加载完成: {handle.name}（耗时 {load_seconds:.1f} 秒，"
+                  f"占用 {handle.memory_bytes / (1 << 30):.1f} GB）")
+            self._make_room(0, keep=model_id)
+            return handle
+
+    async def _load_adapter(self, model_id: str, model_config: dict, base_key: Tuple[str, str]) -> ModelHandle:
+        """多 LoRA 模式：共享基座未加载时先加载基座，再在基座的适配器池中注册该模型的适配器"""
+        start = time.perf_counter()
+        base = self._bases.get(base_key)
+        if base is None:
+            base_config = dict(model_config, name=Path(base_key[0]).name, adapter_name_or_path=None)
+            estimate = self._estimate_bytes(base_key[0], model_config)
+            self._make_room(estimate, keep=model_id)
+            chat_model, scheduler, load_seconds, memory_bytes = await asyncio.to_thread(
+                self._load, base_config['name'], base_config
+            )
+            base = ModelHandle(
+                base_config['name'], base_config, chat_model, scheduler, load_seconds,
+                memory_bytes=memory_bytes or estimate,
+            )
+            if scheduler is None or scheduler.adapters is None:
+                await asyncio.to_thread(base.close)
+                raise RuntimeError("多 LoRA 模式需要挂载了 LoRA 适配器池的调度器")
+            self._sizes[base_key[0]] = base.memory_bytes
+            self._bases[base_key] = base
+            print(f"共享基座加载完成: {base.name}（耗时 {load_seconds:.1f} 秒，"
+                  f"占用 {base.memory_bytes / (1 << 30):.1f} GB）")
+
+        adapter_bytes = await asyncio.to_thread(
+            base.scheduler.adapters.register, model_id, model_config['adapter_name_or_path']
+        )
+        handle = ModelHandle(
+            model_id, model_config, base.chat_model, base.scheduler, time.perf_counter() - start,
+            memory_bytes=adapter_bytes, adapter=model_id, base=base,
+        )
+        self.resident[model_id] = handle
+        print(f"LoRA 适配器已注册: {handle.name}（基座 {base.name}，"
+              f"占用 {adapter_bytes / (1 << 20):.1f} MB）")
+        self._make_room(0, keep=model_id)
+        return handle
+
+    def _make_room(self, extra_bytes: int, keep: Optional[str] = None):
+        """按 LRU 淘汰模型，直到已加载模型加上 extra_bytes 不超过内存预算"""
+        if self.memory_budget <= 0:
+            return
+        while self.memory_used() + extra_bytes > self.memory_budget:
+            victim = next(
+                (h for h in self.resident.values() if h.model_id not in (keep, self.default_id)),
+                None,
+            )
+            if victim is None:
+                print(f"⚠️  警告: 已加载模型超出内存预算 "
+                      f"（{(self.memory_used() + extra_bytes) / (1 << 30):.1f} / "
+                      f"{self.memory_budget / (1 << 30):.1f} GB）")
+                return
+            self.evict(victim.model_id)
+
+    def evict(self, model_id: str) -> bool:
+        """卸载模型：立即停止接收新请求，正在进行的请求结束后释放权重"""
+        handle = self.resident.pop(model_id, None)
+        if handle is None:
+            return False
+        print(f"卸载模型: {handle.name}")
+        self._start_retire(handle)
+
+        # 共享基座不再被任何模型使用时一并释放
+        base = handle.base
+        if base is not None and not any(h.base is base for h in self.resident.values()):
+            for base_key, shared in list(self._bases.items()):
+                if shared is base:
+                    del self._bases[base_key]
+                    print(f"卸载共享基座: {base.name}")
+                    self._start_retire(base)
+        return True
+
+    def _start_retire(self, handle: ModelHandle):
+        task = asyncio.create_task(self._retire(handle))
+        self._retiring[handle] = task
+        task.add_done_callback(lambda _: self._retiring.pop(handle, None))
+
+    async def _retire(self, handle: ModelHandle):
+        if not await handle.drain(self.drain_timeout):
+            print(f"⚠️  警告: 模型 {handle.name} 仍有 {handle.in_flight} 个请求未结束，强制释放")
+        await asyncio.to_thread(handle.close)
+        print(f"模型已释放: {handle.name}")
+
+    async def load(self, model_id: Optional[str] = None) -> ModelHandle:
+        """
+        加载模型并设为默认模型
+
+        设置了内存预算时超出预算才淘汰其他模型；未设置预算时切换后卸载原默认模型
+        （状态为 draining，其上的请求结束后释放权重），避免每次热切换都多占一份权重。
+        """
+        model_id, model_config = resolve_model(model_id, self.config_file)
+        self.status = {"phase": "loading", "target": model_id, "load_seconds": None, "error": None}
+
+        try:
+            handle = await self._ensure_loaded(model_id, model_config)
+        except Exception as e:
+            self.status.update(phase="failed", error=str(e))
+            raise
+
+        previous_id, self.default_id = self.default_id, model_id
+        self.resident.move_to_end(model_id)
+        self._make_room(0, keep=model_id)
+
+        previous = self.resident.get(previous_id) if previous_id != model_id else None
+        if self.memory_budget <= 0 and previous is not None:
+            self.status.update(phase="draining", load_seconds=handle.load_seconds)
+            self.evict(previous_id)
+            retiring = [task for retired, task in self._retiring.items() if retired is previous or retired is previous.base]
+            await asyncio.gather(*retiring, return_exceptions=True)
+
+        self.status.update(phase="done", load_seconds=handle.load_seconds)
+        return handle
+
+    def switch(self, model_id: str) -> dict:
+        """在后台切换默认模型，立即返回切换状态"""
+        resolve_model(model_id, self.config_file)  # 模型不存在时抛出 KeyError
+        if self._switch_task is not None and not self._switch_task.done():
+            raise RuntimeError(f"正在切换到模型 '{self.status['target']}'，请稍后再试")
+        self.status = {"phase": "loading", "target": model_id, "load_seconds": None, "error": None}
+        self._switch_task = asyncio.create_task(self._switch(model_id))
+        return dict(self.status)
+
+    async def _switch(self, model_id: str):
+        try:
+            await self.load(model_id)
+        except Exception as e:
+            print(f"模型切换失败: {e}")
+
+    async def acquire(self, model_id: Optional[str] = None) -> ModelHandle:
+        """
+        获取模型并登记一个正在进行的请求，使用完毕后调用 handle.release()
+
+        model_id 为空时使用默认模型；指定的模型未加载时按需加载，不存在时抛出 KeyError
+        """
+        if model_id is None:
+            handle = self.active
+            if handle is None:
+                raise RuntimeError("模型未加载完成")
+        else:
+            model_id = self.resolve_id(model_id)
+            # 加载完成到登记请求之间模型可能已被淘汰，此时重新加载
+            while (handle := self.resident.get(model_id)) is None:
+                _, model_config = resolve_model(model_id, self.config_file)
+                await self._ensure_loaded(model_id, model_config)
+        self.resident.move_to_end(handle.model_id)
+        handle.acquire()
+        return handle
+
+    def list_models(self) -> List[dict]:
+        """列出配置中的全部模型及其驻留状态"""
+        configs = list_model_configs(self.config_file)
+        model_ids = list(configs) + [model_id for model_id in self.resident if model_id not in configs]
+        models = []
+        for model_id in model_ids:
+            handle = self.resident.get(model_id)
+            model_config = handle.config if handle is not None else configs[model_id]
+            if handle is not None:
+                state = "loaded"
+            elif model_id in self._loading:
+                state = "loading"
+            else:
+                state = "unloaded"
+            models.append({
+                "id": model_id,
+                "name": model_config.get('name', model_id),
+                "status": state,
+                "default": model_id == self.default_id,
+                "base": handle.base.name if handle is not None and handle.base is not None else None,
+                "memory_bytes": handle.memory_bytes if handle is not None else self._estimate_bytes(model_id, model_config),
+                "in_flight": handle.in_flight if handle is not None else 0,
+                "last_used": int(handle.last_used) if handle is not None else None,
+            })
+        return models
+
+    def memory_stats(self) -> dict:
+        return {
+            "budget_bytes": self.memory_budget,
+            "used_bytes": self.memory_used(),
+            "resident": list(self.resident),
+        }
+
+    async def watch_config(self, interval: float):
+        """轮询配置文件，current_model 变化时自动切换默认模型"""
+        last_mtime = self._mtime()
+        while True:
+            await asyncio.sleep(interval)
+            mtime = self._mtime()
+            if mtime == last_mtime:
+                continue
+            last_mtime = mtime
+            try:
+                current_id = read_config(self.config_file).get('current_model')
+            except Exception as e:
+                print(f"⚠️  警告: 无法读取配置文件: {e}")
+                continue
+            busy = self._switch_task is not None and not self._switch_task.done()
+            if current_id and self.default_id is not None and current_id != self.default_id and not busy:
+                print(f"检测到配置文件变化，切换模型: {current_id}")
+                try:
+                    self.switch(current_id)
+                except Exception as e:
+                    print(f"模型切换失败: {e}")
+
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self.config_file).st_mtime
+        except OSError:
+            return None
+
+    async def close(self):
+        """关闭时释放全部模型"""
+        if self._switch_task is not None and not self._switch_task.done():
+            self._switch_task.cancel()
+        for task in list(self._retiring.values()):
+            task.cancel()
+        # 先丢弃共享基座上的适配器，再释放基座
+        handles = list(self.resident.values()) + list(self._retiring) + list(self._bases.values())
+        handles.sort(key=lambda handle: handle.base is None)
+        self.resident.clear()
+        self._bases.clear()
+        self.default_id = None
+        for handle in handles:
+            await asyncio.to_thread(handle.close)
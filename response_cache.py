@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+回复缓存
+两级缓存：进程内 LRU（带 TTL） + 多个 worker 共享的 SQLite 磁盘缓存
+"""
+
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def make_cache_key(messages: List[dict], model_id: str, **sampling) -> str:
+    """根据规范化后的消息列表、模型 ID 与采样参数生成缓存键"""
+    payload = {
+        "model": model_id,
+        "messages": [[m["role"], normalize_text(m["content"])] for m in messages],
+        "sampling": sampling,
+    }
+    raw = json.dumps(payload, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class MemoryLRU:
+    """进程内 LRU 缓存，条目超过 TTL 后失效"""
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 86400):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def put(self, key: str, value: dict, expires_at: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (expires_at or time.time() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SQLiteTier:
+    """SQLite 磁盘缓存，WAL 模式下可被多个 worker 进程共享"""
+
+    def __init__(self, path: str, ttl: float = 86400):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        conn = self._connect()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+        )
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Optional[tuple]:
+        """返回 (expires_at, value)，不存在或已过期时返回 None"""
+        row = self._connect().execute(
+            "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return row[1], json.loads(row[0])
+
+    def put(self, key: str, value: dict):
+        conn = self._connect()
+        conn.execute(
+            "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+            (key, json.dumps(value, ensure_ascii=False), time.time() + self.ttl),
+        )
+        conn.commit()
+
+    def purge_expired(self) -> int:
+        """删除已过期的条目"""
+        conn = self._connect()
+        cursor = conn.execute("DELETE FROM responses WHERE expires_at < ?", (time.time(),))
+        conn.commit()
+        return cursor.rowcount
+
+
+class ResponseCache:
+    """两级回复缓存，统计各级命中与未命中次数"""
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 86400,
+        db_path: Optional[str] = None,
+        max_temperature: float = 0.3,
+    ):
+        """
+        Args:
+            max_entries: 内存缓存最大条目数
+            ttl: 缓存有效期（秒）
+            db_path: SQLite 文件路径，为空时只使用内存缓存
+            max_temperature: 只缓存温度不高于该值的请求
+        """
+        self.max_temperature = max_temperature
+        self.memory = MemoryLRU(max_entries=max_entries, ttl=ttl)
+        self.disk = SQLiteTier(db_path, ttl=ttl) if db_path else None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def cacheable(self, temperature: float) -> bool:
+        """只有确定性或低温度的请求才使用缓存"""
+        return temperature <= self.max_temperature
+
+    def get(self, key: str) -> Optional[dict]:
+        value = self.memory.get(key)
+        if value is not None:
+            self.memory_hits += 1
+            return value
+
+        if self.disk is not None:
+            item = self.disk.get(key)
+            if item is not None:
+                expires_at, value = item
+                self.memory.put(key, value, expires_at=expires_at)
+                self.disk_hits += 1
+                return value
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, value: dict):
+        self.memory.put(key, value)
+        if self.disk is not None:
+            self.disk.put(key, value)
+
+    def stats(self) -> dict:
+        """缓存命中统计"""
+        return {
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "bypassed": self.bypassed,
+            "memory_entries": len(self.memory),
+        }
@@ -0,0 +1,442 @@
+#!/usr/bin/env python3
+"""
+法规条文检索
+基于汉字二元组的 BM25 倒排索引，生成回答前检索相关条文注入提示，让模型依据原文作答。
+
+索引按段（segment）存放在磁盘上，每段是一组 .npy 数组（词项、倒排表、文档长度、条文原文），
+以内存映射方式打开，启动时不读入整个索引。新法规以新段追加，同一条文在较新的段中出现时
+旧版本失效；段数超过 MAX_SEGMENTS 时合并为一段。
+
+用法：
+    python retrieval.py build --db data/statutes.sqlite3 --index data/statute_index
+    python retrieval.py add new_statutes.jsonl --index data/statute_index
+    python retrieval.py search "正当防卫的认定条件" --index data/statute_index
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from statutes import StatuteStore, normalize_law_name, parse_article
+
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# 查询最多使用的词项数（按 IDF 取最高的若干个），长问题的常见二元组对排序几乎没有贡献
+MAX_QUERY_TERMS = 32
+
+# 段数超过该值时合并为一段
+MAX_SEGMENTS = 8
+
+# 注入提示的检索结果格式
+GROUNDING_TEMPLATE = "以下是可能相关的法规条文，回答时请优先依据这些条文：\n{passages}\n\n问题：{question}"
+
+MANIFEST = "manifest.json"
+
+_TOKEN_RE = re.compile(r"[㐀-䶿一-鿿]+|[a-z0-9]+")
+
+
+def _word_key(word: str) -> int:
+    """字母数字词的词项编号：最高位置 1，与汉字编号区分"""
+    digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+    return (1 << 63) | (int.from_bytes(digest, "little") >> 1)
+
+
+def tokenize(text: str) -> List[int]:
+    """
+    将文本切分为词项编号
+
+    汉字按相邻二元组切分（单字片段取单字），编号为两个字的码位拼接，无需词典；
+    字母与数字按整词取哈希。
+    """
+    keys = []
+    for run in _TOKEN_RE.findall(unicodedata.normalize("NFKC", text).lower()):
+        if run[0] < "㐀":
+            keys.append(_word_key(run))
+        elif len(run) == 1:
+            keys.append(ord(run) << 21)
+        else:
+            keys.extend((ord(a) << 21) | ord(b) for a, b in zip(run, run[1:]))
+    return keys
+
+
+def format_passage(hit: dict) -> str:
+    return f"《{hit['law']}》第{hit['article']}条：{hit['text']}"
+
+
+def write_segment(path: Path, records: Iterable[dict]) -> int:
+    """
+    将条文记录写为一个索引段，返回条文数
+
+    倒排表按 (词项, 文档) 排序，offsets[i]:offsets[i+1] 为第 i 个词项的倒排区间。
+    """
+    docs = []
+    text_offsets = array("Q", [0])
+    lengths = array("I")
+    post_keys, post_docs, post_tfs = array("Q"), array("I"), array("H")
+
+    blob = bytearray()
+    for record in records:
+        law = normalize_law_name(record["law"])
+        number = parse_article(record["article"])
+        if not law or number is None:
+            raise ValueError(f"无法识别的条文记录: {record!r}")
+
+        doc = len(docs)
+        docs.append([law, number])
+        blob += record["text"].encode("utf-8")
+        text_offsets.append(len(blob))
+
+        # 法规名称一并索引，问题中提到法规名称时对应条文得分更高
+        tokens = tokenize(f"{law} {record['text']}")
+        lengths.append(len(tokens))
+        counts = {}
+        for key in tokens:
+            counts[key] = counts.get(key, 0) + 1
+        for key, tf in counts.items():
+            post_keys.append(key)
+            post_docs.append(doc)
+            post_tfs.append(min(tf, 65535))
+
+    keys = np.frombuffer(post_keys, dtype=np.uint64) if post_keys else np.zeros(0, np.uint64)
+    doc_ids = np.frombuffer(post_docs, dtype=np.uint32) if post_docs else np.zeros(0, np.uint32)
+    tfs = np.frombuffer(post_tfs, dtype=np.uint16) if post_tfs else np.zeros(0, np.uint16)
+    order = np.lexsort((doc_ids, keys))
+    keys, doc_ids, tfs = keys[order], doc_ids[order], tfs[order]
+    terms, starts = np.unique(keys, return_index=True)
+    offsets = np.append(starts, len(keys)).astype(np.uint64)
+
+    path.mkdir(parents=True, exist_ok=True)
+    np.save(path / "terms.npy", terms)
+    np.save(path / "offsets.npy", offsets)
+    np.save(path / "postings.npy", doc_ids)
+    np.save(path / "tfs.npy", tfs)
+    np.save(path / "lengths.npy", np.array(lengths, dtype=np.uint32))
+    np.save(path / "text_offsets.npy", np.array(text_offsets, dtype=np.uint64))
+    (path / "texts.bin").write_bytes(bytes(blob))
+    with open(path / "docs.json", "w", encoding="utf-8") as f:
+        json.dump(docs, f, ensure_ascii=False)
+    return len(docs)
+
+
+class Segment:
+    """以内存映射方式打开的索引段"""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.terms = np.load(path / "terms.npy", mmap_mode="r")
+        self.offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self.postings = np.load(path / "postings.npy", mmap_mode="r")
+        self.tfs = np.load(path / "tfs.npy", mmap_mode="r")
+        self.lengths = np.load(path / "lengths.npy", mmap_mode="r")
+        self.text_offsets = np.load(path / "text_offsets.npy", mmap_mode="r")
+        self.texts = np.memmap(path / "texts.bin", dtype=np.uint8, mode="r") if self.text_offsets[-1] else b""
+        with open(path / "docs.json", "r", encoding="utf-8") as f:
+            self.docs = [tuple(doc) for doc in json.load(f)]
+        # 每个文档的 BM25 长度归一项，由索引在计算全局平均长度后填入；失效文档为 inf
+        self.norms: Optional[np.ndarray] = None
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def text(self, doc: int) -> str:
+        start, end = int(self.text_offsets[doc]), int(self.text_offsets[doc + 1])
+        return bytes(self.texts[start:end]).decode("utf-8")
+
+
+class StatuteIndex:
+    """
+    分段的 BM25 条文索引
+
+    search() 只读取查询词项的倒排区间并以数组运算累加得分，查询耗时与语料规模基本无关。
+    其他进程更新索引（python retrieval.py add）后，下一次查询时自动重新打开。
+    """
+
+    def __init__(self, path: str, max_segments: int = MAX_SEGMENTS):
+        """
+        Args:
+            path: 索引目录
+            max_segments: 段数上限，超过时合并
+        """
+        self.path = Path(path)
+        self.max_segments = max_segments
+        self._lock = threading.Lock()
+        self._manifest_mtime = None
+        self._segments: List[Segment] = []
+        self._live_docs = 0
+        self.queries = 0
+        self._reload()
+
+    # ------------------------------------------------------------------
+    # 加载
+    # ------------------------------------------------------------------
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.path / MANIFEST, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"segments": [], "next": 1}
+
+    def _write_manifest(self, manifest: dict):
+        self.path.mkdir(parents=True, exist_ok=True)
+        tmp = self.path / (MANIFEST + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp, self.path / MANIFEST)
+
+    def _manifest_stat(self):
+        try:
+            return os.stat(self.path / MANIFEST).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _reload(self):
+        """打开清单中的全部段，标记被较新段覆盖的条文，并按全局平均长度计算归一项"""
+        mtime = self._manifest_stat()
+        segments = [Segment(self.path / name) for name in self._read_manifest()["segments"]]
+
+        seen = set()
+        live_masks = []
+        for segment in reversed(segments):
+            live = np.ones(len(segment), dtype=bool)
+            for doc, key in enumerate(segment.docs):
+                if key in seen:
+                    live[doc] = False
+                else:
+                    seen.add(key)
+            live_masks.append(live)
+        live_masks.reverse()
+
+        live_docs = sum(int(live.sum()) for live in live_masks)
+        total_length = sum(int(segment.lengths[live].sum()) for segment, live in zip(segments, live_masks))
+        avg_length = total_length / live_docs if live_docs else 1.0
+        for segment, live in zip(segments, live_masks):
+            norms = BM25_K1 * (1 - BM25_B + BM25_B * np.asarray(segment.lengths, dtype=np.float32) / avg_length)
+            norms[~live] = np.inf
+            segment.norms = norms.astype(np.float32)
+
+        self._segments = segments
+        self._live_docs = live_docs
+        self._manifest_mtime = mtime
+
+    def refresh(self):
+        """清单文件变化时重新打开索引"""
+        if self._manifest_stat() != self._manifest_mtime:
+            with self._lock:
+                if self._manifest_stat() != self._manifest_mtime:
+                    self._reload()
+
+    # ------------------------------------------------------------------
+    # 更新
+    # ------------------------------------------------------------------
+
+    def add(self, records: Iterable[dict]) -> int:
+        """以新段追加条文（同一条文覆盖旧版本），返回追加的条数"""
+        with self._lock:
+            manifest = self._read_manifest()
+            name = f"seg-{manifest['next']:06d}"
+            count = write_segment(self.path / name, records)
+            if count == 0:
+                shutil.rmtree(self.path / name, ignore_errors=True)
+                return 0
+            manifest["segments"].append(name)
+            manifest["next"] += 1
+            self._write_manifest(manifest)
+            self._reload()
+
+        if len(self._segments) > self.max_segments:
+            self.compact()
+        return count
+
+    def rebuild(self, records: Iterable[dict]) -> int:
+        """用给定条文重建整个索引"""
+        with self._lock:
+            return self._replace_all(records)
+
+    def compact(self) -> int:
+        """将全部段合并为一段，丢弃失效的旧版本条文"""
+        with self._lock:
+            segments = self._segments
+
+            def live_records():
+                for segment in segments:
+                    for doc in np.flatnonzero(np.isfinite(segment.norms)):
+                        law, number = segment.docs[doc]
+                        yield {"law": law, "article": number, "text": segment.text(doc)}
+
+            return self._replace_all(live_records())
+
+    def _replace_all(self, records: Iterable[dict]) -> int:
+        manifest = self._read_manifest()
+        old = list(manifest["segments"])
+        name = f"seg-{manifest['next']:06d}"
+        count = write_segment(self.path / name, records)
+        self._write_manifest({"segments": [name], "next": manifest["next"] + 1})
+        self._reload()
+        # 已打开的内存映射在文件删除后仍然有效
+        for segment_name in old:
+            shutil.rmtree(self.path / segment_name, ignore_errors=True)
+        return count
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def search(self, query: str, top_k: int = 3) -> List[dict]:
+        """
+        检索与查询最相关的条文
+
+        Returns:
+            按得分从高到低排列的 [{"law", "article", "text", "score"}]
+        """
+        self.refresh()
+        segments, total = self._segments, self._live_docs
+        keys = np.unique(np.array(tokenize(query), dtype=np.uint64))
+        if total == 0 or top_k <= 0 or len(keys) == 0:
+            return []
+        self.queries += 1
+
+        # 各段中词项的倒排区间与全局文档频率
+        ranges = []
+        df = np.zeros(len(keys), dtype=np.int64)
+        for segment in segments:
+            pos = np.searchsorted(segment.terms, keys)
+            found = pos < len(segment.terms)
+            found[found] = segment.terms[pos[found]] == keys[found]
+            starts = np.where(found, segment.offsets[np.minimum(pos, len(segment.offsets) - 1)], 0).astype(np.int64)
+            ends = np.where(found, segment.offsets[np.minimum(pos + 1, len(segment.offsets) - 1)], 0).astype(np.int64)
+            ranges.append((starts, ends))
+            df += ends - starts
+
+        idf = np.log1p((total - df + 0.5) / (df + 0.5))
+        terms = [i for i in np.argsort(-idf) if df[i] > 0][:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+
+        candidates = []
+        for segment, (starts, ends) in zip(segments, ranges):
+            scores = np.zeros(len(segment), dtype=np.float32)
+            for i in terms:
+                start, end = starts[i], ends[i]
+                if start == end:
+                    continue
+                docs = segment.postings[start:end]
+                tf = segment.tfs[start:end].astype(np.float32)
+                scores[docs] += np.float32(idf[i]) * tf * (BM25_K1 + 1) / (tf + segment.norms[docs])
+            k = min(top_k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            candidates.extend((float(scores[doc]), segment, int(doc)) for doc in best if scores[doc] > 0)
+
+        candidates.sort(key=lambda item: -item[0])
+        hits = []
+        for score, segment, doc in candidates[:top_k]:
+            law, number = segment.docs[doc]
+            hits.append({"law": law, "article": number, "text": segment.text(doc), "score": round(score, 4)})
+        return hits
+
+    def stats(self) -> dict:
+        segments = self._segments
+        return {
+            "segments": len(segments),
+            "passages": self._live_docs,
+            "terms": sum(len(segment.terms) for segment in segments),
+            "queries": self.queries,
+        }
+
+
+def ground_messages(
+    index: StatuteIndex,
+    messages: List[dict],
+    count_tokens: Callable[[str], int],
+    top_k: int = 3,
+    max_tokens: int = 1024,
+) -> Tuple[List[dict], List[dict]]:
+    """
+    以最后一条 user 消息检索条文，注入该消息之前
+
+    按得分依次加入条文，总 token 数不超过 max_tokens（放不下的条文跳过）。
+    不修改传入的消息列表。
+
+    Returns:
+        (送入模型的消息列表, 注入的检索结果)
+    """
+    last = next((i for i in range(len(messages) - 1, -1, -1) if messages[i]["role"] == "user"), None)
+    if last is None:
+        return messages, []
+
+    question = messages[last]["content"]
+    passages, used, budget = [], [], max_tokens
+    for hit in index.search(question, top_k):
+        passage = format_passage(hit)
+        tokens = count_tokens(passage)
+        if tokens > budget:
+            continue
+        budget -= tokens
+        passages.append(passage)
+        used.append(hit)
+    if not passages:
+        return messages, []
+
+    grounded = list(messages)
+    grounded[last] = {
+        **messages[last],
+        "content": GROUNDING_TEMPLATE.format(passages="\n".join(passages), question=question),
+    }
+    return grounded, used
+
+
+def main():
+    parser = argparse.ArgumentParser(description="法规条文检索索引")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="从本地法规库重建索引")
+    build_parser.add_argument("--db", default="data/statutes.sqlite3", help="本地法规库（statutes.py）")
+
+    add_parser = subparsers.add_parser("add", help="从 JSONL 文件增量追加条文（格式同 statutes.py import）")
+    add_parser.add_argument("file", help="JSONL 文件")
+
+    subparsers.add_parser("compact", help="合并全部段")
+
+    search_parser = subparsers.add_parser("search", help="检索条文")
+    search_parser.add_argument("query", help="查询文本")
+    search_parser.add_argument("-k", "--top-k", type=int, default=5, help="返回条数")
+
+    for sub in (build_parser, add_parser, subparsers.choices["compact"], search_parser):
+        sub.add_argument("--index", default="data/statute_index", help="索引目录")
+
+    args = parser.parse_args()
+    index = StatuteIndex(args.index)
+    if args.command == "build":
+        count = index.rebuild(StatuteStore(args.db).iter_articles())
+        print(f"已索引 {count} 条条文: {index.stats()}")
+    elif args.command == "add":
+        with open(args.file, "r", encoding="utf-8") as f:
+            count = index.add(json.loads(line) for line in f if line.strip())
+        print(f"已追加 {count} 条条文: {index.stats()}")
+    elif args.command == "compact":
+        count = index.compact()
+        print(f"已合并为 1 段，共 {count} 条条文")
+    else:
+        started = time.perf_counter()
+        hits = index.search(args.query, args.top_k)
+        print(f"检索耗时 {(time.perf_counter() - started) * 1000:.2f} ms")
+        for hit in hits:
+            print(f"[{hit['score']:.2f}] {format_passage(hit)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+服务端会话
+保存每个会话的消息历史，以及上一轮结束时的 token 前缀与注意力 KV 缓存，
+下一轮只需预填充新增的消息。
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Optional, Sequence, Tuple
+
+
+class SessionStore:
+    """会话消息历史，按 LRU 与 TTL 淘汰"""
+
+    def __init__(self, max_sessions: int = 10000, ttl: float = 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, session_id: str) -> List[dict]:
+        """返回会话的消息历史，不存在或已过期时返回空列表"""
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is None:
+                return []
+            updated_at, messages = item
+            if updated_at + self.ttl < time.time():
+                del self._data[session_id]
+                return []
+            self._data.move_to_end(session_id)
+            return list(messages)
+
+    def save(self, session_id: str, messages: List[dict]):
+        with self._lock:
+            self._data[session_id] = (time.time(), list(messages))
+            self._data.move_to_end(session_id)
+            while len(self._data) > self.max_sessions:
+                self._data.popitem(last=False)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._data.pop(session_id, None) is not None
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+def _kv_bytes(past_key_values) -> int:
+    return sum(k.numel() * k.element_size() + v.numel() * v.element_size() for k, v in past_key_values)
+
+
+class KVCacheStore:
+    """
+    会话 KV 缓存
+
+    每个会话保存一份 (token_ids, ((key, value), ...))，按 LRU 淘汰以满足显存预算。
+    条目在下一轮预填充时被取出，被淘汰的会话回退到完整预填充。
+    tag 标记生成该缓存的 LoRA 适配器，换用其他适配器时缓存不可复用。
+    """
+
+    def __init__(self, max_bytes: int = 2 << 30):
+        self.max_bytes = max_bytes
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+
+    def put(self, session_id: str, token_ids: List[int], past_key_values, tag: Optional[str] = None):
+        size = _kv_bytes(past_key_values)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove(session_id)
+            self._data[session_id] = (token_ids, past_key_values, size, tag)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def pop(self, session_id: str, tag: Optional[str] = None) -> Optional[Tuple[List[int], tuple]]:
+        """取出会话的 (token_ids, KV 缓存)，tag 不一致时丢弃该条目"""
+        with self._lock:
+            item = self._data.get(session_id)
+            if item is not None:
+                self._remove(session_id)
+            if item is None or item[3] != tag:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return item[0], item[1]
+
+    def discard(self, session_id: str):
+        with self._lock:
+            self._remove(session_id)
+
+    def _remove(self, session_id: str):
+        item = self._data.pop(session_id, None)
+        if item is not None:
+            self._bytes -= item[2]
+
+    def stats(self) -> dict:
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "reused_tokens": self.reused_tokens,
+        }
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    """两个 token 序列的最长公共前缀长度"""
+    n = min(len(a), len(b))
+    for i in range(n):
+        if a[i] != b[i]:
+            return i
+    return n
@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+近似问题缓存
+基于汉字 n-gram 的 MinHash + LSH 索引，为措辞略有不同的单轮问题复用历史回答。
+纯 Python 实现，无需外部服务或 GPU。python similar_cache.py 检查内置问题对的匹配结果。
+
+局限：相似度按字面 n-gram 计算，语序调整较大的同义问题（如“劳动合同解除的条件是什么”与
+“解除劳动合同需要什么条件”，相似度约 0.56）在默认阈值 0.8 下不会命中；而只换了主体的问题
+（如“公司可以单方面解除劳动合同吗”与“员工可以……”，相似度约 0.71）字面上反而更接近，
+降低阈值会把它们误判为同一问题。因此主体词（PARTY_TERMS）不同的问题一律不匹配。
+同理，一字之差可能意思相反（“公司有没有权利解除……”与“公司没有权利解除……吗”），
+比较时只去除首尾的客套词与语气词，否定词与“是否/有没有”一类正反问的形式不同时也不匹配。
+
+持久化文件为追加写入的 JSONL：每写入一条问答立即追加一行，进程崩溃也不丢失；
+加载时同一问题（模型、system 相同）以最后一行为准，记录数明显多于条目数时重写压缩。
+"""
+
+import json
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+from response_cache import normalize_text
+
+
+# 比较前去除的口语化前缀与句末语气词（只去除首尾整词，不删除句中的字）
+LEADING_FILLERS = ["请问一下", "请问", "想问一下", "问一下", "请"]
+TRAILING_FILLERS = ["一下", "吗", "呢", "啊", "呀"]
+
+# 否定词，数量不同的问题意思可能相反
+NEGATION_CHARS = "不没未无非别勿"
+
+# 法律问题中的主体词：两个问题出现的主体不同时（如公司与员工、出租人与承租人）视为不同问题
+PARTY_TERMS = [
+    "用人单位", "劳动者", "公司", "单位", "老板", "员工", "职工",
+    "出租人", "承租人", "房东", "租客", "租户", "买方", "卖方", "买家", "卖家",
+    "甲方", "乙方", "原告", "被告", "债权人", "债务人", "出借人", "借款人",
+    "丈夫", "妻子", "父母", "子女", "业主", "物业",
+]
+
+_PARTY_RE = re.compile("|".join(sorted(PARTY_TERMS, key=len, reverse=True)))
+_LEADING_RE = re.compile(f"^(?:{'|'.join(sorted(LEADING_FILLERS, key=len, reverse=True))})+")
+_TRAILING_RE = re.compile(f"(?:{'|'.join(sorted(TRAILING_FILLERS, key=len, reverse=True))})+$")
+_PUNCT_RE = re.compile(r"[\s\W_]+")
+# 正反问：有没有、是不是、能不能、可不可以……与“是否”同义
+_ALTERNATIVE_RE = re.compile(r"是否|(.)[不没]\1")
+
+# MinHash 使用的梅森素数
+_PRIME = (1 << 61) - 1
+
+
+def question_text(text: str) -> str:
+    """规范化问题：去除标点空白与首尾的客套词、语气词"""
+    text = _PUNCT_RE.sub("", normalize_text(text).lower())
+    return _TRAILING_RE.sub("", _LEADING_RE.sub("", text))
+
+
+def shingles(text: str, ngram: int = 2) -> Set[str]:
+    """将问题规范化后切分为汉字 n-gram 集合"""
+    text = question_text(text)
+    if len(text) <= ngram:
+        return {text} if text else set()
+    return {text[i:i + ngram] for i in range(len(text) - ngram + 1)}
+
+
+def parties(text: str) -> Set[str]:
+    """问题中出现的主体词"""
+    return set(_PARTY_RE.findall(normalize_text(text)))
+
+
+def polarity(text: str) -> Tuple[bool, int]:
+    """问题的正反形式：(是否为正反问, 其余否定词个数)，两者都相同的问题才可能同义"""
+    text = question_text(text)
+    alternative = _ALTERNATIVE_RE.search(text) is not None
+    rest = _ALTERNATIVE_RE.sub("", text)
+    return alternative, sum(rest.count(ch) for ch in NEGATION_CHARS)
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class MinHasher:
+    """固定种子的 MinHash 签名生成器"""
+
+    def __init__(self, num_perm: int = 64, seed: int = 1):
+        self.num_perm = num_perm
+        # 线性同余参数由种子确定，保证重启后签名一致
+        state = seed
+        self._params = []
+        for _ in range(num_perm):
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            a = (state >> 3) % (_PRIME - 1) + 1
+            state = (state * 6364136223846793005 + 1442695040888963407) % (1 << 64)
+            b = (state >> 3) % _PRIME
+            self._params.append((a, b))
+
+    def signature(self, items: Set[str]) -> Tuple[int, ...]:
+        hashes = [zlib.crc32(item.encode("utf-8")) for item in items] or [0]
+        return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in self._params)
+
+
+class SimilarQuestionIndex:
+    """
+    近似问题索引
+
+    LSH 分桶召回候选问题，再用 n-gram 集合的 Jaccard 相似度确认，
+    超过阈值时返回已存储的回答。只在模型与 system 提示都相同、主体词与正反形式一致的问答之间匹配；
+    温度高于 max_temperature 的请求不查询也不写入（与回复缓存一致）。同一问题再次写入时替换原条目，
+    条目数超过上限时按 LRU 淘汰。
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.8,
+        max_entries: int = 10000,
+        num_perm: int = 64,
+        bands: int = 16,
+        ngram: int = 2,
+        path: Optional[str] = None,
+        max_temperature: float = 0.3,
+    ):
+        """
+        Args:
+            threshold: 判定为同一问题的最低 Jaccard 相似度
+            max_entries: 最大条目数
+            num_perm: MinHash 签名长度
+            bands: LSH 分段数（num_perm 需能被整除）
+            ngram: 汉字 n-gram 长度
+            path: 持久化文件路径，为空时不持久化
+            max_temperature: 使用索引的最高采样温度
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm 必须能被 bands 整除")
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.ngram = ngram
+        self.path = Path(path) if path else None
+        self.max_temperature = max_temperature
+        self.hasher = MinHasher(num_perm)
+
+        self._entries: "OrderedDict[int, dict]" = OrderedDict()
+        # (规范化问题, 模型, system) -> 条目 ID
+        self._keys: Dict[Tuple[str, str, str], int] = {}
+        # 持久化文件中的记录数，超过条目数两倍时重写
+        self._log_records = 0
+        self._buckets: List[Dict[Tuple[int, ...], Set[int]]] = [{} for _ in range(bands)]
+        self._next_id = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[Tuple[int, ...]]:
+        return [signature[i * self.rows:(i + 1) * self.rows] for i in range(self.bands)]
+
+    def cacheable(self, temperature: float) -> bool:
+        """只有确定性或低温度的回答才写入和复用"""
+        return temperature <= self.max_temperature
+
+    def lookup(self, question: str, model_id: str, system: str = "") -> Optional[dict]:
+        """查找近似问题，返回 {"question", "answer", "similarity"}；未命中时返回 None"""
+        items = shingles(question, self.ngram)
+        if not items:
+            return None
+        signature = self.hasher.signature(items)
+        question_parties = parties(question)
+        question_polarity = polarity(question)
+
+        with self._lock:
+            candidates = set()
+            for band, key in enumerate(self._band_keys(signature)):
+                candidates |= self._buckets[band].get(key, set())
+
+            best_id, best_score = None, 0.0
+            for entry_id in candidates:
+                entry = self._entries[entry_id]
+                if entry["model"] != model_id or entry["system"] != system:
+                    continue
+                if entry["parties"] != question_parties or entry["polarity"] != question_polarity:
+                    continue
+                score = jaccard(items, entry["shingles"])
+                if score > best_score:
+                    best_id, best_score = entry_id, score
+
+            if best_id is None or best_score < self.threshold:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(best_id)
+            self.hits += 1
+            entry = self._entries[best_id]
+            return {"question": entry["question"], "answer": entry["answer"], "similarity": best_score}
+
+    def add(self, question: str, answer: str, model_id: str, system: str = ""):
+        """存储一条问答并追加到持久化文件；同一问题已存在时替换"""
+        record = {"question": question, "answer": answer, "model": model_id, "system": system}
+        with self._lock:
+            if not self._insert(record):
+                return
+            if self.path is not None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._log_records += 1
+                if self._log_records > 2 * max(len(self._entries), 1) + 100:
+                    self._rewrite()
+
+    def _insert(self, record: dict) -> bool:
+        """写入索引（需持有锁），问题为空时返回 False"""
+        question = record["question"]
+        items = shingles(question, self.ngram)
+        if not items:
+            return False
+        signature = self.hasher.signature(items)
+        key = (question_text(question), record["model"], record["system"])
+
+        previous = self._keys.get(key)
+        if previous is not None:
+            self._remove(previous)
+        entry_id = self._next_id
+        self._next_id += 1
+        self._keys[key] = entry_id
+        self._entries[entry_id] = dict(
+            record,
+            key=key,
+            parties=parties(question),
+            polarity=polarity(question),
+            shingles=items,
+            signature=signature,
+        )
+        for band, band_key in enumerate(self._band_keys(signature)):
+            self._buckets[band].setdefault(band_key, set()).add(entry_id)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+        return True
+
+    def _remove(self, entry_id: int):
+        entry = self._entries.pop(entry_id)
+        del self._keys[entry["key"]]
+        for band, key in enumerate(self._band_keys(entry["signature"])):
+            bucket = self._buckets[band].get(key)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band][key]
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._entries)}
+
+    def save(self):
+        """按 LRU 顺序重写持久化文件（原子替换），去除已替换或淘汰的记录"""
+        if self.path is None:
+            return
+        with self._lock:
+            self._rewrite()
+
+    def _rewrite(self):
+        """需持有锁"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for e in self._entries.values():
+                record = {"question": e["question"], "answer": e["answer"], "model": e["model"], "system": e["system"]}
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.path)
+        self._log_records = len(self._entries)
+
+    def load(self):
+        """从持久化文件恢复索引，同一问题以最后一行为准；末行不完整（写入时崩溃）时跳过"""
+        if self.path is None or not self.path.exists():
+            return
+        records = 0
+        with self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    records += 1
+                    self._insert({
+                        "question": record["question"],
+                        "answer": record["answer"],
+                        "model": record["model"],
+                        "system": record.get("system", ""),
+                    })
+            self._log_records = records
+            if records > len(self._entries):
+                self._rewrite()
+
+
+# ----------------------------------------------------------------------
+# 匹配检查
+# ----------------------------------------------------------------------
+
+# (已存储的问题, 新问题, 是否应当命中)
+CHECK_PAIRS = [
+    ("请问公司可以单方面解除劳动合同吗", "公司可以单方面解除劳动合同吗？", True),
+    ("试用期被辞退有没有经济补偿", "请问试用期被辞退有没有经济补偿呢", True),
+    ("公司有没有权利单方面解除劳动合同", "公司没有权利单方面解除劳动合同吗", False),
+    ("加班不给加班费是不是违法", "加班不给加班费不是违法吗", False),
+    ("借款合同有效吗", "借款合同无效吗", False),
+    ("公司可以单方面解除劳动合同吗", "员工可以单方面解除劳动合同吗", False),
+]
+
+
+def check(threshold: float = 0.8) -> bool:
+    """以 CHECK_PAIRS 检查匹配结果：措辞差异应命中，意思相反或主体不同的问题不应命中"""
+    passed = True
+    for stored, asked, expected in CHECK_PAIRS:
+        index = SimilarQuestionIndex(threshold=threshold)
+        index.add(stored, "answer", "model")
+        matched = index.lookup(asked, "model") is not None
+        ok = matched == expected
+        passed = passed and ok
+        score = jaccard(shingles(stored), shingles(asked))
+        print(f"{'通过' if ok else '失败'}  {'应命中' if expected else '不应命中'}  相似度 {score:.2f}  {stored} / {asked}")
+    return passed
+
+
+if __name__ == "__main__":
+    import sys
+
+    sys.exit(0 if check() else 1)
@@ -0,0 +1,391 @@
+#!/usr/bin/env python3
+"""
+推测解码（speculative decoding）
+小模型（草稿模型）先连续生成若干个候选 token，大模型（目标模型）在一次前向中验证全部候选，
+接受与自己分布一致的前缀，并在第一个不一致处给出修正 token。
+贪心解码时输出与目标模型单独解码完全相同；采样时按推测采样的接受规则保证输出分布与目标模型一致。
+
+要求两个模型属于同一系列、使用同一分词器与对话模板（如 Qwen2.5-1.5B 与 Qwen2.5-7B）。
+在 config_models.yaml 的目标模型条目中设置：
+
+    draft_model: qwen-1.5b   # 草稿模型的模型 ID
+    draft_tokens: 4          # 每轮草稿长度
+
+用法：
+    python speculative.py bench qwen-7b-speculative --draft-tokens 2,4,6
+    python speculative.py bench --tiny      # 用随机初始化的小模型在 CPU 上检查正确性
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+from typing import List, Optional, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from batching import BatchScheduler, _Sequence
+
+
+# 默认草稿长度：接受率高时加长可减少目标模型前向次数，接受率低时草稿计算被浪费
+DEFAULT_DRAFT_TOKENS = 4
+
+# 启动时测量目标模型单 token 解码耗时的步数，用于估算加速比
+CALIBRATION_STEPS = 8
+
+
+class SpeculativeDecoder(BatchScheduler):
+    """
+    推测解码器
+
+    接口与 BatchScheduler 相同（achat / astream_chat / stats），可直接作为模型的调度器使用。
+    一次只解码一条序列（推测解码降低的是单请求延迟），其余请求在队列中等待。
+    目标模型的 KV 缓存在每轮验证后裁剪到已接受的长度，草稿模型的 KV 缓存在下一轮开始时裁剪。
+    """
+
+    def __init__(
+        self,
+        model,
+        draft_model,
+        tokenizer,
+        encode_prompt,
+        stop_token_ids,
+        draft_tokens: int = DEFAULT_DRAFT_TOKENS,
+    ):
+        """
+        Args:
+            model: 目标模型
+            draft_model: 草稿模型（与目标模型共用分词器）
+            tokenizer: 分词器
+            encode_prompt: 将 (messages, system) 编码为提示 token 的函数
+            stop_token_ids: 终止 token
+            draft_tokens: 每轮草稿长度
+        """
+        super().__init__(model, tokenizer, encode_prompt, stop_token_ids, max_batch_size=1)
+        self.draft_model = draft_model
+        self.draft_tokens = max(0, draft_tokens)
+        self.draft_device = next(draft_model.parameters()).device
+        # 同系列模型的词表大小可能因对齐填充而不同，只比较共同部分
+        self.vocab_size = min(model.config.vocab_size, draft_model.config.vocab_size)
+
+        self._tokens: List[int] = []
+        self._draft_cache = None
+        self._draft_length = 0
+
+        self.rounds = 0
+        self.drafted = 0
+        self.accepted = 0
+        self.decoded = 0
+        self.decode_seconds = 0.0
+        self.draft_seconds = 0.0
+        self.verify_seconds = 0.0
+        self.target_step_seconds: Optional[float] = None
+
+    @classmethod
+    def from_chat_models(cls, chat_model, draft_chat_model, **kwargs) -> "SpeculativeDecoder":
+        """复用两个 llamafactory ChatModel 已加载的模型，分词器与对话模板取自目标模型"""
+        scheduler = BatchScheduler.from_chat_model(chat_model)
+        return cls(
+            scheduler.model,
+            draft_chat_model.engine.model,
+            scheduler.tokenizer,
+            scheduler.encode_prompt,
+            scheduler.stop_token_ids,
+            **kwargs,
+        )
+
+    def start(self):
+        """测量目标模型单 token 解码耗时后启动工作线程"""
+        if self.target_step_seconds is None:
+            self.target_step_seconds = self.calibrate()
+        super().start()
+
+    def calibrate(self) -> float:
+        """目标模型逐 token 解码一步的耗时（秒，取中位数），作为估算加速比的基准"""
+        timings = []
+        with torch.inference_mode():
+            cache = DynamicCache()
+            outputs = self.model(input_ids=torch.arange(1, 17, device=self.device).unsqueeze(0),
+                                 past_key_values=cache, use_cache=True)
+            token = outputs.logits[:, -1, :self.vocab_size].argmax(dim=-1, keepdim=True)
+            for _ in range(CALIBRATION_STEPS):
+                start = time.perf_counter()
+                outputs = self.model(input_ids=token, past_key_values=cache, use_cache=True)
+                token = outputs.logits[:, -1, :self.vocab_size].argmax(dim=-1, keepdim=True)
+                token.item()  # 等待 GPU 计算完成
+                timings.append(time.perf_counter() - start)
+        timings.sort()
+        return timings[len(timings) // 2]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["speculative"] = {
+            "draft_tokens": self.draft_tokens,
+            "rounds": self.rounds,
+            "drafted_tokens": self.drafted,
+            "accepted_tokens": self.accepted,
+            "acceptance_rate": round(self.accepted / self.drafted, 4) if self.drafted else None,
+            "tokens_per_round": round(self.decoded / self.rounds, 3) if self.rounds else None,
+            "speedup": self.speedup(),
+        }
+        return stats
+
+    def speedup(self) -> Optional[float]:
+        """估算的加速比：目标模型逐 token 解码同样多 token 的耗时 / 实际解码耗时"""
+        if not self.decode_seconds or not self.target_step_seconds:
+            return None
+        return round(self.decoded * self.target_step_seconds / self.decode_seconds, 3)
+
+    # ------------------------------------------------------------------
+    # 工作线程
+    # ------------------------------------------------------------------
+
+    def _reset_batch(self):
+        super()._reset_batch()
+        self._tokens = []
+        self._draft_cache = None
+        self._draft_length = 0
+
+    def _prefill(self, seq: _Sequence):
+        """目标模型预填充提示并生成第一个 token；草稿模型在第一轮起草时再预填充"""
+        outputs = self.model(
+            input_ids=torch.tensor([seq.prompt_ids], device=self.device),
+            past_key_values=DynamicCache(),
+            use_cache=True,
+        )
+        self._cache = outputs.past_key_values
+        self._draft_cache = DynamicCache()
+        self._draft_length = 0
+        self._tokens = list(seq.prompt_ids)
+        self._active.append(seq)
+        token = self._sample(outputs.logits[:, -1, :self.vocab_size], [seq])
+        self._push_tokens(seq, token.tolist())
+
+    def _decode_step(self):
+        """一轮推测解码：起草、验证、接受，至少前进一个 token"""
+        seq = self._active[0]
+        start = time.perf_counter()
+        # 目标模型每轮至少生成一个 token，草稿长度不超过剩余额度
+        budget = min(self.draft_tokens, seq.max_new_tokens - len(seq.generated) - 1)
+        drafts, draft_probs = self._draft(seq, budget)
+        drafted_at = time.perf_counter()
+
+        # 目标模型一次前向验证：输入上一个 token 与全部草稿，得到每个位置的下一个 token 分布
+        length = len(self._tokens)
+        outputs = self.model(
+            input_ids=torch.tensor([self._tokens[-1:] + drafts], device=self.device),
+            past_key_values=self._cache,
+            use_cache=True,
+        )
+        accepted, correction = self._verify(seq, drafts, draft_probs, outputs.logits[0, :, :self.vocab_size])
+        self._cache = outputs.past_key_values
+        self._cache.crop(length + accepted)
+        # 草稿缓存包含 drafts[:-1]，其中被接受的部分下一轮可以复用
+        self._draft_length = min(self._draft_length + max(len(drafts) - 1, 0), length + accepted)
+
+        self.rounds += 1
+        self.drafted += len(drafts)
+        self.accepted += accepted
+        self.decoded += accepted + 1
+        self.draft_seconds += drafted_at - start
+        self.verify_seconds += time.perf_counter() - drafted_at
+        self._push_tokens(seq, drafts[:accepted] + [correction])
+        self.decode_seconds += time.perf_counter() - start
+
+    def _draft(self, seq: _Sequence, count: int) -> Tuple[List[int], List[torch.Tensor]]:
+        """草稿模型自回归生成 count 个候选 token，返回候选与各自的草稿分布"""
+        if count <= 0:
+            return [], []
+
+        # 丢弃上一轮未被接受的草稿，补上新接受的 token
+        self._draft_cache.crop(self._draft_length)
+        input_ids = self._tokens[self._draft_length:]
+        self._draft_length = len(self._tokens)
+
+        drafts, probs = [], []
+        while True:
+            outputs = self.draft_model(
+                input_ids=torch.tensor([input_ids], device=self.draft_device),
+                past_key_values=self._draft_cache,
+                use_cache=True,
+            )
+            self._draft_cache = outputs.past_key_values
+            dist = self._probs(outputs.logits[:, -1, :self.vocab_size], seq)[0]
+            token = int(dist.argmax()) if seq.temperature <= 0 else int(torch.multinomial(dist, 1))
+            drafts.append(token)
+            probs.append(dist.to(self.device))
+            if len(drafts) >= count or token in self.stop_token_ids:
+                return drafts, probs
+            input_ids = [token]
+
+    def _verify(
+        self, seq: _Sequence, drafts: List[int], draft_probs: List[torch.Tensor], logits: torch.Tensor
+    ) -> Tuple[int, int]:
+        """
+        按目标模型的分布逐个检查草稿，返回 (接受的草稿数, 修正或追加的 token)
+
+        贪心解码时草稿与目标模型的 argmax 一致才接受；采样时以 min(1, p/q) 的概率接受，
+        拒绝时从 max(0, p - q) 归一化后的分布中重新采样，全部接受时从最后一个位置的分布追加一个 token。
+        """
+        if seq.temperature <= 0:
+            targets = logits.argmax(dim=-1).tolist()
+            accepted = 0
+            while accepted < len(drafts) and drafts[accepted] == targets[accepted]:
+                accepted += 1
+            return accepted, targets[accepted]
+
+        probs = self._probs(logits, seq)
+        for i, token in enumerate(drafts):
+            p, q = probs[i], draft_probs[i]
+            if torch.rand(()) * q[token] < p[token]:
+                continue
+            residual = (p - q).clamp(min=0)
+            if residual.sum() <= 0:
+                residual = p
+            return i, int(torch.multinomial(residual / residual.sum(), 1))
+        return len(drafts), int(torch.multinomial(probs[len(drafts)], 1))
+
+    def _probs(self, logits: torch.Tensor, seq: _Sequence) -> torch.Tensor:
+        """按序列的 temperature / top_p 得到采样分布（与 BatchScheduler._sample 一致）"""
+        probs = torch.softmax(logits.float() / max(seq.temperature, 1e-5), dim=-1)
+        sorted_probs, sorted_indices = torch.sort(probs, dim=-1, descending=True)
+        cumulative = torch.cumsum(sorted_probs, dim=-1)
+        sorted_probs[(cumulative - sorted_probs) > seq.top_p] = 0.0
+        probs = torch.zeros_like(probs).scatter_(-1, sorted_indices, sorted_probs)
+        return probs / probs.sum(dim=-1, keepdim=True)
+
+    def _push_tokens(self, seq: _Sequence, tokens: List[int]):
+        """依次推送本轮得到的 token，遇到终止 token 或达到长度上限时停止"""
+        for token in tokens:
+            self._tokens.append(token)
+            self._emit([seq], [token])
+            if seq not in self._active:
+                return
+
+
+# ----------------------------------------------------------------------
+# 基准测试
+# ----------------------------------------------------------------------
+
+BENCH_PROMPTS = [
+    "什么是正当防卫？",
+    "劳动合同到期不续签有补偿吗？",
+    "借款合同的诉讼时效是多久？",
+]
+
+
+class ByteTokenizer:
+    """--tiny 模式使用的字节级分词器（token = 字节值 + 1，0 为终止 token）"""
+
+    eos_token_id = 0
+
+    def encode(self, text: str, **kwargs) -> List[int]:
+        return [b + 1 for b in text.encode("utf-8")]
+
+    def decode(self, ids: List[int], skip_special_tokens: bool = True) -> str:
+        return bytes(i - 1 for i in ids if 0 < i <= 256).decode("utf-8", errors="replace")
+
+
+def tiny_models(layers: int = 6, draft_layers: int = 2):
+    """随机初始化的小模型：草稿模型是目标模型的前 draft_layers 层（共用嵌入与输出层）"""
+    from transformers import Qwen2Config, Qwen2ForCausalLM
+
+    torch.manual_seed(0)
+    config = Qwen2Config(
+        vocab_size=257, hidden_size=256, intermediate_size=512, num_hidden_layers=layers,
+        num_attention_heads=4, num_key_value_heads=2, tie_word_embeddings=True,
+    )
+    target = Qwen2ForCausalLM(config).eval()
+    draft = Qwen2ForCausalLM(Qwen2Config(**dict(config.to_dict(), num_hidden_layers=draft_layers))).eval()
+    draft.load_state_dict(target.state_dict(), strict=False)
+    return target, draft
+
+
+def _load_models(model_id: Optional[str]):
+    """加载目标模型与 draft_model 指定的草稿模型，返回 (目标, 草稿, 分词器, 编码函数, 终止 token, 配置)"""
+    from llamafactory.chat import ChatModel
+    from model_registry import create_chat_model, resolve_model
+    from switch_model import open_merged_cache
+
+    model_id, model_config = resolve_model(model_id)
+    if not model_config.get('draft_model'):
+        raise SystemExit(f"❌ 模型 '{model_id}' 没有配置 draft_model")
+    _, draft_config = resolve_model(model_config['draft_model'])
+    # 与服务端相同的加载方式（合并权重缓存、CPU 量化），测得的速度才有参考价值
+    merged_cache = open_merged_cache()
+    chat_model = create_chat_model(ChatModel, model_config, merged_cache=merged_cache)
+    draft_chat_model = create_chat_model(ChatModel, draft_config, merged_cache=merged_cache)
+    scheduler = BatchScheduler.from_chat_model(chat_model)
+    return (scheduler.model, draft_chat_model.engine.model, scheduler.tokenizer,
+            scheduler.encode_prompt, scheduler.stop_token_ids, model_config)
+
+
+async def _generate(engine, prompts: List[str], max_new_tokens: int) -> Tuple[List[str], float]:
+    """贪心依次生成，返回回答与总耗时"""
+    answers = []
+    start = time.perf_counter()
+    for prompt in prompts:
+        response = await engine.achat([{"role": "user", "content": prompt}],
+                                      max_new_tokens=max_new_tokens, temperature=0.0)
+        answers.append(response[0].response_text)
+    return answers, time.perf_counter() - start
+
+
+def bench(args) -> bool:
+    """对比目标模型单独解码与各草稿长度下的推测解码，返回贪心输出是否完全一致"""
+    if args.tiny:
+        target, draft = tiny_models()
+        tokenizer = ByteTokenizer()
+
+        def encode_prompt(messages, system=None):
+            return tokenizer.encode("".join(m["content"] for m in messages))
+
+        stop_token_ids = [tokenizer.eos_token_id]
+        draft_lengths = args.draft_tokens or str(DEFAULT_DRAFT_TOKENS)
+    else:
+        target, draft, tokenizer, encode_prompt, stop_token_ids, model_config = _load_models(args.model)
+        draft_lengths = args.draft_tokens or str(model_config.get('draft_tokens', DEFAULT_DRAFT_TOKENS))
+
+    baseline = BatchScheduler(target, tokenizer, encode_prompt, stop_token_ids, max_batch_size=1)
+    baseline.start()
+    try:
+        expected, baseline_seconds = asyncio.run(_generate(baseline, BENCH_PROMPTS, args.new_tokens))
+    finally:
+        baseline.stop()
+    print(f"目标模型单独解码: {baseline_seconds:.2f} 秒\n")
+    print(f"{'草稿长度':<8}{'耗时(s)':>10}{'实测加速':>10}{'估算加速':>10}{'接受率':>10}{'每轮 token':>12}{'输出一致':>10}")
+
+    identical = True
+    for draft_tokens in (int(n) for n in draft_lengths.split(",")):
+        decoder = SpeculativeDecoder(target, draft, tokenizer, encode_prompt, stop_token_ids, draft_tokens)
+        decoder.start()
+        try:
+            answers, seconds = asyncio.run(_generate(decoder, BENCH_PROMPTS, args.new_tokens))
+        finally:
+            decoder.stop()
+        stats = decoder.stats()["speculative"]
+        same = answers == expected
+        identical = identical and same
+        print(f"{draft_tokens:<12}{seconds:>10.2f}{baseline_seconds / seconds:>12.2f}x"
+              f"{stats['speedup'] or 0:>10.2f}x{stats['acceptance_rate'] or 0:>12.1%}"
+              f"{stats['tokens_per_round'] or 0:>12.2f}{'✅' if same else '❌':>10}")
+    return identical
+
+
+def main():
+    parser = argparse.ArgumentParser(description="推测解码")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    bench_parser = subparsers.add_parser("bench", help="对比推测解码与目标模型单独解码的速度，并检查贪心输出一致")
+    bench_parser.add_argument("model", nargs="?", help="配置了 draft_model 的模型 ID（默认为 current_model）")
+    bench_parser.add_argument("--draft-tokens", help="草稿长度，逗号分隔依次测试（默认读取模型配置）")
+    bench_parser.add_argument("--new-tokens", type=int, default=128, help="每个问题最多生成的 token 数")
+    bench_parser.add_argument("--tiny", action="store_true", help="使用随机初始化的小模型（只需 CPU）")
+
+    args = parser.parse_args()
+    sys.exit(0 if bench(args) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+启动过程计时与导入耗时分析
+PhaseTimer 记录启动与模型加载各阶段的耗时，供 /health/ready 报告加载进度；
+命令行模式以 python -X importtime 导入指定模块，按顶层包汇总导入耗时，找出拖慢启动的依赖。
+
+用法：
+    python startup.py profile api_server
+    python startup.py profile app --top 30
+"""
+
+import argparse
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+
+
+class PhaseTimer:
+    """
+    分阶段计时器
+
+    phase() 依次进入各阶段，snapshot() 返回已完成阶段的耗时与当前阶段已用时间。
+    计时在工作线程中进行时，其他线程可随时读取 snapshot()。
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+        self.current: Optional[str] = None
+        self.error: Optional[str] = None
+        self._current_started = 0.0
+        self._phases: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        with self._lock:
+            self.current = name
+            self._current_started = time.perf_counter()
+        try:
+            yield
+        except BaseException as e:
+            self.error = f"{name}: {e}"
+            self.finish()
+            raise
+        finally:
+            with self._lock:
+                self._phases[name] = time.perf_counter() - self._current_started
+                self.current = None
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            phases = {name: round(seconds, 3) for name, seconds in self._phases.items()}
+            if self.current is not None:
+                phases[self.current] = round(time.perf_counter() - self._current_started, 3)
+            current = self.current
+        return {
+            "phase": current or ("failed" if self.error else "done" if self.finished else "starting"),
+            "elapsed_seconds": round(self.elapsed, 3),
+            "phases": phases,
+            "error": self.error,
+        }
+
+
+def profile_imports(module: str) -> List[Tuple[str, int, int]]:
+    """
+    在子进程中导入模块，返回 [(模块名, 自身耗时 us, 累计耗时 us)]
+
+    每个模块只在首次导入时计时，累计耗时包含它导入的全部子模块。
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        tail = result.stderr.strip().splitlines()[-1:] or ["未知错误"]
+        raise RuntimeError(f"导入 {module} 失败: {tail[0]}")
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def summarize(rows: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """按顶层包汇总自身耗时（us）"""
+    totals: Dict[str, int] = {}
+    for name, self_us, _ in rows:
+        package = name.split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description="启动耗时分析")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    profile_parser = subparsers.add_parser("profile", help="分析导入模块的耗时")
+    profile_parser.add_argument("module", help="模块名，如 api_server 或 app")
+    profile_parser.add_argument("--top", type=int, default=20, help="显示的条数")
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    rows = profile_imports(args.module)
+    wall = time.perf_counter() - started
+    total = sum(self_us for _, self_us, _ in rows)
+
+    print(f"导入 {args.module}: 共 {len(rows)} 个模块，导入耗时 {total / 1e6:.2f} 秒（含解释器启动 {wall:.2f} 秒）\n")
+    print("按顶层包汇总（自身耗时）:")
+    for package, self_us in sorted(summarize(rows).items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1e3:9.1f} ms  {self_us / max(total, 1):6.1%}  {package}")
+
+    print("\n累计耗时最长的模块:")
+    for name, _, cumulative_us in sorted(rows, key=lambda row: -row[2])[:args.top]:
+        print(f"  {cumulative_us / 1e3:9.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python3
+"""
+本地法规库
+按法规名称与条号索引的 SQLite 法规条文库，可从本地导出文件导入，无需联网。
+查询结果缓存在进程内 LRU 中，重复引用的条文在微秒级返回。
+
+导入文件为 JSONL，每行一条条文：
+    {"law": "中华人民共和国刑法", "article": 20, "text": "为了使国家、公共利益……"}
+article 可以是整数或“第二十条”形式；可选 aliases 字段给出法规的其他名称（如简称）。
+
+用法：
+    python statutes.py import statutes.jsonl --db data/statutes.sqlite3
+    python statutes.py lookup 刑法 20 --db data/statutes.sqlite3
+"""
+
+import argparse
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Union
+
+from law_links import CN_NUMERALS
+
+
+# 法规全称的常见前缀，去掉后作为简称登记
+LAW_NAME_PREFIX = "中华人民共和国"
+
+_CN_DIGITS = {"零": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_CN_UNITS = {"十": 10, "百": 100, "千": 1000, "万": 10000}
+
+# 缓存中表示“条文不存在”的标记，避免重复查询库中没有的条文
+_MISSING = object()
+
+
+def parse_number(text: str) -> Optional[int]:
+    """将阿拉伯数字或中文数字（如“二十”“一千二百六十”）转换为整数，无法识别时返回 None"""
+    if text.isdigit():
+        return int(text)
+    if not text or any(ch not in CN_NUMERALS and ch != "两" for ch in text):
+        return None
+
+    total, section, digit = 0, 0, 0
+    for ch in text:
+        if ch in _CN_DIGITS:
+            digit = _CN_DIGITS[ch]
+        elif ch == "万":
+            total += (section + digit) * 10000
+            section, digit = 0, 0
+        else:
+            # “十”开头时省略了“一”
+            section += (digit or 1) * _CN_UNITS[ch]
+            digit = 0
+    return total + section + digit
+
+
+def parse_article(value: Union[int, str]) -> Optional[int]:
+    """将 20、"20"、"第二十条" 等形式的条号转换为整数"""
+    if isinstance(value, int):
+        return value
+    text = str(value).strip()
+    if text.startswith("第"):
+        text = text[1:]
+    if text.endswith("条"):
+        text = text[:-1]
+    return parse_number(text)
+
+
+def normalize_law_name(name: str) -> str:
+    """去掉书名号与空白"""
+    return name.strip().strip("《》").strip()
+
+
+def law_aliases(name: str) -> List[str]:
+    """法规的可查询名称：全称与去掉“中华人民共和国”前缀的简称"""
+    name = normalize_law_name(name)
+    aliases = [name]
+    if name.startswith(LAW_NAME_PREFIX) and len(name) > len(LAW_NAME_PREFIX):
+        aliases.append(name[len(LAW_NAME_PREFIX):])
+    return aliases
+
+
+class StatuteStore:
+    """
+    法规条文库
+
+    SQLite 中的 articles 表以 (法规 ID, 条号) 为主键，law_aliases 表将全称与简称映射到法规 ID。
+    lookup() 先查进程内 LRU，未命中时再查库（结果不存在时同样缓存）。
+    """
+
+    def __init__(self, path: str, cache_size: int = 4096):
+        """
+        Args:
+            path: SQLite 文件路径
+            cache_size: 进程内缓存的条文数上限
+        """
+        self.path = Path(path)
+        self.cache_size = cache_size
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._local = threading.local()
+        self._cache: "OrderedDict[tuple, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        conn = self._connect()
+        conn.executescript(
+            "CREATE TABLE IF NOT EXISTS laws (id INTEGER PRIMARY KEY, name TEXT UNIQUE NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS law_aliases ("
+            "alias TEXT PRIMARY KEY, law_id INTEGER NOT NULL) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS articles ("
+            "law_id INTEGER NOT NULL, number INTEGER NOT NULL, text TEXT NOT NULL,"
+            "PRIMARY KEY (law_id, number)) WITHOUT ROWID;"
+        )
+        conn.commit()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # 导入
+    # ------------------------------------------------------------------
+
+    def import_records(self, records: Iterable[dict]) -> int:
+        """导入条文记录（同一条文重复导入时覆盖），返回导入的条数"""
+        conn = self._connect()
+        law_ids = {}
+        count = 0
+        with conn:
+            for record in records:
+                name = normalize_law_name(record["law"])
+                number = parse_article(record["article"])
+                if not name or number is None:
+                    raise ValueError(f"无法识别的条文记录: {record!r}")
+
+                law_id = law_ids.get(name)
+                if law_id is None:
+                    conn.execute("INSERT OR IGNORE INTO laws (name) VALUES (?)", (name,))
+                    law_id = conn.execute("SELECT id FROM laws WHERE name = ?", (name,)).fetchone()[0]
+                    law_ids[name] = law_id
+                    for alias in law_aliases(name) + [normalize_law_name(a) for a in record.get("aliases", [])]:
+                        conn.execute("INSERT OR REPLACE INTO law_aliases (alias, law_id) VALUES (?, ?)", (alias, law_id))
+
+                conn.execute(
+                    "INSERT OR REPLACE INTO articles (law_id, number, text) VALUES (?, ?, ?)",
+                    (law_id, number, record["text"]),
+                )
+                count += 1
+
+        with self._lock:
+            self._cache.clear()
+        return count
+
+    def import_file(self, path: str) -> int:
+        """从 JSONL 导出文件导入"""
+        def records():
+            with open(path, "r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+
+        return self.import_records(records())
+
+    # ------------------------------------------------------------------
+    # 查询
+    # ------------------------------------------------------------------
+
+    def lookup(self, law: str, number: int) -> Optional[str]:
+        """查询条文内容，法规名称可以是全称、简称或带书名号的引用文本"""
+        key = (normalize_law_name(law), number)
+        with self._lock:
+            value = self._cache.get(key)
+            if value is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return None if value is _MISSING else value
+
+        row = self._connect().execute(
+            "SELECT a.text FROM law_aliases l JOIN articles a ON a.law_id = l.law_id "
+            "WHERE l.alias = ? AND a.number = ?",
+            key,
+        ).fetchone()
+        value = row[0] if row is not None else _MISSING
+
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = value
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return None if value is _MISSING else value
+
+    def iter_articles(self) -> Iterator[dict]:
+        """按法规与条号顺序遍历全部条文（记录格式与导入文件相同）"""
+        rows = self._connect().execute(
+            "SELECT l.name, a.number, a.text FROM articles a JOIN laws l ON l.id = a.law_id "
+            "ORDER BY a.law_id, a.number"
+        )
+        for name, number, text in rows:
+            yield {"law": name, "article": number, "text": text}
+
+    def stats(self) -> dict:
+        conn = self._connect()
+        with self._lock:
+            cached = len(self._cache)
+        return {
+            "laws": conn.execute("SELECT COUNT(*) FROM laws").fetchone()[0],
+            "articles": conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0],
+            "cached": cached,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地法规库")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = subparsers.add_parser("import", help="从 JSONL 导出文件导入条文")
+    import_parser.add_argument("file", help="JSONL 文件")
+
+    lookup_parser = subparsers.add_parser("lookup", help="查询条文")
+    lookup_parser.add_argument("law", help="法规名称（全称或简称）")
+    lookup_parser.add_argument("article", help="条号，如 20 或 第二十条")
+
+    for sub in (import_parser, lookup_parser):
+        sub.add_argument("--db", default="data/statutes.sqlite3", help="SQLite 文件路径")
+
+    args = parser.parse_args()
+    store = StatuteStore(args.db)
+    if args.command == "import":
+        count = store.import_file(args.file)
+        print(f"已导入 {count} 条条文: {store.stats()}")
+    else:
+        text = store.lookup(args.law, parse_article(args.article))
+        print(text if text is not None else "未找到该条文")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,12 +5,18 @@
 """
 
 import argparse
+import json
 import os
 import sys
+import time
+import urllib.error
+import urllib.request
 from pathlib import Path
 
 import yaml
 
+from merged_cache import MergedCheckpointCache
+
 # 配置文件路径
 CONFIG_FILE = Path(__file__).parent / "config_models.yaml"
 APP_PY = Path(__file__).parent / "app.py"
@@ -48,6 +54,10 @@ def list_models():
         print(f"  LoRA 权重: {model_config.get('adapter_name_or_path', '无')}")
         print(f"  模板: {model_config['template']}")
         print(f"  微调类型: {model_config['finetuning_type']}")
+        if model_config.get('device', 'cuda') == 'cpu':
+            print(f"  设备: CPU（{model_config.get('cpu_threads', '全部')} 线程，量化 {model_config.get('quantization', 'int8')}）")
+        if model_config.get('draft_model'):
+            print(f"  推测解码: 草稿模型 {model_config['draft_model']}，草稿长度 {model_config.get('draft_tokens', 4)}")
         print(f"  描述: {model_config['description']}")
 
     print("\n" + "=" * 60)
@@ -55,7 +65,94 @@ def list_models():
     print("=" * 60)
 
 
-def switch_model(model_id):
+def _admin_request(url, token=None, payload=None):
+    """调用 API 服务器的管理接口"""
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["X-Admin-Token"] = token
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, headers=headers, method="POST" if data else "GET")
+    with urllib.request.urlopen(request, timeout=30) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def hot_switch(server, model_id, token=None, timeout=1800):
+    """通知正在运行的 API 服务器热切换模型，并等待切换完成"""
+    url = f"{server.rstrip('/')}/admin/models/switch"
+    start = time.time()
+
+    try:
+        _admin_request(url, token, {"model_id": model_id})
+    except urllib.error.HTTPError as e:
+        print(f"❌ 热切换请求失败: {e.code} {e.read().decode('utf-8', errors='replace')}")
+        sys.exit(1)
+    except urllib.error.URLError as e:
+        print(f"❌ 无法连接 API 服务器 {server}: {e.reason}")
+        sys.exit(1)
+
+    print(f"🔄 服务器正在后台加载 {model_id}，期间继续使用旧模型提供服务...")
+    last_phase = None
+    while time.time() - start < timeout:
+        time.sleep(1)
+        status = _admin_request(url, token)
+        if status["phase"] != last_phase:
+            last_phase = status["phase"]
+            print(f"  - {last_phase}（{time.time() - start:.1f} 秒）")
+        if status["phase"] == "failed":
+            print(f"❌ 模型切换失败: {status.get('error')}")
+            sys.exit(1)
+        if status["phase"] == "done" and status.get("target") == model_id:
+            print("=" * 60)
+            print(f"✅ 热切换完成: {model_id}")
+            print(f"  模型加载耗时: {status['load_seconds']:.1f} 秒")
+            print(f"  总耗时: {time.time() - start:.1f} 秒")
+            print("=" * 60)
+            return
+
+    print(f"❌ 等待超时（{timeout} 秒）")
+    sys.exit(1)
+
+
+def open_merged_cache(cache_dir=None):
+    """打开合并权重缓存（目录默认读取 API_MERGED_CACHE_DIR，上限读取 API_MERGED_CACHE_GB），未配置时返回 None"""
+    cache_dir = cache_dir or os.environ.get("API_MERGED_CACHE_DIR")
+    if not cache_dir:
+        return None
+    return MergedCheckpointCache(cache_dir, int(float(os.environ.get("API_MERGED_CACHE_GB", "64")) * (1 << 30)))
+
+
+def prebuild(model_ids, cache_dir=None):
+    """预先合并模型的 LoRA 权重并写入缓存，之后加载或切换到这些模型时直接读取合并后的权重"""
+    config = load_config()
+    models = config.get('models', {})
+    cache = open_merged_cache(cache_dir)
+    if cache is None:
+        print("❌ 未配置合并权重缓存目录：请设置 API_MERGED_CACHE_DIR 或使用 --cache-dir")
+        sys.exit(1)
+
+    for model_id in model_ids:
+        if model_id not in models:
+            print(f"❌ 错误: 模型 '{model_id}' 不存在")
+            sys.exit(1)
+        model_config = models[model_id]
+        if model_config.get('finetuning_type') != 'lora' or not model_config.get('adapter_name_or_path'):
+            print(f"  - {model_id}: 没有 LoRA 适配器，无需合并")
+            continue
+
+        start = time.time()
+        key = cache.key(model_config)
+        path = cache.lookup(model_config, key)
+        if path is not None:
+            print(f"  - {model_id}: 已缓存（{path}）")
+        else:
+            path = cache.build(model_config, key)
+            print(f"  - {model_id}: 已合并（{path}，耗时 {time.time() - start:.1f} 秒）")
+
+    stats = cache.stats()
+    print(f"缓存: {stats['entries']} 个条目，共 {stats['bytes'] / (1 << 30):.1f} GB")
+
+
+def switch_model(model_id, server=None, token=None, prebuild_cache=False):
     """切换模型"""
     config = load_config()
     models = config.get('models', {})
@@ -65,6 +162,10 @@ def switch_model(model_id):
         print(f"\n可用模型: {', '.join(models.keys())}")
         sys.exit(1)
 
+    # 先合并权重再切换，服务端加载时直接命中缓存
+    if prebuild_cache:
+        prebuild([model_id])
+
     # 更新当前模型
     config['current_model'] = model_id
     save_config(config)
@@ -80,9 +181,15 @@ def switch_model(model_id):
     print(f"  描述: {model_config['description']}")
     print("=" * 60)
     print("\n📝 配置已更新！")
-    print("请重启应用以使用新模型：")
+
+    if server:
+        hot_switch(server, model_id, token)
+        return
+
+    print("请重启应用以使用新模型，或使用 --server 热切换正在运行的 API 服务：")
     print("  ./start.sh gradio   # Gradio 界面")
     print("  ./start.sh api      # API 服务")
+    print(f"  python switch_model.py switch {model_id} --server http://localhost:8000   # 热切换")
 
 
 def add_model(model_id, name, base_model, adapter_path, template="Qwen", finetuning_type="lora", description=""):
@@ -179,6 +286,14 @@ def main():
     # switch 命令
     switch_parser = subparsers.add_parser('switch', help='切换模型')
     switch_parser.add_argument('model_id', help='模型 ID')
+    switch_parser.add_argument('--server', help='正在运行的 API 服务地址（如 http://localhost:8000），指定后不重启直接热切换')
+    switch_parser.add_argument('--token', default=os.environ.get('API_ADMIN_TOKEN'), help='管理令牌（默认读取 API_ADMIN_TOKEN）')
+    switch_parser.add_argument('--prebuild', action='store_true', help='切换前预先合并 LoRA 权重（需设置 API_MERGED_CACHE_DIR）')
+
+    # prebuild 命令
+    prebuild_parser = subparsers.add_parser('prebuild', help='预先合并模型的 LoRA 权重并写入缓存')
+    prebuild_parser.add_argument('model_ids', nargs='+', help='模型 ID')
+    prebuild_parser.add_argument('--cache-dir', help='缓存目录（默认读取 API_MERGED_CACHE_DIR）')
 
     # compare 命令
     compare_parser = subparsers.add_parser('compare', help='对比两个模型')
@@ -200,7 +315,9 @@ def main():
     if args.command == 'list':
         list_models()
     elif args.command == 'switch':
-        switch_model(args.model_id)
+        switch_model(args.model_id, args.server, args.token, args.prebuild)
+    elif args.command == 'prebuild':
+        prebuild(args.model_ids, args.cache_dir)
     elif args.command == 'compare':
         compare_models(args.model1, args.model2)
     elif args.command == 'add':